@@ -0,0 +1,55 @@
+""" Time path_sha on a generated tree with a cold and a warm hash index.
+
+    python -m benchmarks.path_sha --files 10000 --size 4096
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from create.hash_index import HashIndex
+from create.utils import path_sha
+
+def make_tree(root, files, size, per_dir = 100):
+    for i in range(files):
+        d = os.path.join(root, "d{:04d}".format(i // per_dir))
+        if not os.path.isdir(d):
+            os.makedirs(d)
+        with open(os.path.join(d, "f{:06d}.txt".format(i)), 'wb') as f:
+            f.write(os.urandom(size))
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print("{:<24} {:8.3f}s".format(label, time.perf_counter() - start))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type = int, default = 10000)
+    parser.add_argument("--size", type = int, default = 4096)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp()
+    try:
+        root = os.path.join(work, "tree")
+        index_path = os.path.join(work, "hash_index.json")
+        make_tree(root, args.files, args.size)
+        print("{} files of {} bytes".format(args.files, args.size))
+
+        cold = timed("cold index", lambda: path_sha(root, index = HashIndex(index_path)))
+        warm = timed("warm index", lambda: path_sha(root, index = HashIndex(index_path)))
+
+        #Touch one file so a single entry is re-hashed
+        changed = os.path.join(root, "d0000", "f000000.txt")
+        with open(changed, 'ab') as f:
+            f.write(b"x")
+        timed("one file changed", lambda: path_sha(root, index = HashIndex(index_path)))
+
+        if cold != warm:
+            raise(RuntimeError("Cold and warm path_sha differ"))
+    finally:
+        shutil.rmtree(work)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+""" Time each stack builder and to_json on generated configs of increasing size.
+
+    python -m benchmarks.render
+    python -m benchmarks.render --compare benchmarks/results/<commit>.json
+
+AWS lookups are served from an empty offline snapshot so no boto call is made.
+A builder that needs one, or fails in any other way, fails the run with a non-zero
+exit and no results file. Results are saved to benchmarks/results/<commit>.json
+so runs on different commits can be compared.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import create.config
+import create.lookups
+import create.stacks
+
+#(name, tcpstacks, app subnets, custom security group rules)
+scenarios = [
+    ("small",  1,   2,   10),
+    ("medium", 10,  10,  100),
+    ("large",  100, 100, 1000),
+    ("xlarge", 500, 100, 1000),
+]
+
+builders = ["resources", "network", "app", "tcpstacks"]
+
+bench_path   = os.path.dirname(os.path.abspath(__file__))
+results_path = os.path.join(bench_path, "results")
+userdata     = os.path.join(bench_path, "..", "examples", "phpinfo.userdata")
+azs          = ["ap-southeast-2a", "ap-southeast-2b", "ap-southeast-2c"]
+
+custom_ports = range(4)
+
+def az_name(i):
+    return "az{}".format(i % len(azs) + 1)
+
+def synthetic_config(tcpstacks, subnets, rules):
+    app_networks = {"az{}{:03d}".format(i % len(azs) + 1, i):"10.0.{}.0/24".format(i) for i in range(subnets)}
+    availability_zones = {k:azs[int(k[2]) - 1] for k in app_networks}
+    availability_zones.update({az_name(i):azs[i] for i in range(len(azs))})
+    #Consecutive /24s each opening the same few ports, as office and partner ranges do. The rules still
+    #have to be compacted to fit under sg_rule_limit, which the network builder times
+    custom_rules = [["10.{}.{}.0/24".format(100 + n // 256, n % 256), str(8080 + i % len(custom_ports)), "ingress"]
+        for i, n in ((i, i // len(custom_ports)) for i in range(rules))]
+
+    stacks = dict()
+    for i in range(tcpstacks):
+        az = az_name(i)
+        stacks["Svc{:03d}".format(i)] = dict(
+            stack_type    = "ec2",
+            enabled       = True,
+            ports         = ["8080"],
+            networks      = {az:"10.{}.{}.0/28".format(1 + i // 256, i % 256)},
+            custom_rules  = [["10.200.0.0/16", "8080", "ingress"]],
+            userdata_file = userdata,
+            instance_size = "t2.small",
+            instances     = dict(node = dict(az = az)),
+        )
+
+    ops = create.config.ConfigOptions()
+    ops.update(dict(
+        app_name         = "Bench",
+        billing_id       = "bench",
+        deploy_bucket    = "bench-bucket",
+        elb_bucket       = "bench-elb-logs",
+        ami_image        = "ami-123",
+        deploy_env       = "bench",
+        aws_region       = "ap-southeast-2",
+        vpc_id           = "vpc-123",
+        igw_id           = "igw-123",
+        ofc_vpn_id       = "vgw-123",
+        vpn_route        = ["1.2.3.4/24"],
+        use_nat_gw       = True,
+        nat_gw_ids       = {k:"nat-123" for k in availability_zones},
+        availability_zones = availability_zones,
+        build_ami        = False,
+        cloudwatch_alarm = False,
+        root_volume_size = "50",
+        SSLCert_arn      = "arn:aws:iam::1234:server-certificate/bench",
+        userdata_file    = userdata,
+        install_packages = ["httpd"],
+        userdata_exports = dict(APP_NAME = "app_name"),
+        userdata_values  = dict(VAR1 = "value1"),
+        cf_params        = dict(
+            InstanceType = dict(name = "InstanceType", desc = "Instance type", default = "t2.micro"),
+            KeyName      = dict(name = "KeyName", desc = "Instance key pair", default = "bench"),
+        ),
+        out_ports        = ["80", "443"],
+        port_map         = dict(HTTPS = ["443", "80"]),
+        public_ips       = ["0.0.0.0/0"],
+        elb_networks     = {az_name(i):"10.1.{}.0/28".format(i) for i in range(len(azs))},
+        app_networks     = app_networks,
+        custom_app_rules = custom_rules,
+        tcpstacks        = stacks,
+    ))
+    return ops
+
+def render(builder, ops):
+    if builder == "tcpstacks":
+        return [create.stacks.tcp_stack_template(ops, k, v, True) for k,v in ops.tcpstacks.items()]
+    return [getattr(create.stacks, builder + "_stack_template")(ops, True)]
+
+def time_builder(builder, ops, repeat):
+    #Best of repeat runs
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        templates = render(builder, ops)
+        built = time.perf_counter()
+        size = sum(len(t.to_json()) for t in templates)
+        done = time.perf_counter()
+        result = dict(build = built - start, to_json = done - built, templates = len(templates), json_bytes = size,
+            resources = sum(len(t.resources) for t in templates))
+        if best is None or result['build'] + result['to_json'] < best['build'] + best['to_json']:
+            best = result
+    return best
+
+def run(repeat, names = None):
+    """Return (results, errors). A builder that fails is listed in errors and left out of the results,
+    an error is not a timing to compare against.
+    """
+    #Any AWS lookup raises OfflineLookupError
+    snapshot = tempfile.NamedTemporaryFile(mode = 'w', suffix = ".json", delete = False)
+    snapshot.write("{}")
+    snapshot.close()
+    create.lookups.configure(offline_path = snapshot.name)
+    results = dict()
+    errors  = []
+    try:
+        for name, tcpstacks, subnets, rules in scenarios:
+            if names and name not in names:
+                continue
+            ops = synthetic_config(tcpstacks, subnets, rules)
+            results[name] = dict(tcpstacks = tcpstacks, subnets = subnets, rules = rules, builders = dict())
+            for builder in builders:
+                try:
+                    results[name]['builders'][builder] = time_builder(builder, ops, repeat)
+                except Exception as e:
+                    errors.append("{} {}: {}: {}".format(name, builder, type(e).__name__, e))
+    finally:
+        os.unlink(snapshot.name)
+    return results, errors
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd = bench_path).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def format_results(results):
+    lines = ["{:<8} {:<10} {:>10} {:>10} {:>10} {:>12}".format("scenario", "builder", "build s", "to_json s", "resources", "json bytes")]
+    for name, scenario in results.items():
+        for builder, r in scenario['builders'].items():
+            lines.append("{:<8} {:<10} {:>10.3f} {:>10.3f} {:>10} {:>12}".format(
+                name, builder, r['build'], r['to_json'], r['resources'], r['json_bytes']))
+    return "\n".join(lines)
+
+def compare(baseline, results, threshold):
+    """Return lines for builders slower than baseline by more than threshold (a fraction)"""
+    regressions = []
+    for name, scenario in results.items():
+        for builder, r in scenario['builders'].items():
+            base = baseline.get(name, {}).get('builders', {}).get(builder)
+            if not base or base.get('error'):
+                continue
+            before = base['build'] + base['to_json']
+            after  = r['build'] + r['to_json']
+            if before > 0 and (after - before) / before > threshold:
+                regressions.append("{} {}: {:.3f}s -> {:.3f}s ({:+.0%})".format(name, builder, before, after, (after - before) / before))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--scenario", action = "append", help = "Only run named scenarios")
+    parser.add_argument("--output", help = "Results file, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help = "Results file of an earlier run to check for regressions")
+    parser.add_argument("--threshold", type = float, default = 0.2, help = "Slowdown reported as a regression")
+    args = parser.parse_args()
+
+    results, errors = run(args.repeat, args.scenario)
+    print(format_results(results))
+    if errors:
+        #Results missing a builder are not saved, they would hide its regressions in later comparisons
+        for e in errors:
+            print("Error: " + e, file = sys.stderr)
+        sys.exit(1)
+
+    output = args.output or os.path.join(results_path, git_commit() + ".json")
+    if not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as f:
+        json.dump(dict(commit = git_commit(), python = sys.version.split()[0], results = results), f, indent = 1, sort_keys = True)
+    print("Results saved to {}".format(output))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(baseline, results, args.threshold)
+        for r in regressions:
+            print("Regression: " + r)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+""" Time per instance userdata rendering with multipart_userdata.
+
+    python -m benchmarks.userdata --instances 100
+
+cold clears the file and cloud-config caches before every instance, warm keeps them
+as a stack render does. Also reports whether the libyaml dumper gives the same
+cloud-config, CloudConfigDumper stays on the Python emitter while it does not.
+"""
+import argparse
+import os
+import time
+import yaml
+import create.ec2
+
+bench_path = os.path.dirname(os.path.abspath(__file__))
+userdata   = os.path.join(bench_path, "..", "examples", "phpinfo.userdata")
+
+def render(i):
+    return create.ec2.multipart_userdata(
+        bash_files       = [userdata],
+        install_packages = ["docker"],
+        sub_values       = dict(resource_name = "Host{}".format(i), LOG_GROUP = "logs"),
+        env_vars         = dict(ENVIRONMENT = "bench"),
+        enable_cre_disk_alarm = True,
+    )
+
+def clear_caches():
+    create.ec2.cloud_config.cache_clear()
+    create.ec2.load_file.cache_clear()
+
+def timed(label, instances, fn):
+    start = time.perf_counter()
+    for i in range(instances):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print("{:<8} {:8.3f}s {:10.1f}us per instance".format(label, elapsed, elapsed / instances * 1e6))
+
+def c_dumper_matches():
+    class CDumper(yaml.CDumper):
+        pass
+    CDumper.add_representer(create.ec2.literal_unicode, lambda dumper, data: dumper.represent_scalar(u'tag:yaml.org,2002:str', str(data), style='|'))
+    clear_caches()
+    text = render(0).to_dict()['Fn::Base64']['Fn::Sub'][0]
+    cloudconf = yaml.safe_load(text)
+    for f in cloudconf['write_files']:
+        f['content'] = create.ec2.literal_unicode(f['content'])
+    return text == "#cloud-config\n" + yaml.dump(cloudconf, Dumper = CDumper)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instances", type = int, default = 100)
+    args = parser.parse_args()
+
+    print("{} instances".format(args.instances))
+    timed("cold", args.instances, lambda i: (clear_caches(), render(i)))
+    clear_caches()
+    timed("warm", args.instances, render)
+    if getattr(yaml, "__with_libyaml__", False):
+        print("libyaml dumper output {}".format("identical" if c_dumper_matches() else "differs"))
+
+if __name__ == "__main__":
+    main()
@@ -2,34 +2,37 @@
 
 import sys
 import os.path
+import threading
 from functools import partial
 import click
-import boto3
-import create.config
-from create.custom_funcs import check_custom_func, check_lambda_code
-from create.events import check_s3trigger_lambda
-from botocore.exceptions import ClientError
+import create.lookups
+import create.profiling
 from collections import OrderedDict, namedtuple
+#boto3, troposphere and the stack builders are imported by the functions that use them to keep startup fast
 
 class BotoHandle(object):
     def __init__(self):
         self.bclient = {}
+        self.lock    = threading.Lock()
 
     def set_region(self, aws_region):
         self.aws_region = aws_region
 
     def create_client(self, aws_region, service_name):
-        self.bclient[service_name] = boto3.client(service_name, region_name = aws_region)
+        import create.boto_clients
+        self.bclient[service_name] = create.boto_clients.get_client(service_name, aws_region)
 
     def get_client(self, service_name):
-        if self.bclient.get(service_name):
-            return self.bclient[service_name]
-        else:
-            if self.aws_region:
-                self.create_client(self.aws_region, service_name)
+        #Clients are shared between deploy threads
+        with self.lock:
+            if self.bclient.get(service_name):
                 return self.bclient[service_name]
             else:
-                raise ValueError("AWS Region not set on boto client")
+                if self.aws_region:
+                    self.create_client(self.aws_region, service_name)
+                    return self.bclient[service_name]
+                else:
+                    raise ValueError("AWS Region not set on boto client")
 
     def get_cf_client(self):
         return self.get_client('cloudformation')
@@ -38,22 +41,26 @@ class BotoHandle(object):
         return self.get_client('s3')
 
 botohandle = BotoHandle()
+#Seconds a stack wait runs before failing, set by deploy --wait-timeout
+stack_wait_timeout = 3600
 
-def wait_for_stack(stack_name, wait_status):
+@create.profiling.profiled()
+def wait_for_stack(stack_name, wait_status, since_event_id = "latest"):
+    #since_event_id defaults to create.stack_events.FROM_LATEST
+    import create.stack_events
     bclient = botohandle.get_cf_client()
-    waiter  = bclient.get_waiter(wait_status)
-    print("Waiting for %s to be in state %s" % (stack_name, wait_status))
-    waiter.wait(StackName=stack_name)
+    create.stack_events.wait_for_stack(bclient, stack_name, wait_status, since_event_id = since_event_id, max_wait = stack_wait_timeout)
 
 
 def get_available_stacks():
-    from create.stacks import (
-        resources_stack_template,
-        network_stack_template,
-        app_stack_template,
-        tcp_stack_template,
-        build_stack_template
-    )
+    with create.profiling.span("import builders"):
+        from create.stacks import (
+            resources_stack_template,
+            network_stack_template,
+            app_stack_template,
+            tcp_stack_template,
+            build_stack_template
+        )
     available_stacks = OrderedDict()
     stack_call = partial(dict, inbuilt = False, default=False, options=dict())
 
@@ -77,6 +84,7 @@ def get_available_stacks():
 
 
 def get_required_command(stack_name):
+    from botocore.exceptions import ClientError
     ready_stacks = dict(
         stack_exists          = (["CREATE_COMPLETE", "ROLLBACK_COMPLETE", "UPDATE_COMPLETE","UPDATE_COMPLETE",
             "UPDATE_ROLLBACK_COMPLETE"], "update"),
@@ -126,6 +134,36 @@ def get_stack_parameter_keys(stack_name):
     else:
         return []
 
+def get_deployed_template(stack_name):
+    bclient = botohandle.get_cf_client()
+    return bclient.get_template(StackName = stack_name, TemplateStage = "Original")['TemplateBody']
+
+def stack_unchanged(stack_name, template, use_params = None):
+    import create.template_diff
+    #Compare deployed template and parameters before doing any S3 or cloudformation writes
+    if not create.template_diff.same_template(get_deployed_template(stack_name), template.to_dict()):
+        return False
+    if use_params:
+        bclient = botohandle.get_cf_client()
+        stack_details = bclient.describe_stacks(StackName=stack_name)
+        deployed_params = {p['ParameterKey']:p.get('ParameterValue') for p in stack_details['Stacks'][0].get('Parameters', [])}
+        template_params = template.to_dict().get('Parameters', {})
+        for p in use_params:
+            if deployed_params.get(p) != str(template_params.get(p, {}).get('Default')):
+                return False
+    return True
+
+def diff_stack(stack_name, template):
+    import create.template_diff
+    from botocore.exceptions import ClientError
+    try:
+        deployed = get_deployed_template(stack_name)
+    except ClientError:
+        print("{}: stack does not exist, will be created".format(stack_name))
+        return
+    changes = create.template_diff.template_diff(deployed, template.to_dict())
+    print(create.template_diff.format_diff(stack_name, changes))
+
 def set_cf_params(stack_name, use_params):
     param_keys = get_stack_parameter_keys(stack_name)
     for p in use_params:
@@ -134,35 +172,52 @@ def set_cf_params(stack_name, use_params):
     return use_params_opt
 
 
-def upload_template(stack_name, template, bucket, deploy_env, s3_filename=None):
+@create.profiling.profiled()
+def upload_template(stack_name, template, bucket, deploy_env, s3_filename=None, template_prefix=None):
+    import create.template_store
+    bclient = botohandle.get_s3_client()
+    body = create.template_store.template_body(template.to_dict())
     if s3_filename:
+        #Named uploads are read by other tools at a fixed key
         obj_key = "%s/%s" % (deploy_env, s3_filename)
+        print("Uploading template to s3://{bucket}/{obj_key}".format(bucket=bucket, obj_key = obj_key))
+        bclient.put_object(Bucket=bucket, Key=obj_key, Body=body)
     else:
-        obj_key = "%s/%s" % (deploy_env, stack_name)
-    template_url = "s3://{bucket}/{obj_key}".format(bucket=bucket, obj_key = obj_key)
-    print("Uploading template to {url}".format(url=template_url))
-    bclient = botohandle.get_s3_client()
-    bclient.put_object(Bucket=bucket, Key=obj_key, Body=template.to_json())
-    #TODO: check upload success
+        obj_key, uploaded = create.template_store.upload_template_body(
+            bclient,
+            bucket,
+            stack_ref = "%s/%s" % (deploy_env, stack_name),
+            body      = body,
+            prefix    = create.template_store.env_prefix(deploy_env, template_prefix),
+        )
+        template_url = "s3://{bucket}/{obj_key}".format(bucket=bucket, obj_key = obj_key)
+        if uploaded:
+            print("Uploading template to {url}".format(url=template_url))
+        else:
+            print("Template already uploaded to {url}".format(url=template_url))
+    return create.template_store.template_url(botohandle.aws_region, bucket, obj_key)
 
-def create_stack(stack_name, stack_type, aws_region, template, bucket, deploy_env):
+def create_stack(stack_name, stack_type, aws_region, template, bucket, deploy_env, template_prefix = None):
 
-    upload_template(stack_name, template, bucket, deploy_env)
+    template_url = upload_template(stack_name, template, bucket, deploy_env, template_prefix = template_prefix)
 
     bclient = botohandle.get_cf_client()
 
-    template_url = "https://s3-%s.amazonaws.com/%s/%s/%s" % (aws_region, bucket, deploy_env, stack_name)
     stack_exec_options = get_available_stacks()[stack_type]['options']
 
     print("creating stack:%s" % (stack_name,))
     bclient.create_stack(StackName = stack_name, TemplateURL = template_url, **stack_exec_options)
 
-    wait_for_stack(stack_name, 'stack_create_complete')
+    wait_for_stack(stack_name, 'stack_create_complete', since_event_id = None)
+
+def confirm_update(stack_name, aws_region):
+    return click.confirm("Continue updating existing stack {stack_name} in {aws_region}?".format(stack_name = stack_name, aws_region = aws_region))
 
-def update_stack(stack_name, stack_type, aws_region, template, bucket, deploy_env, use_params = None, force = False):
-    if force or click.confirm("Continue updating existing stack {stack_name} in {aws_region}?".format(stack_name = stack_name, aws_region = aws_region)):
+def update_stack(stack_name, stack_type, aws_region, template, bucket, deploy_env, use_params = None, force = False, template_prefix = None):
+    import create.stack_events
+    if force or confirm_update(stack_name, aws_region):
 
-        upload_template(stack_name, template, bucket, deploy_env)
+        template_url = upload_template(stack_name, template, bucket, deploy_env, template_prefix = template_prefix)
 
         bclient = botohandle.get_cf_client()
 
@@ -170,21 +225,201 @@ def update_stack(stack_name, stack_type, aws_region, template, bucket, deploy_en
         if stack_exec_options.get('Parameters'):
             raise(ValueError,"Parameters option should not be set somewhere else")
         stack_exec_options['Parameters'] = set_cf_params(stack_name, use_params)
-        template_url = "https://s3-%s.amazonaws.com/%s/%s/%s" % (aws_region, bucket, deploy_env, stack_name)
 
         print("updating stack %s" % stack_name)
+        last_event_id = create.stack_events.latest_event_id(bclient, stack_name)
         bclient.update_stack(StackName = stack_name, TemplateURL = template_url, **stack_exec_options)
-        wait_for_stack(stack_name, 'stack_update_complete')
-
-def to_stdout(template):
-    print(template.to_json())
-
-def stack_exec(stacks, config_file, dry_run = False, force = False, use_params = None):
-
-    bin_path   = os.path.dirname(os.path.abspath(__file__))
-    local_path = os.path.join(bin_path, "..")
+        wait_for_stack(stack_name, 'stack_update_complete', since_event_id = last_event_id)
+
+def to_stdout(template, output_format = "json"):
+    import create.template_store
+    print(create.template_store.template_body(template.to_dict(), output_format))
+
+def print_userdata_report(stack_name, template):
+    import create.assembler
+    import create.ec2
+    for name, size in create.ec2.userdata_report(create.assembler.dependency_dict(template)):
+        over = ", over the {} byte limit".format(create.ec2.userdata_limit) if size > create.ec2.userdata_limit else ""
+        print("Userdata {} {}: {} bytes{}".format(stack_name, name, size, over), file = sys.stderr)
+
+def deploy_stacks(stack_jobs, commands, aws_region, force = False, use_params = None, max_jobs = 4):
+    import create.assembler
+    from create.scheduler import stack_dependencies, run_stacks
+    #Find required commands and confirm updates up front, before any stack runs in the background
+    for stack_name, job in list(stack_jobs.items()):
+        job['command'] = get_required_command(stack_name)
+        if job['command'] == "update" and stack_unchanged(stack_name, job['template'], use_params):
+            print("No changes to stack {}. Skipping update".format(stack_name), file = sys.stderr)
+            del stack_jobs[stack_name]
+        elif job['command'] == "update" and not force:
+            if not confirm_update(stack_name, aws_region):
+                print("Skipping update of stack {}".format(stack_name), file = sys.stderr)
+                del stack_jobs[stack_name]
+
+    parent = create.profiling.current_path()
+    def exec_stack(stack_name):
+        job = stack_jobs[stack_name]
+        command_options = dict(
+            stack_name = stack_name,
+            stack_type = job['stack_type'],
+            template   = job['template'],
+            **commands[job['command']]['func_opts']
+        )
+        if job['command'] == "update":
+            command_options['force'] = True
+        with create.profiling.span("{} {}".format(job['command'], stack_name), parent):
+            commands[job['command']]['exec_function'](**command_options)
+
+    dependencies = stack_dependencies({k:create.assembler.dependency_dict(v['template']) for k,v in stack_jobs.items()})
+    status = run_stacks(dependencies, exec_stack, max_workers = max_jobs)
+    failed = [k for k,v in status.items() if v != "complete"]
+    if failed:
+        raise(RuntimeError("Stacks not deployed: {}".format(", ".join(failed))))
+
+def confirm_change_set(bclient, plan, aws_region, force = False):
+    #Failed and rejected change sets are discarded, Rejected is set on plans not confirmed
+    import create.changesets
+    if plan['Status'] == "FAILED":
+        create.changesets.discard_change_set(bclient, plan)
+    elif not force and not click.confirm("Execute change set for stack {} in {}?".format(plan['StackName'], aws_region)):
+        create.changesets.discard_change_set(bclient, plan)
+        plan['Rejected'] = True
+    return plan
+
+def changeset_stacks(stack_jobs, aws_region, bucket, deploy_env, force = False, use_params = None, max_jobs = 4, template_prefix = None):
+    import create.assembler
+    import create.changesets
+    import create.stack_events
+    from create.scheduler import stack_dependencies, run_stacks
+    bclient = botohandle.get_cf_client()
+    available_stacks = get_available_stacks()
 
-    ops = create.config.parse(config_file = os.path.realpath(config_file))
+    requests = OrderedDict()
+    for stack_name, job in list(stack_jobs.items()):
+        command = get_required_command(stack_name)
+        if command == "update" and stack_unchanged(stack_name, job['template'], use_params):
+            print("No changes to stack {}. Skipping change set".format(stack_name), file = sys.stderr)
+            del stack_jobs[stack_name]
+            continue
+        options = dict(available_stacks[job['stack_type']]['options'])
+        if command == "update":
+            options['Parameters'] = set_cf_params(stack_name, use_params)
+        requests[stack_name] = dict(
+            stack_name      = stack_name,
+            template_url    = upload_template(stack_name, job['template'], bucket, deploy_env, template_prefix = template_prefix),
+            change_set_type = command,
+            options         = options,
+        )
+    dependencies = stack_dependencies({k:create.assembler.dependency_dict(v['template']) for k,v in stack_jobs.items()})
+
+    #Stacks importing from other stacks in this run are planned once those have executed, before that their exports may not exist
+    plans = dict()
+    with create.profiling.span("plan change sets"):
+        planned = create.changesets.plan_change_sets(bclient, [r for k,r in requests.items() if not dependencies[k]], max_workers = max_jobs)
+    for plan in planned:
+        print(create.changesets.format_plan(plan))
+    #Confirm every plan before executing any, rejected change sets are removed without a redeploy
+    for plan in planned:
+        plans[plan['StackName']] = confirm_change_set(bclient, plan, aws_region, force)
+
+    wait_status = dict(create = "stack_create_complete", update = "stack_update_complete")
+    confirm_lock = threading.Lock()
+    parent = create.profiling.current_path()
+    def exec_stack(stack_name):
+        with create.profiling.span("execute " + stack_name, parent):
+            plan = plans.get(stack_name)
+            if plan is None:
+                plan = create.changesets.plan_change_set(bclient, **requests[stack_name])
+                with confirm_lock:
+                    print(create.changesets.format_plan(plan))
+                    plan = confirm_change_set(bclient, plan, aws_region, force)
+            if create.changesets.no_changes(plan) or plan.get('Rejected'):
+                return
+            if plan['Status'] == "FAILED":
+                raise(RuntimeError("Change set failed: {}".format(plan['StatusReason'])))
+            last_event_id = create.stack_events.latest_event_id(bclient, stack_name)
+            create.changesets.execute_change_set(bclient, plan)
+            wait_for_stack(stack_name, wait_status[plan['ChangeSetType']], since_event_id = last_event_id)
+
+    status = run_stacks(dependencies, exec_stack, max_workers = max_jobs)
+    failed = [k for k,v in status.items() if v != "complete"]
+    if failed:
+        raise(RuntimeError("Stacks not deployed: {}".format(", ".join(failed))))
+
+def lambda_artifacts(ops, stacks):
+    from create.custom_funcs import custom_func_artifact, lambda_artifact
+    from create.events import s3trigger_artifact
+    from create.mongo import start_stop_lambda
+    #TODO: move to check all lambda code function
+    deploy_env = ops.deploy_env
+    check_files = []
+    artifacts = []
+    if ops.build_ami:
+        check_files.append("ami_resource")
+    if ops.cloudwatch_alarm:
+        check_files.append("cloudwatch_alarm")
+
+    #Mongodb tcpstacks without an arbiter start and stop their instances with a lambda
+    tcpstacks = ops.get("tcpstacks") or dict()
+    if any(tcpstacks[s]['stack_type'] == "mongodb" and tcpstacks[s]['enabled'] and not tcpstacks[s]['enableArbiter']
+            for s in stacks if s in tcpstacks):
+        artifacts.append(lambda_artifact(deploy_env, start_stop_lambda))
+
+    if ops.get("s3_triggers") and "resources" in stacks:
+        check_files.append("s3trigger")
+        for trigger_name,trigger_setup in ops.s3_triggers.items():
+            artifacts.append(s3trigger_artifact(deploy_env, trigger_setup['lambda_code']))
+
+    for lambda_file in check_files:
+        artifacts.append(custom_func_artifact(deploy_env, lambda_file))
+    return artifacts
+
+def build_stack(ops, s, available_stacks, dry_run, userdata_report = False):
+    #Returns (stack_name, stack_type, template), or None for a disabled tcpstack
+    import create.assembler
+    import create.template_store
+    inbuilt_stack_types = [key for key,value in available_stacks.items() if value['inbuilt']]
+    defined_stacks = []
+    if ops.get('tcpstacks'):
+        defined_stacks = [k for k in ops.tcpstacks.keys()]
+        for d in defined_stacks:
+            if d in inbuilt_stack_types:
+                raise(ValueError("Stack name {} overrides value of a stack type.\
+                    Currently unsupported to have stack key the same as a stack type".format(d)))
+    if s not in inbuilt_stack_types + defined_stacks:
+        raise(ValueError("Stack \"{}\" not a valid stack type. Available types:{}".format(s, inbuilt_stack_types + defined_stacks)))
+
+    stack_name = "{stack}-{stack_type}".format(stack=ops.app_name, stack_type=s)
+    if  available_stacks.get(s):
+        stack_type = s
+        with create.profiling.span("build " + s):
+            stack_template = available_stacks[stack_type]['create_func'](ops, dry_run)
+    else:
+        stack_type = ops.tcpstacks[s]['stack_type']
+        if not ops.tcpstacks[s]['enabled']:
+            print("Stack {} not enabled. Skipping.".format(s), file = sys.stderr)
+            return None
+        with create.profiling.span("build " + s):
+            stack_template = available_stacks[stack_type]['create_func'](ops, s, ops.tcpstacks[s], dry_run)
+    #Templates near the CloudFormation limits are split into nested stacks
+    stack_template = create.assembler.assemble(stack_template, stack_name, ops.aws_region, ops.deploy_bucket,
+        create.template_store.env_prefix(ops.deploy_env, ops.get("template_prefix")))
+    if userdata_report:
+        print_userdata_report(stack_name, stack_template)
+    return stack_name, stack_type, stack_template
+
+def stack_exec(stacks, config_file, dry_run = False, force = False, use_params = None, max_jobs = 4, show_diff = False, changeset = False,
+        output_format = "json", userdata_report = False):
+    import create.config
+    import create.artifacts
+    import create.assembler
+    import create.template_store
+    import create.schema
+
+    with create.profiling.span("config.parse"):
+        ops = create.config.parse(config_file = os.path.realpath(config_file))
+    with create.profiling.span("config.validate"):
+        create.schema.validate(ops, stacks, config_file)
     botohandle.set_region(ops.aws_region)
     aws_region    = ops.aws_region
     deploy_bucket = ops.deploy_bucket
@@ -194,82 +429,115 @@ def stack_exec(stacks, config_file, dry_run = False, force = False, use_params =
         aws_region = aws_region,
         bucket     = deploy_bucket,
         deploy_env = deploy_env,
+        template_prefix = ops.get("template_prefix"),
     )
     commands = dict(
         create = dict(exec_function = create_stack, func_opts = func_opts),
         update = dict(exec_function = update_stack, func_opts = dict(use_params = use_params, force=force, **func_opts)),
-        stdout = dict(exec_function = to_stdout,    func_opts = dict())
+        stdout = dict(exec_function = to_stdout,    func_opts = dict(output_format = output_format)),
+        diff   = dict(exec_function = diff_stack,   func_opts = dict()),
     )
     available_stacks = get_available_stacks()
 
     if not dry_run:
-        #TODO: move to check all lambda code function
-        check_files = []
-        if ops.build_ami:
-            check_files.append("ami_resource")
-        if ops.cloudwatch_alarm:
-            check_files.append("cloudwatch_alarm")
-
-        if "mongo" in stacks:
-            check_lambda_code(
-                s3_bucket   = deploy_bucket,
-                s3_prefix   = deploy_env,
-                lambda_file = os.path.join(local_path,"/lambdas/mongo_start_stop_lambda.py")
-            )
-
-        if ops.get("s3_triggers") and "resources" in stacks:
-            check_files.append("s3trigger")
-            for trigger_name,trigger_setup in ops.s3_triggers.items():
-                check_s3trigger_lambda(
-                    deploy_bucket,
-                    deploy_env,
-                    trigger_setup['lambda_code'],
-                )
-
-        for lambda_file in check_files:
-            check_custom_func(
-                deploy_bucket    = deploy_bucket,
-                deploy_env       = deploy_env,
-                custom_func_file = lambda_file,
+        #Upload missing lambda code before any stack is rendered or deployed
+        with create.profiling.span("lambda artifacts"):
+            create.artifacts.upload_artifacts(
+                botohandle.get_s3_client(),
+                deploy_bucket,
+                deploy_env + "/",
+                lambda_artifacts(ops, stacks),
+                max_workers = max_jobs,
             )
 
+    stack_jobs = OrderedDict()
     for s in stacks:
-        inbuilt_stack_types = [key for key,value in available_stacks.items() if value['inbuilt']]
-        defined_stacks = []
-        if ops.get('tcpstacks'):
-            defined_stacks = [k for k in ops.tcpstacks.keys()]
-            for d in defined_stacks:
-                if d in inbuilt_stack_types:
-                    raise(ValueError("Stack name {} overrides value of a stack type.\
-                        Currently unsupported to have stack key the same as a stack type".format(d)))
-        if s not in inbuilt_stack_types + defined_stacks:
-            raise(ValueError("Stack \"{}\" not a valid stack type. Available types:{}".format(s, inbuilt_stack_types + defined_stacks)))
-
-        stack_name = "{stack}-{stack_type}".format(stack=ops.app_name, stack_type=s)
-        if  available_stacks.get(s):
-            stack_type = s
-            stack_template = available_stacks[stack_type]['create_func'](ops, dry_run)
-        else:
-            stack_type = ops.tcpstacks[s]['stack_type']
-            if not ops.tcpstacks[s]['enabled']:
-                print("Stack {} not enabled. Skipping.".format(s), file = sys.stderr)
-                continue
-            stack_template = available_stacks[stack_type]['create_func'](ops, s, ops.tcpstacks[s], dry_run)
-
-        if dry_run:
+        built = build_stack(ops, s, available_stacks, dry_run, userdata_report)
+        if built is None:
+            continue
+        stack_name, stack_type, stack_template = built
+
+        if dry_run and show_diff:
+            with create.profiling.span("diff " + s):
+                commands['diff']['exec_function'](stack_name = stack_name, template = stack_template)
+        elif dry_run:
             command = 'stdout'
             command_options = dict(template=stack_template,**commands[command]['func_opts'])
+            with create.profiling.span("serialize " + s):
+                commands[command]['exec_function'](**command_options)
         else:
-
-            command = get_required_command(stack_name)
-            command_options = dict(
-                stack_name = stack_name,
-                stack_type = stack_type,
-                template=stack_template,
-                **commands[command]['func_opts']
-            )
-
-        commands[command]['exec_function'](**command_options)
+            stack_jobs[stack_name] = dict(stack_type = stack_type, template = stack_template)
+
+    if stack_jobs:
+        with create.profiling.span("nested templates"):
+            create.assembler.upload_nested(botohandle.get_s3_client(), deploy_bucket, deploy_env,
+                {k:v['template'] for k,v in stack_jobs.items()},
+                prefix = create.template_store.env_prefix(deploy_env, ops.get("template_prefix")), max_workers = max_jobs)
+
+    if stack_jobs and changeset:
+        changeset_stacks(stack_jobs, aws_region, deploy_bucket, deploy_env, force = force, use_params = use_params,
+            max_jobs = max_jobs, template_prefix = ops.get("template_prefix"))
+    elif stack_jobs:
+        deploy_stacks(stack_jobs, commands, aws_region, force = force, use_params = use_params, max_jobs = max_jobs)
+
+_render_configs = dict()
+
+def render_config(config_file):
+    import create.config
+    #Configs are parsed once in each render worker process
+    if config_file not in _render_configs:
+        _render_configs[config_file] = create.config.parse(config_file = os.path.realpath(config_file))
+    return _render_configs[config_file]
+
+def render_output_path(output_dir, config_file, s, output_format = "json"):
+    config_name = os.path.splitext(os.path.basename(config_file))[0]
+    return os.path.join(output_dir, config_name, s + (".yaml" if output_format == "yaml" else ".json"))
+
+def render_stack(config_file, s, output_dir, output_format = "json", userdata_report = False):
+    import create.utils
+    import create.template_store
+    ops = render_config(config_file)
+    botohandle.set_region(ops.aws_region)
+    built = build_stack(ops, s, get_available_stacks(), True, userdata_report)
+    if built is None:
+        return None, "disabled"
+    path = render_output_path(output_dir, config_file, s, output_format)
+    written = create.utils.write_if_changed(path, create.template_store.template_body(built[2].to_dict(), output_format))
+    for n in getattr(built[2], 'nested', []):
+        nested_written = create.utils.write_if_changed(render_output_path(output_dir, config_file, s + "." + n['name'], output_format),
+            create.template_store.template_body(n['template'], output_format))
+        written = written or nested_written
+    return path, "written" if written else "unchanged"
+
+def render_worker_init(lookup_ttl, lookup_cache, offline_lookups, refresh_prerun):
+    import create.prerun
+    create.lookups.configure(lookup_ttl, lookup_cache, offline_lookups)
+    create.prerun.configure(refresh = refresh_prerun)
+
+def render_stacks(config_stacks, output_dir, jobs, lookup_ttl = create.lookups.default_ttl, lookup_cache = False, offline_lookups = None,
+        refresh_prerun = False, output_format = "json", userdata_report = False):
+    """Render (config_file, stacks) pairs in a process pool, one template file per stack.
+    Files whose contents did not change are not rewritten.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    failed = []
+    with ProcessPoolExecutor(max_workers = jobs, initializer = render_worker_init,
+            initargs = (lookup_ttl, lookup_cache, offline_lookups, refresh_prerun)) as pool:
+        futures = OrderedDict()
+        for config_file, stacks in config_stacks:
+            for s in stacks:
+                futures[(config_file, s)] = pool.submit(render_stack, config_file, s, output_dir, output_format, userdata_report)
+        for (config_file, s), future in futures.items():
+            try:
+                path, status = future.result()
+            except Exception as e:
+                print("{} {}: {}: {}".format(config_file, s, type(e).__name__, e), file = sys.stderr)
+                failed.append("{} {}".format(config_file, s))
+                continue
+            if path:
+                print("{:<9} {}".format(status, path))
+    if failed:
+        raise(RuntimeError("Stacks not rendered: {}".format(", ".join(failed))))
 
 @click.group()
 def go_tropo():
@@ -280,6 +548,7 @@ def go_tropo():
 @click.option('--run', is_flag=True)
 @click.argument('config_yaml', nargs = 1)
 def build(dry_run, run, config_yaml):
+    import create.config
     #TODO:see if this can be moved to use stack_exec
     ops = create.config.parse(config_file = os.path.realpath(config_yaml))
     app_cfn_options = create.config.ConfigOptions()
@@ -313,47 +582,144 @@ def build(dry_run, run, config_yaml):
 
 
 @go_tropo.command()
-@click.option("--stream", help="Only show logs for given stream")
+@click.option("--stream", multiple=True, help="Only show streams whose name starts with this, such as an instance id. Can be given more than once")
+@click.option("--start", default="20m", show_default=True, help="Show events from this time: an age such as 20m, 2h or 1d, epoch seconds or an ISO 8601 time")
+@click.option("--until", help="Show events up to this time and stop, in the same forms as --start")
+@click.option("--grep", help="CloudWatch Logs filter pattern, matched by the service")
+@click.option("--json", "json_output", is_flag=True, help="Print each event as a JSON object")
+@click.option("--no-follow", is_flag=True, help="Stop after the events up to now instead of waiting for new ones")
 @click.argument('config_yaml', nargs = 1)
-def logs(stream, config_yaml):
-    import create.stacks
-    from awslogs import AWSLogs
+def logs(stream, start, until, grep, json_output, no_follow, config_yaml):
+    import create.boto_clients
+    import create.config
+    import create.log_events
+    import create.names
     ops = create.config.parse(config_file = os.path.realpath(config_yaml))
-    aws_region = ops.aws_region
-    log_group = create.stacks.create_resource_names(ops)['log_group']
-    if not stream:
-        log_stream_name = "ALL"
-    else:
-        log_stream_name = stream
-    al = AWSLogs(
-        output_group_enabled=True,
-        watch=True,
-        aws_region = aws_region,
-        log_stream_name = log_stream_name,
-        start="20m",
-        output_stream_enabled=True,
-        log_group_name=log_group,
-        color_enabled=True
-    )
-    al.list_logs()
+    log_group = create.names.create_resource_names(ops)['log_group']
+    client = create.boto_clients.get_client("logs", ops.aws_region)
+    try:
+        create.log_events.tail_logs(
+            client,
+            log_group,
+            start           = create.log_events.parse_time(start),
+            end             = create.log_events.parse_time(until) if until else None,
+            filter_pattern  = grep,
+            stream_prefixes = list(stream),
+            follow          = not no_follow,
+            json_output     = json_output,
+        )
+    except KeyboardInterrupt:
+        pass
 
 @go_tropo.command()
 @click.option('--stack', help="Only create named stack section", multiple = True)
 @click.option('--use-param', help="If updating existing stack, use default Cloudformation parameter from config file", multiple = True)
 @click.option('--dry-run', is_flag=True)
+@click.option('--diff', is_flag=True, help="With --dry-run, show per resource changes against the deployed stacks instead of the templates")
+@click.option('--changeset', is_flag=True, help="Deploy through change sets, showing planned resource changes and replacements before executing")
 @click.option('--force', is_flag=True)
+@click.option('--jobs', default=4, show_default=True, help="Maximum number of stacks to deploy at the same time")
+@click.option('--lookup-cache', is_flag=True, help="Keep AWS lookups made while rendering templates in the local cache between runs")
+@click.option('--lookup-ttl', default=create.lookups.default_ttl, show_default=True, help="Seconds a cached AWS lookup stays valid")
+@click.option('--record-lookups', help="Save AWS lookups made while rendering to this snapshot file")
+@click.option('--offline-lookups', help="Serve AWS lookups only from this snapshot file, without calling AWS")
+@click.option('--refresh-prerun', is_flag=True, help="Run prerun functions again instead of using results cached with cache_ttl")
+@click.option('--format', 'output_format', type=click.Choice(["json", "compact", "yaml"]), default="json", show_default=True, help="Template format printed by --dry-run. Uploads are always compact json")
+@click.option('--userdata-report', is_flag=True, help="Print the userdata bytes of every launch config and instance")
+@click.option('--boto-stats', is_flag=True, help="Print boto client and API call counts when finished")
+@click.option('--wait-timeout', default=3600, show_default=True, help="Seconds to wait for each stack to finish before failing the deploy")
+@click.option('--profile', is_flag=True, help="Print time spent in each deploy phase when finished")
+@click.option('--trace-file', help="Write deploy phase timings to this file as a Chrome trace event JSON")
 @click.argument('config_yaml', nargs = 1)
-def deploy(stack, use_param, dry_run, force, config_yaml):
+def deploy(stack, use_param, dry_run, diff, changeset, force, jobs, lookup_cache, lookup_ttl, record_lookups, offline_lookups, refresh_prerun,
+        output_format, userdata_report, wait_timeout, boto_stats, profile, trace_file, config_yaml):
+    import create.boto_clients
+    import create.prerun
+    global stack_wait_timeout
+    stack_wait_timeout = wait_timeout
+
+    if profile or trace_file:
+        create.profiling.enable()
+
+    create.lookups.configure(
+        ttl          = lookup_ttl,
+        use_disk     = lookup_cache,
+        offline_path = offline_lookups,
+        record_path  = record_lookups,
+    )
+    create.prerun.configure(refresh = refresh_prerun)
 
-    if not stack:
-        available_stacks = get_available_stacks()
-        stack = [s for s in available_stacks.keys() if available_stacks[s]['default']]
+    try:
+        with create.profiling.span("deploy"):
+            if not stack:
+                available_stacks = get_available_stacks()
+                stack = [s for s in available_stacks.keys() if available_stacks[s]['default']]
+
+            if dry_run:
+                print("Dry run create stacks:%s" % (stack,), file=sys.stderr)
+                stack_exec(stacks = stack, config_file = config_yaml, dry_run = True, show_diff = diff, output_format = output_format,
+                    userdata_report = userdata_report)
+            else:
+                if diff:
+                    print("Ignoring --diff option since --dry-run was not given", file=sys.stderr)
+                stack_exec(stacks = stack, config_file = config_yaml, use_params = use_param, force = force, max_jobs = jobs, changeset = changeset,
+                    userdata_report = userdata_report)
+    finally:
+        if boto_stats:
+            print(create.boto_clients.registry.format_stats(), file=sys.stderr)
+        if profile:
+            print(create.profiling.profiler.summary(), file=sys.stderr)
+        if trace_file:
+            create.profiling.profiler.write_trace(trace_file)
 
-    if dry_run:
-        print("Dry run create stacks:%s" % (stack,), file=sys.stderr)
-        stack_exec(stacks = stack, config_file = config_yaml, dry_run = True)
-    else:
-        stack_exec(stacks = stack, config_file = config_yaml, use_params = use_param, force = force)
+@go_tropo.command()
+@click.option('--stack', help="Only render named stacks. Defaults to the default stacks and all tcpstacks", multiple = True)
+@click.option('--output-dir', default="rendered", show_default=True, help="Templates are written to <output-dir>/<config name>/<stack>.json or .yaml")
+@click.option('--jobs', type=int, help="Number of render processes. Defaults to the number of CPUs")
+@click.option('--lookup-cache', is_flag=True, help="Keep AWS lookups made while rendering templates in the local cache between runs")
+@click.option('--lookup-ttl', default=create.lookups.default_ttl, show_default=True, help="Seconds a cached AWS lookup stays valid")
+@click.option('--offline-lookups', help="Serve AWS lookups only from this snapshot file, without calling AWS")
+@click.option('--refresh-prerun', is_flag=True, help="Run prerun functions again instead of using results cached with cache_ttl")
+@click.option('--format', 'output_format', type=click.Choice(["json", "compact", "yaml"]), default="json", show_default=True, help="Format of the rendered templates")
+@click.option('--userdata-report', is_flag=True, help="Print the userdata bytes of every launch config and instance")
+@click.argument('config_yaml', nargs = -1, required = True)
+def render(stack, output_dir, jobs, lookup_cache, lookup_ttl, offline_lookups, refresh_prerun, output_format, userdata_report, config_yaml):
+    """Render the templates of one or more configs to files, as in a dry run"""
+    import create.config
+    import create.schema
+    config_names = [os.path.splitext(os.path.basename(c))[0] for c in config_yaml]
+    for name in set(config_names):
+        if config_names.count(name) > 1:
+            raise(ValueError("Config files with the same name '{}' would render to the same directory".format(name)))
+
+    available_stacks = get_available_stacks()
+    default_stacks = [s for s in available_stacks.keys() if available_stacks[s]['default']]
+    config_stacks = []
+    for config_file in config_yaml:
+        ops = create.config.parse(config_file = os.path.realpath(config_file))
+        stacks = list(stack) or default_stacks + list(ops.get('tcpstacks', {}).keys())
+        create.schema.validate(ops, stacks, config_file)
+        config_stacks.append((config_file, stacks))
+
+    render_stacks(config_stacks, output_dir, jobs or os.cpu_count(),
+        lookup_ttl = lookup_ttl, lookup_cache = lookup_cache, offline_lookups = offline_lookups, refresh_prerun = refresh_prerun,
+        output_format = output_format, userdata_report = userdata_report)
+
+@go_tropo.command()
+@click.option('--keep', type=int, help="Number of templates kept for each stack of the config's deploy_env. Defaults to config template_retention or 10")
+@click.option('--dry-run', is_flag=True)
+@click.argument('config_yaml', nargs = 1)
+def prune_templates(keep, dry_run, config_yaml):
+    import create.config
+    import create.template_store
+    ops = create.config.parse(config_file = os.path.realpath(config_yaml))
+    botohandle.set_region(ops.aws_region)
+    if keep is None:
+        keep = ops.get("template_retention", create.template_store.default_retention)
+    stale = create.template_store.prune_templates(botohandle.get_s3_client(), ops.deploy_bucket, ops.deploy_env,
+        keep = keep, dry_run = dry_run)
+    for key in stale:
+        print("{} s3://{}/{}".format("Would delete" if dry_run else "Deleted", ops.deploy_bucket, key))
 
 @go_tropo.command()
 def create_yaml():
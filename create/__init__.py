@@ -1,5 +1,6 @@
-from troposphere import Output, Export, ImportValue
+#troposphere is imported when first used so that importing any create module stays light
 def export_ref(template, export_name, value, desc):
+    from troposphere import Output, Export
     template.add_output([
         Output(export_name,
             Description = desc,
@@ -9,4 +10,5 @@ def export_ref(template, export_name, value, desc):
     ])
 
 def import_ref(import_name):
+    from troposphere import ImportValue
     return ImportValue(import_name)
@@ -0,0 +1,79 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .template_store import object_exists
+from . import profiling
+
+class RemoteKeys(object):
+    """ Keys known to exist in S3, from one listing of each deploy prefix.
+    Keys outside a listed prefix are checked with a HEAD request.
+    """
+    def __init__(self):
+        self.lock     = threading.Lock()
+        self.prefixes = dict()
+        self.keys     = dict()
+
+    def prefetch(self, s3_client, bucket, prefix):
+        keys = set()
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket = bucket, Prefix = prefix):
+            keys.update(o['Key'] for o in page.get('Contents', []))
+        with self.lock:
+            self.prefixes.setdefault(bucket, set()).add(prefix)
+            self.keys.setdefault(bucket, set()).update(keys)
+        return keys
+
+    def listed(self, bucket, key):
+        return any(key.startswith(p) for p in self.prefixes.get(bucket, ()))
+
+    def exists(self, s3_client, bucket, key):
+        with self.lock:
+            if key in self.keys.get(bucket, ()):
+                return True
+            if self.listed(bucket, key):
+                return False
+        if object_exists(s3_client, bucket, key):
+            self.add(bucket, key)
+            return True
+        return False
+
+    def add(self, bucket, key):
+        with self.lock:
+            self.keys.setdefault(bucket, set()).add(key)
+
+remote_keys = RemoteKeys()
+
+def key_exists(s3_client, bucket, key):
+    return remote_keys.exists(s3_client, bucket, key)
+
+def missing_artifacts(s3_client, bucket, artifacts):
+    #Keep the first artifact for each key, the same lambda can be used by several stacks
+    seen = set()
+    missing = []
+    for a in artifacts:
+        if a['key'] in seen:
+            continue
+        seen.add(a['key'])
+        if not key_exists(s3_client, bucket, a['key']):
+            missing.append(a)
+    return missing
+
+def upload_artifacts(s3_client, bucket, prefix, artifacts, max_workers = 4):
+    """List prefix once, then upload the artifacts not already in bucket in parallel.
+    Each artifact is a dict with key, description and upload, a function taking (s3_client, bucket, key).
+    Returns the uploaded keys.
+    """
+    remote_keys.prefetch(s3_client, bucket, prefix)
+    missing = missing_artifacts(s3_client, bucket, artifacts)
+    parent  = profiling.current_path()
+
+    def upload(a):
+        print("Uploading {} to s3bucket {}".format(a['description'], a['key']))
+        with profiling.span("upload " + a['key'], parent):
+            a['upload'](s3_client, bucket, a['key'])
+        remote_keys.add(bucket, a['key'])
+        return a['key']
+
+    if not missing:
+        return []
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+        return list(pool.map(upload, missing))
@@ -0,0 +1,301 @@
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from troposphere import Template
+from . import import_ref
+from . import profiling
+from .template_store import template_body, template_key, template_url, upload_template_body, default_prefix
+
+#CloudFormation limits for a template uploaded to S3
+limits = dict(body = 1000000, resources = 500, outputs = 200, parameters = 200)
+#Templates are split once past this fraction of a limit, the rest is room for the nested stack wiring
+headroom = 0.8
+#Body kept free in the parent for the nested stack resources and their parameters
+parent_reserve = dict(body = 100000)
+
+sub_name = re.compile(r"\$\{([^!}][^}]*)\}")
+
+def getatt_parts(value):
+    if isinstance(value, str):
+        name, attr = value.split(".", 1)
+        return name, attr
+    return value[0], value[1]
+
+def sub_names(value):
+    #Names a Fn::Sub reads from the template, without its own variables
+    string, variables = (value, dict()) if isinstance(value, str) else (value[0], value[1])
+    return [n for n in sub_name.findall(string) if n.split(".")[0] not in variables and not n.startswith("AWS::")]
+
+def references(node, found):
+    #Logical ids used by Ref, Fn::GetAtt, Fn::Sub and DependsOn in a template fragment
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == "Ref" and isinstance(v, str):
+                found.add(v)
+            elif k == "Fn::GetAtt":
+                found.add(getatt_parts(v)[0])
+            elif k == "Fn::Sub":
+                found.update(n.split(".")[0] for n in sub_names(v))
+            elif k == "DependsOn":
+                found.update([v] if isinstance(v, str) else v)
+            references(v, found)
+    elif isinstance(node, list):
+        for v in node:
+            references(v, found)
+    return found
+
+def rewrite(node, external):
+    """Copy of a template fragment with references to resources in other parts replaced by
+    external(name, attr), which returns None for references that stay as they are.
+    """
+    if isinstance(node, dict):
+        if len(node) == 1 and isinstance(node.get("Ref"), str):
+            return external(node["Ref"], None) or node
+        if len(node) == 1 and "Fn::GetAtt" in node:
+            name, attr = getatt_parts(node["Fn::GetAtt"])
+            return external(name, attr) or node
+        if len(node) == 1 and "Fn::Sub" in node:
+            value = node["Fn::Sub"]
+            string, variables = (value, dict()) if isinstance(value, str) else (value[0], dict(value[1]))
+            variables = dict((k, rewrite(v, external)) for k, v in variables.items())
+            for n in sub_names(value):
+                name, attr = n.split(".", 1) if "." in n else (n, None)
+                replaced = external(name, attr)
+                if replaced:
+                    variable = n.replace(".", "")
+                    string = string.replace("${" + n + "}", "${" + variable + "}")
+                    variables[variable] = replaced
+            return {"Fn::Sub": [string, variables] if variables else string}
+        return dict((k, rewrite(v, external)) for k, v in node.items())
+    if isinstance(node, list):
+        return [rewrite(v, external) for v in node]
+    return node
+
+def resource_order(resources):
+    #Dependencies before the resources using them, otherwise in template order to keep groups together
+    position = dict((name, i) for i, name in enumerate(resources))
+    deps = dict((name, set(d for d in references(r, set()) if d in resources and d != name)) for name, r in resources.items())
+    users = dict((name, []) for name in resources)
+    for name, ds in deps.items():
+        for d in ds:
+            users[d].append(name)
+    waiting = dict((name, len(ds)) for name, ds in deps.items())
+    ready = sorted([name for name, count in waiting.items() if count == 0], key = position.get)
+    order = []
+    while ready:
+        name = ready.pop(0)
+        order.append(name)
+        for u in users[name]:
+            waiting[u] -= 1
+            if waiting[u] == 0:
+                ready.append(u)
+        ready.sort(key = position.get)
+    if len(order) != len(resources):
+        raise(ValueError("Circular references between resources: {}".format(
+            ", ".join(sorted(set(resources) - set(order))))))
+    return order
+
+def partition(resources, order, nested_count = 0):
+    """Fill the parent first, then each nested part, keeping every part under the headroom limits.
+    The parent keeps one resource free for each nested stack, so the partition is redone with a
+    bigger reserve until it holds every nested part.
+    """
+    if nested_count >= int(limits['resources'] * headroom):
+        raise(ValueError("Template needs {} nested stacks, more than its parent can hold".format(nested_count)))
+    budgets = [dict(
+        resources = int(limits['resources'] * headroom) - nested_count,
+        body      = int(limits['body'] * headroom) - parent_reserve['body'],
+    )]
+    parts = [[]]
+    used  = dict(resources = 0, body = 0)
+    for name in order:
+        size = len(template_body({name: resources[name]}))
+        budget = budgets[-1]
+        if parts[-1] and (used['resources'] + 1 > budget['resources'] or used['body'] + size > budget['body']):
+            parts.append([])
+            budgets.append(dict(resources = int(limits['resources'] * headroom), body = int(limits['body'] * headroom)))
+            used = dict(resources = 0, body = 0)
+        parts[-1].append(name)
+        used['resources'] += 1
+        used['body'] += size
+    if len(parts) - 1 > nested_count:
+        return partition(resources, order, len(parts) - 1)
+    return parts
+
+def over_headroom(template_dict, body):
+    return (len(body) > limits['body'] * headroom or
+        len(template_dict.get('Resources', {})) > limits['resources'] * headroom or
+        len(template_dict.get('Outputs', {})) > limits['outputs'] * headroom)
+
+def check_limits(name, template_dict, body):
+    for key, size in [('body', len(body)), ('resources', len(template_dict.get('Resources', {}))),
+            ('outputs', len(template_dict.get('Outputs', {}))), ('parameters', len(template_dict.get('Parameters', {})))]:
+        if size > limits[key]:
+            raise(ValueError("Template {} has {} {}, over the CloudFormation limit of {}".format(name, size, key, limits[key])))
+
+class SplittableTemplate(Template):
+    """ Template without troposphere's resource and output caps. Builders can go past the
+    CloudFormation limits and assemble() splits the result into nested stacks, checking every part.
+    """
+    def add_resource(self, resource):
+        return self._update(self.resources, resource)
+
+    def add_output(self, output):
+        return self._update(self.outputs, output)
+
+class NestedTemplate(object):
+    """ Parent template of a stack split into nested stacks. nested holds the name, S3 key, url
+    and body of each nested template, to upload before the parent is deployed.
+    """
+    def __init__(self, parent, nested):
+        self.parent = parent
+        self.nested = nested
+
+    def to_dict(self):
+        return self.parent
+
+    def to_json(self):
+        return template_body(self.parent, "json")
+
+def dependency_dict(template):
+    #Template dict with the resources and outputs of nested templates, for finding exports and imports
+    template_dict = template.to_dict()
+    if not isinstance(template, NestedTemplate):
+        return template_dict
+    combined = dict(template_dict, Resources = dict(template_dict['Resources']), Outputs = dict(template_dict.get('Outputs', {})))
+    for n in template.nested:
+        combined['Resources'].update(n['template']['Resources'])
+        combined['Outputs'].update(n['template'].get('Outputs', {}))
+    return combined
+
+def assemble(template, stack_name, aws_region, bucket, prefix = None):
+    """Return template as it is while it is well within the CloudFormation limits. Otherwise resources
+    spill, dependencies first, into nested stacks, returned as a NestedTemplate.
+    Nested resources get parent resource values as stack parameters and values of earlier nested
+    stacks through exports, so the nested stacks only depend on earlier ones.
+    """
+    template_dict = template.to_dict()
+    body = template_body(template_dict)
+    if not over_headroom(template_dict, body):
+        return template
+
+    with profiling.span("assemble " + stack_name):
+        resources  = template_dict['Resources']
+        parameters = template_dict.get('Parameters', {})
+        parts = partition(resources, resource_order(resources))
+        part_of = dict((name, i) for i, part in enumerate(parts) for name in part)
+        outputs = [dict() for part in parts]
+        for name, output in template_dict.get('Outputs', {}).items():
+            outputs[max([part_of.get(r, 0) for r in references(output, set())] + [0])][name] = output
+
+        parent = dict((k, v) for k, v in template_dict.items() if k not in ('Resources', 'Outputs'))
+        parent['Resources'] = dict((name, resources[name]) for name in parts[0])
+        if outputs[0]:
+            parent['Outputs'] = outputs[0]
+        nested_templates = [dict() for part in parts]
+        nested = []
+
+        for i in range(1, len(parts)):
+            stack_id = "NestedStack{}".format(i)
+            stack_parameters = dict()
+            part_parameters  = dict()
+            stack_depends    = set()
+
+            def external(name, attr):
+                if name in parameters and name not in stack_parameters:
+                    part_parameters[name] = parameters[name]
+                    value = {"Ref": name}
+                    if parameters[name]['Type'].startswith("List<") or parameters[name]['Type'] == "CommaDelimitedList":
+                        value = {"Fn::Join": [",", value]}
+                    stack_parameters[name] = value
+                if name not in part_of or part_of[name] == i:
+                    return None
+                value_id = name + (attr.replace(".", "") if attr else "")
+                value = {"Fn::GetAtt": [name, attr]} if attr else {"Ref": name}
+                if part_of[name] == 0:
+                    #Values from the parent are passed in as parameters
+                    part_parameters[value_id] = dict(Type = "String")
+                    stack_parameters[value_id] = value
+                    return {"Ref": value_id}
+                #Values from an earlier nested stack are exported there and imported here
+                export_name = "{}-{}".format(stack_name, value_id)
+                nested_templates[part_of[name]].setdefault('Outputs', dict())[value_id] = dict(
+                    Description = "Export of {} for {}".format(value_id, stack_id),
+                    Value  = value,
+                    Export = dict(Name = export_name),
+                )
+                stack_depends.add("NestedStack{}".format(part_of[name]))
+                return import_ref(export_name).to_dict()
+
+            part_resources = dict()
+            for name in parts[i]:
+                resource = rewrite(resources[name], external)
+                depends_on = resource.pop('DependsOn', [])
+                depends_on = [depends_on] if isinstance(depends_on, str) else depends_on
+                local = [d for d in depends_on if part_of.get(d) == i]
+                if local:
+                    resource['DependsOn'] = local
+                for d in depends_on:
+                    if d in part_of and part_of[d] != i:
+                        stack_depends.add(d if part_of[d] == 0 else "NestedStack{}".format(part_of[d]))
+                part_resources[name] = resource
+            part_outputs = rewrite(outputs[i], external)
+            for k in ('Conditions', 'Mappings'):
+                if k in template_dict:
+                    nested_templates[i][k] = rewrite(template_dict[k], external)
+
+            nested_templates[i].update(
+                AWSTemplateFormatVersion = template_dict.get('AWSTemplateFormatVersion', "2010-09-09"),
+                Description = "{} part {}".format(template_dict.get('Description', stack_name), i),
+                Resources = part_resources,
+            )
+            nested_templates[i].setdefault('Outputs', dict()).update(part_outputs)
+            if part_parameters:
+                nested_templates[i]['Parameters'] = part_parameters
+            parent['Resources'][stack_id] = dict(
+                Type = "AWS::CloudFormation::Stack",
+                Properties = dict(Parameters = stack_parameters),
+            )
+            if stack_depends:
+                parent['Resources'][stack_id]['DependsOn'] = sorted(stack_depends)
+
+        #Exports are added to earlier parts by later ones, so bodies and urls are made last
+        for i in range(1, len(parts)):
+            stack_id = "NestedStack{}".format(i)
+            if not nested_templates[i]['Outputs']:
+                del nested_templates[i]['Outputs']
+            nested_body = template_body(nested_templates[i])
+            check_limits("{} {}".format(stack_name, stack_id), nested_templates[i], nested_body)
+            key = template_key(nested_body, prefix or default_prefix)
+            url = template_url(aws_region, bucket, key)
+            parent['Resources'][stack_id]['Properties']['TemplateURL'] = url
+            nested.append(dict(name = stack_id, key = key, url = url, body = nested_body, template = nested_templates[i]))
+
+        assembled = NestedTemplate(parent, nested)
+        check_limits(stack_name, parent, template_body(parent))
+        print("Template {} split into a parent with {} resources and {} nested stacks".format(
+            stack_name, len(parts[0]), len(nested)), file = sys.stderr)
+        return assembled
+
+def upload_nested(s3_client, bucket, deploy_env, stack_templates, prefix = None, max_workers = 4):
+    """Upload the nested templates of every NestedTemplate in stack_templates, a dict of stack name
+    to template, in parallel. prefix is the one given to assemble(). Returns the keys uploaded.
+    """
+    uploads = [(stack_name, n) for stack_name, template in stack_templates.items() for n in getattr(template, 'nested', [])]
+    parent = profiling.current_path()
+
+    def upload(item):
+        stack_name, n = item
+        with profiling.span("upload " + n['key'], parent):
+            key, uploaded = upload_template_body(s3_client, bucket,
+                stack_ref = "{}/{}/{}".format(deploy_env, stack_name, n['name']),
+                body      = n['body'],
+                prefix    = prefix or default_prefix,
+            )
+        print("{} nested template {} {} to {}".format("Uploaded" if uploaded else "Already uploaded", stack_name, n['name'], n['url']))
+        return key if uploaded else None
+
+    if not uploads:
+        return []
+    with ThreadPoolExecutor(max_workers = max_workers) as pool:
+        return [k for k in pool.map(upload, uploads) if k]
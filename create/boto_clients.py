@@ -0,0 +1,65 @@
+import copy
+import json
+import threading
+
+#Larger connection pool for threaded deploys and standard retry mode for throttled API calls
+default_config = dict(
+    max_pool_connections = 32,
+    retries = dict(mode = "standard", max_attempts = 10),
+)
+
+class ClientRegistry(object):
+    """ One boto3 session with clients shared by region, service and client config.
+    Counts client creations and API calls made through the clients.
+    """
+    def __init__(self):
+        self.lock             = threading.Lock()
+        self.session          = None
+        self.clients          = dict()
+        self.client_creations = 0
+        self.api_calls        = dict()
+
+    def get_session(self):
+        import boto3
+        if self.session is None:
+            self.session = boto3.session.Session()
+        return self.session
+
+    def count_call(self, model, **kwargs):
+        name = ".".join([model.service_model.service_name, model.name])
+        with self.lock:
+            self.api_calls[name] = self.api_calls.get(name, 0) + 1
+
+    def client(self, service_name, aws_region = None, **config_options):
+        from botocore.config import Config
+        options = copy.deepcopy(default_config)
+        options.update(config_options)
+        key = (aws_region, service_name, json.dumps(options, sort_keys = True))
+        #Client creation from a shared session is not thread safe
+        with self.lock:
+            if key not in self.clients:
+                c = self.get_session().client(service_name, region_name = aws_region, config = Config(**copy.deepcopy(options)))
+                c.meta.events.register('before-parameter-build', self.count_call)
+                self.clients[key] = c
+                self.client_creations += 1
+            return self.clients[key]
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                client_creations = self.client_creations,
+                api_calls        = sum(self.api_calls.values()),
+                operations       = dict(self.api_calls),
+            )
+
+    def format_stats(self):
+        stats = self.stats()
+        lines = ["boto clients created: {client_creations}, API calls: {api_calls}".format(**stats)]
+        for name, count in sorted(stats['operations'].items(), key = lambda x: -x[1]):
+            lines.append("  {:>6} {}".format(count, name))
+        return "\n".join(lines)
+
+registry = ClientRegistry()
+
+def get_client(service_name, aws_region = None, **config_options):
+    return registry.client(service_name, aws_region, **config_options)
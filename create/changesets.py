@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+no_change_reasons = [
+    "didn't contain changes",
+    "No updates are to be performed",
+]
+
+def change_set_name():
+    return "go-tropo-" + time.strftime("%Y%m%d%H%M%S")
+
+def create_change_set(client, stack_name, name, template_url, change_set_type, options):
+    client.create_change_set(
+        StackName     = stack_name,
+        ChangeSetName = name,
+        TemplateURL   = template_url,
+        ChangeSetType = change_set_type.upper(),
+        **options
+    )
+
+def describe_change_set(client, stack_name, name, delay = 2):
+    #Poll until the change set has finished being created, then read every page of changes
+    while True:
+        r = client.describe_change_set(StackName = stack_name, ChangeSetName = name)
+        if r['Status'] in ("CREATE_COMPLETE", "FAILED"):
+            break
+        time.sleep(delay)
+    changes = list(r.get('Changes', []))
+    while r.get('NextToken'):
+        r = client.describe_change_set(StackName = stack_name, ChangeSetName = name, NextToken = r['NextToken'])
+        changes.extend(r.get('Changes', []))
+    return dict(Status = r['Status'], StatusReason = r.get('StatusReason', ''), Changes = changes)
+
+def plan_change_set(client, stack_name, template_url, change_set_type, options):
+    name = change_set_name()
+    create_change_set(client, stack_name, name, template_url, change_set_type, options)
+    plan = describe_change_set(client, stack_name, name)
+    plan.update(StackName = stack_name, ChangeSetName = name, ChangeSetType = change_set_type)
+    return plan
+
+def plan_change_sets(client, requests, max_workers = 4):
+    """Create change sets and fetch their summaries in parallel.
+    requests is a list of dicts with stack_name, template_url, change_set_type and options.
+    """
+    with ThreadPoolExecutor(max_workers = max(1, max_workers)) as pool:
+        futures = [pool.submit(plan_change_set, client, **r) for r in requests]
+        return [f.result() for f in futures]
+
+def no_changes(plan):
+    return plan['Status'] == "FAILED" and any(r in plan['StatusReason'] for r in no_change_reasons)
+
+def summarise(plan):
+    summary = []
+    for change in plan['Changes']:
+        rc = change.get('ResourceChange', {})
+        summary.append((
+            rc.get('Action', ''),
+            rc.get('LogicalResourceId', ''),
+            rc.get('ResourceType', ''),
+            rc.get('Replacement', ''),
+        ))
+    return summary
+
+def replacements(plan):
+    return [s for s in summarise(plan) if s[3] in ("True", "Conditional")]
+
+def format_plan(plan):
+    stack_name = plan['StackName']
+    if no_changes(plan):
+        return "{}: no changes".format(stack_name)
+    if plan['Status'] == "FAILED":
+        return "{}: change set failed: {}".format(stack_name, plan['StatusReason'])
+    summary = summarise(plan)
+    counts = dict()
+    for action, _, _, _ in summary:
+        counts[action] = counts.get(action, 0) + 1
+    lines = ["{} ({}): {}".format(stack_name, plan['ChangeSetType'],
+        ", ".join(["{} {}".format(v, k) for k,v in sorted(counts.items())]))]
+    for action, logical_id, resource_type, replacement in summary:
+        line = "  {:<7} {} ({})".format(action, logical_id, resource_type)
+        if replacement == "True":
+            line += " REPLACEMENT"
+        elif replacement == "Conditional":
+            line += " possible replacement"
+        lines.append(line)
+    return "\n".join(lines)
+
+def discard_change_set(client, plan):
+    client.delete_change_set(StackName = plan['StackName'], ChangeSetName = plan['ChangeSetName'])
+    if plan['ChangeSetType'] == "create":
+        #Stack created just to hold the change set is left in REVIEW_IN_PROGRESS
+        client.delete_stack(StackName = plan['StackName'])
+
+def execute_change_set(client, plan):
+    client.execute_change_set(StackName = plan['StackName'], ChangeSetName = plan['ChangeSetName'])
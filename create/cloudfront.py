@@ -3,10 +3,11 @@ from troposphere import Parameter, Ref, Template, Retain
 from troposphere.cloudfront import Distribution, DistributionConfig, CacheBehavior
 from troposphere.cloudfront import Origin, DefaultCacheBehavior, ViewerCertificate
 from troposphere.cloudfront import ForwardedValues, CustomOrigin, Logging, S3Origin
-import boto3
+from . import lookups
 
 def find_web_acl(wacl_name, web_acl_name):
-    wa = boto3.client("waf")
+    #WAF classic web acls are global, the client uses the default region
+    list_web_acls = lambda **kwargs: lookups.call(None, "waf", "list_web_acls", **kwargs)
 
     def get_acl(name, wacl_list):
         for w in wacls:
@@ -14,13 +15,13 @@ def find_web_acl(wacl_name, web_acl_name):
                 return w['WebACLId']
         return None
 
-    r = wa.list_web_acls()
+    r = list_web_acls()
     wacls = r['WebACLs']
     found_wa = get_acl(wacl_name, wacls)
     if found_wa:
         return found_wa
     while r.get('NextMarker'):
-        r = wa.list_web_acls(NextMarker = r.get('NextMarker'))
+        r = list_web_acls(NextMarker = r.get('NextMarker'))
         wacls = r['WebACLs']
         found_wa = get_acl(wacl_name, wacls)
         if found_wa:
@@ -1,14 +1,53 @@
 import sys
-import importlib
-import yaml
-from itertools import chain
-from . import meta
+import os
+import hashlib
+import pickle
 from . import yaml_load
+from .utils import cache_path
 
+#Bump when the loader changes what a config parses to
+snapshot_version = 1
 
-def load_yml_file(config_file):
-    with open(config_file, 'r') as f:
-        doc = yaml_load.ordered_load(f, yaml.SafeLoader)
+def content_sha(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def snapshot_file(config_file):
+    path_sha = hashlib.sha256(os.path.abspath(config_file).encode('utf8')).hexdigest()
+    return cache_path("config-{}.pickle".format(path_sha))
+
+def load_snapshot(config_file):
+    #Parsed config, if the config and every file it includes still have the recorded content hashes
+    try:
+        with open(snapshot_file(config_file), 'rb') as f:
+            snapshot = pickle.load(f)
+        if snapshot['version'] != snapshot_version:
+            return None
+        for path, sha in snapshot['files'].items():
+            if content_sha(path) != sha:
+                return None
+        return snapshot['doc']
+    except (IOError, OSError, EOFError, KeyError, pickle.UnpicklingError):
+        return None
+
+def save_snapshot(config_file, files, doc):
+    path = snapshot_file(config_file)
+    #Per process temporary file, render workers can snapshot the same config at once
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(dict(version = snapshot_version, files = files, doc = doc), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def load_yml_file(config_file, use_snapshot = True):
+    if use_snapshot:
+        doc = load_snapshot(config_file)
+        if doc is not None:
+            return doc
+    included = dict()
+    with open(config_file, 'rb') as f:
+        doc = yaml_load.ordered_load(f, yaml_load.SafeLoader, included = included)
+    if use_snapshot:
+        save_snapshot(config_file, included, doc)
     return doc
 
 
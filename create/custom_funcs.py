@@ -1,10 +1,13 @@
 from troposphere import awslambda
 from troposphere import GetAtt, Ref
 from . import iam
-from .utils import file_sha, find_files, create_zip, get_s3_client
+from .utils import file_sha, find_files, get_s3_client
+from .packager import package_files
+from .artifacts import key_exists
+from .profiling import profiled
 from itertools import repeat
-import boto3
 import os
+import tempfile
 
 def remote_filename(local_file):
     sha = file_sha(local_file)
@@ -19,26 +22,35 @@ def upload_lambda_code(s3_bucket, s3_prefix, local_file, sha, lib_files = []):
 
     files = [local_file]
     files.extend(lib_files)
-    upload_body = create_zip(files, local_path)
 
     upload_key = os.path.join(s3_prefix, remote_filename(local_file))
-    s3.put_object(Body = upload_body, Bucket = s3_bucket, Key = upload_key)
+    with tempfile.TemporaryFile() as archive:
+        package_files(files, local_path, archive)
+        archive.seek(0)
+        s3.upload_fileobj(archive, s3_bucket, upload_key)
+
+def lambda_artifact(s3_prefix, lambda_file, lib_files = []):
+    #Lambda code to upload with go_tropo.create.artifacts.upload_artifacts
+    lib_files = list(lib_files)
+    def upload(s3_client, s3_bucket, key):
+        upload_lambda_code(s3_bucket, s3_prefix, lambda_file, None, lib_files)
+    return dict(
+        key         = os.path.join(s3_prefix, remote_filename(lambda_file)),
+        description = "custom fuction code",
+        upload      = upload,
+    )
 
-def check_lambda_code(s3_bucket, s3_prefix, lambda_file, lib_files = []):
+def check_artifact(s3_bucket, artifact):
     s3 = get_s3_client()
+    if not key_exists(s3, s3_bucket, artifact['key']):
+        print("Uploading {} to s3bucket {}".format(artifact['description'], artifact['key']))
+        artifact['upload'](s3, s3_bucket, artifact['key'])
 
-    sha = file_sha(lambda_file)
-    remote_file = remote_filename(lambda_file)
-    prefix = os.path.join(s3_prefix, remote_file)
-    o = s3.list_objects(
-        Bucket = s3_bucket,
-        Prefix = prefix
-    )
-    if not o.get("Contents"):
-        print("Uploading custom fuction code to s3bucket {prefix}".format(prefix=prefix))
-        upload_lambda_code(s3_bucket, s3_prefix, lambda_file, sha, lib_files)
+@profiled()
+def check_lambda_code(s3_bucket, s3_prefix, lambda_file, lib_files = []):
+    check_artifact(s3_bucket, lambda_artifact(s3_prefix, lambda_file, lib_files))
 
-def check_custom_func(deploy_bucket, deploy_env, custom_func_file):
+def custom_func_artifact(deploy_env, custom_func_file):
     import sys
     import os
 
@@ -52,7 +64,11 @@ def check_custom_func(deploy_bucket, deploy_env, custom_func_file):
     local_filepath = "".join([local_path, "/", custom_func_file, ".py"]) #TODO: fix using /
     paths = [os.path.join(l,k) for l,k in zip(repeat(local_path), required_libs)]
     lib_files = find_files(paths)
-    check_lambda_code(deploy_bucket, custom_resource_s3prefix(deploy_env), local_filepath, lib_files = lib_files)
+    return lambda_artifact(custom_resource_s3prefix(deploy_env), local_filepath, lib_files = lib_files)
+
+@profiled()
+def check_custom_func(deploy_bucket, deploy_env, custom_func_file):
+    check_artifact(deploy_bucket, custom_func_artifact(deploy_env, custom_func_file))
 
 def s3_invoke_permissions(template, name, bucket, lambda_ref):
     invoke_perm = template.add_resource(
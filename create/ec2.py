@@ -1,4 +1,3 @@
-import boto3
 from troposphere import elasticloadbalancing
 from troposphere import policies
 from troposphere import autoscaling
@@ -16,11 +15,14 @@ from troposphere import Ref
 from troposphere import ec2
 from troposphere import cloudformation
 from collections import OrderedDict
+import base64
+import functools
+import gzip
+import hashlib
 import os
 from .utils import update_dict
+from . import lookups
 import yaml
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 
 def keyappend(ob, key, value):
     v = ob.get(key)
@@ -29,16 +31,119 @@ def keyappend(ob, key, value):
     else:
         ob[key] = [value]
 
-def add_cloudconf(msg, name, clcfg):
-    cfg = yaml.dump(clcfg, default_flow_style=False)
-    message_part = MIMEText(cfg,"cloud-config",'us-ascii')
-    message_part.add_header('Content-Disposition','attachment; filename='+name)
-    msg.attach(message_part)
+class folded_unicode(str): pass
+class literal_unicode(str): pass
+
+class CloudConfigDumper(yaml.Dumper):
+    #Not the libyaml CDumper, it wraps quoted scripts with tabs differently and would change deployed userdata
+    pass
+
+def folded_unicode_representer(dumper, data):
+    return dumper.represent_scalar(u'tag:yaml.org,2002:str', data, style='>')
+def literal_unicode_representer(dumper, data):
+    return dumper.represent_scalar(u'tag:yaml.org,2002:str', data, style='|')
+
+CloudConfigDumper.add_representer(folded_unicode, folded_unicode_representer)
+CloudConfigDumper.add_representer(literal_unicode, literal_unicode_representer)
+
+def dump_cloud_config(cloudconf):
+    return "".join(["#cloud-config","\n",yaml.dump(cloudconf, Dumper = CloudConfigDumper)])
+
+def trap_signals_file():
+    return dict(
+        content = literal_unicode("".join(
+        [
+            "#Source this /trap.sh in userdata script to call cloudformation signals on exit and err\n"
+            "signal_code() {\n",
+                "signal=$1\n",
+                "#Signal success to cloudformation which can update autoscaling groups\n",
+                "#TODO: Check the state of cloudformation stack and only signal if needed\n",
+                "set +e\n"
+                "/opt/aws/bin/cfn-signal -e ${!signal} --stack ${AWS::StackName} --resource \"${resource_name}\" --region ${AWS::Region}\n",
+                "set -e\n"
+                "echo Signal Sent\n"
+            "}\n",
+            "trap 'signal_code $CODE' EXIT\n",
+            "trap 'signal_code $CODE' ERR\n",
+            "CODE=1\n"
+        ])),
+        path = "/trap.sh",
+        permissions = '0400'
+    )
 
-def find_cloudfront_sec_group(region):
-    ec2 = boto3.client("ec2", region_name = region)
+def wait_signals_file():
+    return dict(
+        content = literal_unicode("".join(
+        [
+            "#Source this /wait.sh in userdata script to call cloudformation wait signals on exit and err\n"
+            "signal_code() {\n",
+                "signal=$1\n",
+                "#Signal success to cloudformation which can update autoscaling groups\n",
+                "#TODO: Check the state of cloudformation stack and only signal if needed\n",
+                "/opt/aws/bin/cfn-signal -e ${!signal} \"${resource_name}\" || echo \"Ignoring signal error\"\n",
+            "}\n",
+            "trap 'signal_code $CODE' EXIT\n",
+            "trap 'signal_code $CODE' ERR\n",
+            "CODE=1\n"
+        ])),
+        path = "/wait.sh",
+        permissions = '0400'
+    )
+
+def env_file(env_values):
+    return dict(
+        content = literal_unicode("".join(
+        [
+            "".join(["export ", k, "=\"", v, "\"\n"]) for k,v in env_values
+        ])),
+        path = "/envs.sh",
+        permissions = '0400'
+    )
 
-    r = ec2.describe_security_groups(Filters=[{'Name':'tag:Name','Values':['cloudfront']}])
+#EC2 limit on raw userdata, before base64 encoding
+userdata_limit = 16384
+#cloud-init write_files encoding for gzip compressed, base64 encoded content
+compressed_encoding = "gz+b64"
+
+def compress_write_file(write_file):
+    #Content with substitutions stays plain so Fn::Sub still sees it
+    content = write_file['content']
+    if "${" in content:
+        return write_file
+    packed = base64.b64encode(gzip.compress(content.encode('utf8'), mtime = 0)).decode('ascii')
+    if len(packed) >= len(content):
+        return write_file
+    return dict(write_file, content = packed, encoding = compressed_encoding)
+
+def userdata_size(node):
+    #Bytes before Fn::Sub values are filled in, Refs joined into userdata count as nothing
+    if isinstance(node, str):
+        return len(node.encode('utf8'))
+    if isinstance(node, list):
+        return sum(userdata_size(n) for n in node)
+    if isinstance(node, dict):
+        if 'Fn::Base64' in node:
+            return userdata_size(node['Fn::Base64'])
+        if 'Fn::Sub' in node:
+            value = node['Fn::Sub']
+            return userdata_size(value if isinstance(value, str) else value[0])
+        if 'Fn::Join' in node:
+            separator, parts = node['Fn::Join']
+            return len(separator) * max(len(parts) - 1, 0) + userdata_size(parts)
+    return 0
+
+def userdata_report(template_dict):
+    #(resource name, userdata bytes) of every launch config and instance, largest first
+    sizes = []
+    for name, resource in template_dict.get('Resources', {}).items():
+        properties = resource.get('Properties', {})
+        userdata = properties.get('UserData', properties.get('LaunchTemplateData', {}).get('UserData'))
+        if userdata is not None:
+            sizes.append((name, userdata_size(userdata)))
+    return sorted(sizes, key = lambda s: (-s[1], s[0]))
+
+def find_cloudfront_sec_group(region):
+    r = lookups.call(region, "ec2", "describe_security_groups", Filters=[{'Name':'tag:Name','Values':['cloudfront']}])
     if r['ResponseMetadata']['HTTPStatusCode'] != 200:
         raise(RuntimeError("Error retrieving cloudfront security group"))
     elif len(r['SecurityGroups']) > 1:
@@ -216,6 +321,7 @@ def app_userdata(ops, app_cfn_options, resource_name):
             cfn_signal       = autoscale_name,
             sub_values       = userdata_vars,
             enable_cre_disk_alarm = ops.get("enable_disk_alarm", False),
+            compress         = ops.get("compress_userdata", False),
     )
     return userdata
 
@@ -507,7 +613,9 @@ def autoscale(template, name, env, lc_name, key_name, sec_grp, iam_profile, app_
 
     return template.add_resource(autoscaling.AutoScalingGroup(name, **asg_dict))
 
-def read_file(f):
+@functools.lru_cache(maxsize = 256)
+def load_file(f, mtime_ns, size):
+    #Non blank lines and their digest, the stat values in the key make edited files load again
     contents = []
     try:
         with open(f, 'r') as fh:
@@ -518,19 +626,24 @@ def read_file(f):
                 contents.append(line)
     except IOError:
         raise IOError('Error opening or reading file: {}'.format(f))
-    return contents
+    return tuple(contents), hashlib.sha256("".join(contents).encode('utf8')).hexdigest()
+
+def file_key(f):
+    try:
+        stat = os.stat(f)
+    except OSError:
+        raise IOError('Error opening or reading file: {}'.format(f))
+    return f, stat.st_mtime_ns, stat.st_size
+
+def read_file(f):
+    return list(load_file(*file_key(f))[0])
+
+def file_digest(f):
+    return load_file(*file_key(f))[1]
 
 def windows_cloudinit(
         powershell_files = None,
         sub_values = None):
-    #TODO: move this. Potentially make multipart userdata Class. From here -->
-    class folded_unicode(str): pass
-    class literal_unicode(str): pass
-
-    def folded_unicode_representer(dumper, data):
-        return dumper.represent_scalar(u'tag:yaml.org,2002:str', data, style='>')
-    def literal_unicode_representer(dumper, data):
-        return dumper.represent_scalar(u'tag:yaml.org,2002:str', data, style='|')
     reserved_sub_values = ['cfn_signal']
 
     if sub_values:
@@ -540,7 +653,6 @@ def windows_cloudinit(
         svals = sub_values.copy()
     else:
         svals = {}
-    #--> to here
 
     cfn_files = {}
     cmds      = {}
@@ -579,14 +691,6 @@ def windows_cloudinit(
 def windows_userdata(
         powershell_files = None,
         sub_values = None):
-    #TODO: move this. Potentially make multipart userdata Class. From here -->
-    class folded_unicode(str): pass
-    class literal_unicode(str): pass
-
-    def folded_unicode_representer(dumper, data):
-        return dumper.represent_scalar(u'tag:yaml.org,2002:str', data, style='>')
-    def literal_unicode_representer(dumper, data):
-        return dumper.represent_scalar(u'tag:yaml.org,2002:str', data, style='|')
     reserved_sub_values = ['cfn_signal']
 
     if sub_values:
@@ -596,22 +700,14 @@ def windows_userdata(
         svals = sub_values.copy()
     else:
         svals = {}
-    #--> to here
-
-    yaml.add_representer(folded_unicode, folded_unicode_representer)
-    yaml.add_representer(literal_unicode, literal_unicode_representer)
 
-    messages = MIMEMultipart()
     cloudconf = dict()
     put_file = ["<powershell>\n"]
     for b in powershell_files:
         put_file.extend(read_file(b))
     put_file.append("\n</powershell>")
     cloudconf["script"] = literal_unicode("".join(put_file))
-    if len(cloudconf) > 0:
-        add_cloudconf(messages, "cloudconf.txt", cloudconf)
-    cloudconf_userdata = "".join(["#cloud-config","\n",str(yaml.dump(cloudconf))])
-    return Base64(Sub(cloudconf_userdata, **svals))
+    return Base64(Sub(dump_cloud_config(cloudconf), **svals))
 
 
 def multipart_userdata(
@@ -624,70 +720,8 @@ def multipart_userdata(
         ip_list = None,
         enable_mem_metrics = True,
         enable_cre_disk_alarm = False,
-        env_vars = None):
-
-    #TODO: move this. Potentially make multipart userdata Class. From here -->
-    import yaml
-    class folded_unicode(str): pass
-    class literal_unicode(str): pass
-
-    def folded_unicode_representer(dumper, data):
-        return dumper.represent_scalar(u'tag:yaml.org,2002:str', data, style='>')
-    def literal_unicode_representer(dumper, data):
-        return dumper.represent_scalar(u'tag:yaml.org,2002:str', data, style='|')
-
-    yaml.add_representer(folded_unicode, folded_unicode_representer)
-    yaml.add_representer(literal_unicode, literal_unicode_representer)
-    def trap_signals_file():
-        return dict(
-            content = literal_unicode("".join(
-            [
-                "#Source this /trap.sh in userdata script to call cloudformation signals on exit and err\n"
-                "signal_code() {\n",
-                    "signal=$1\n",
-                    "#Signal success to cloudformation which can update autoscaling groups\n",
-                    "#TODO: Check the state of cloudformation stack and only signal if needed\n",
-                    "set +e\n"
-                    "/opt/aws/bin/cfn-signal -e ${!signal} --stack ${AWS::StackName} --resource \"${resource_name}\" --region ${AWS::Region}\n",
-                    "set -e\n"
-                    "echo Signal Sent\n"
-                "}\n",
-                "trap 'signal_code $CODE' EXIT\n",
-                "trap 'signal_code $CODE' ERR\n",
-                "CODE=1\n"
-            ])),
-            path = "/trap.sh",
-            permissions = '0400'
-        )
-    def wait_signals_file():
-        return dict(
-            content = literal_unicode("".join(
-            [
-                "#Source this /wait.sh in userdata script to call cloudformation wait signals on exit and err\n"
-                "signal_code() {\n",
-                    "signal=$1\n",
-                    "#Signal success to cloudformation which can update autoscaling groups\n",
-                    "#TODO: Check the state of cloudformation stack and only signal if needed\n",
-                    "/opt/aws/bin/cfn-signal -e ${!signal} \"${resource_name}\" || echo \"Ignoring signal error\"\n",
-                "}\n",
-                "trap 'signal_code $CODE' EXIT\n",
-                "trap 'signal_code $CODE' ERR\n",
-                "CODE=1\n"
-            ])),
-            path = "/wait.sh",
-            permissions = '0400'
-        )
-
-    def env_file(env_values):
-        return dict(
-            content = literal_unicode("".join(
-            [
-                "".join(["export ", k, "=\"", str(v), "\"\n"]) for k,v in env_values.items()
-            ])),
-            path = "/envs.sh",
-            permissions = '0400'
-        )
-    #TODO: --> move
+        env_vars = None,
+        compress = False):
 
     reserved_sub_values = ['cfn_signal']
 
@@ -698,17 +732,34 @@ def multipart_userdata(
         svals = sub_values.copy()
     else:
         svals = {}
+    if cfn_signal:
+        svals['cfn_signal'] = cfn_signal
 
+    #Only the Sub values differ between instances, the cloud-config text is rendered once for each set of files and options
+    cloudconf_userdata = cloud_config(
+        bash_files            = tuple((b, file_digest(b)) for b in bash_files or []),
+        install_packages      = tuple(install_packages or []),
+        cfn_signal            = bool(cfn_signal),
+        awslogs               = awslogs,
+        add_trap_file         = add_trap_file,
+        ip_keys               = tuple(sorted(ip_list.keys())) if ip_list else (),
+        enable_mem_metrics    = enable_mem_metrics,
+        enable_cre_disk_alarm = enable_cre_disk_alarm,
+        env_vars              = tuple((k, str(v)) for k,v in env_vars.items()) if env_vars else (),
+        compress              = compress,
+    )
+    return Base64(Sub(cloudconf_userdata, **svals))
 
-    messages = MIMEMultipart()
+@functools.lru_cache(maxsize = 128)
+def cloud_config(bash_files, install_packages, cfn_signal, awslogs, add_trap_file, ip_keys, enable_mem_metrics, enable_cre_disk_alarm, env_vars, compress):
+    #bash_files are (path, content digest) pairs so the cache key changes with the file contents
     cloudconf = dict()
     put_files = []
 
     if install_packages:
-        cloudconf.update(dict(packages=install_packages))
-    if ip_list:
-        for key,value in sorted(ip_list.items()):
-             keyappend(cloudconf,"runcmd","echo "+key+"= "+"".join(["${",key,"}"])+">>/ips.txt")
+        cloudconf.update(dict(packages=list(install_packages)))
+    for key in ip_keys:
+        keyappend(cloudconf,"runcmd","echo "+key+"= "+"".join(["${",key,"}"])+">>/ips.txt")
 
     if awslogs:
         #TODO: move this out
@@ -757,7 +808,6 @@ def multipart_userdata(
             permissions = '0500'
         )
         put_files.append(cfn_file)
-        svals['cfn_signal'] = cfn_signal
 
     if enable_mem_metrics:
         put_files.append(dict(
@@ -788,7 +838,7 @@ def multipart_userdata(
             put_files.append(wait_signals_file())
         if env_vars:
             put_files.append(env_file(env_vars))
-        for b in bash_files:
+        for b, digest in bash_files:
             script_filename = "/%s.sh" % os.path.basename(b)
             put_files.append(dict(
                 content= literal_unicode("".join(read_file(b))),
@@ -797,14 +847,12 @@ def multipart_userdata(
             ))
             keyappend(cloudconf,"runcmd", script_filename)
 
-    messages = MIMEMultipart()
+    if compress:
+        put_files = [compress_write_file(f) for f in put_files]
+
     if len(put_files) > 0:
         cloudconf.update(dict(write_files = put_files))
-    if len(cloudconf) > 0:
-        add_cloudconf(messages, "cloudconf.txt", cloudconf)
-
-    cloudconf_userdata = "".join(["#cloud-config","\n",str(yaml.dump(cloudconf))])
-    return Base64(Sub(cloudconf_userdata, **svals))
+    return dump_cloud_config(cloudconf)
 
 
 #TODO: add awslogs starting calls
@@ -102,6 +102,9 @@ def s3trigger_custom_resource(template, app_name, deploy_bucket, deploy_env):
 def s3triggers_prefix(deploy_env):
     return deploy_env+"/s3triggers"
 
+def s3trigger_artifact(deploy_env, local_file):
+    return custom_funcs.lambda_artifact(s3triggers_prefix(deploy_env), local_file)
+
 def check_s3trigger_lambda(deploy_bucket, deploy_env, local_file):
     s3_prefix = s3triggers_prefix(deploy_env)
     custom_funcs.check_lambda_code(
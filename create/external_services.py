@@ -1,40 +1,75 @@
 from troposphere.ec2 import SecurityGroupIngress, SecurityGroupEgress
-import boto3
+from . import lookups
+from .boto_clients import get_client
 
 def ec2_client(aws_region):
-    return boto3.client('ec2', region_name = aws_region)
+    return get_client('ec2', aws_region)
 
-def get_sec_id(rule, aws_region):
+#Values allowed in one describe_security_groups filter
+max_filter_values = 200
+
+def check_rule(rule):
     if rule.get("sec_grp_name") and rule.get("sec_grp"):
-        raise(ValueError("Both sec_grp_name and sec_grp given for external service rule {}. Expects either name or id".format(rule)))
-    if rule.get("sec_grp_name"):
-        ec2 = ec2_client(aws_region)
-        descr_grps = ec2.describe_security_groups(
-            Filters=[
-                {
-                    'Name':'tag-key',
-                    'Values':['Name']
-                },
-                {
-                    'Name':'tag-value',
-                    'Values':[rule.get("sec_grp_name")]
-                }
-            ])["SecurityGroups"]
-        if len(descr_grps) == 1:
-            return descr_grps[0]['GroupId']
-        elif len(descr_grps) == 0:
-            raise(Exception("External security group not found: {}".format(rule.get("sec_grp_name"))))
-        else:
-            raise(Exception("Multiple groups found for external security group: {}".format(rule.get("sec_grp_name"))))
-    else:
-        return rule['sec_grp']
+        return "Both sec_grp_name and sec_grp given for external service rule {}. Expects either name or id".format(rule)
+
+def group_names(services_list):
+    #sec_grp_name values used by the rules of each services mapping, in first use order
+    names = []
+    for services in services_list:
+        for service_name, service in services.items():
+            for rule in service:
+                name = rule.get("sec_grp_name")
+                if name and name not in names:
+                    names.append(name)
+    return names
 
-def security_group_rules(template, app_name, aws_region, source_grp, services):
+def describe_named_groups(aws_region, names):
+    #Name tag value to group ids, from one paginated describe_security_groups per filter chunk
+    group_ids = dict((name, []) for name in names)
+    names = sorted(names)
+    for i in range(0, len(names), max_filter_values):
+        params = dict(Filters = [{'Name': 'tag:Name', 'Values': names[i:i + max_filter_values]}])
+        while True:
+            r = lookups.call(aws_region, "ec2", "describe_security_groups", **params)
+            for group in r["SecurityGroups"]:
+                for tag in group.get("Tags", []):
+                    if tag['Key'] == "Name" and tag['Value'] in group_ids and group['GroupId'] not in group_ids[tag['Value']]:
+                        group_ids[tag['Value']].append(group['GroupId'])
+            if not r.get("NextToken"):
+                break
+            params['NextToken'] = r["NextToken"]
+    return group_ids
+
+def resolve_group_names(aws_region, services_list):
+    """Map every sec_grp_name used by the rules in services_list to its security group id.
+    Raises one ValueError listing all invalid rules, missing and ambiguous names.
+    """
+    errors = [e for e in (check_rule(rule) for services in services_list
+        for service in services.values() for rule in service) if e]
+    names = group_names(services_list)
+    group_ids = describe_named_groups(aws_region, names) if names else dict()
+    for name in names:
+        if len(group_ids[name]) == 0:
+            errors.append("External security group not found: {}".format(name))
+        elif len(group_ids[name]) > 1:
+            errors.append("Multiple groups found for external security group {}: {}".format(name, ", ".join(group_ids[name])))
+    if errors:
+        raise(ValueError("\n".join(errors)))
+    return dict((name, ids[0]) for name, ids in group_ids.items())
+
+def get_sec_id(rule, group_ids):
+    if rule.get("sec_grp_name"):
+        return group_ids[rule["sec_grp_name"]]
+    return rule['sec_grp']
 
+def security_group_rules(template, app_name, aws_region, source_grp, services, group_ids = None):
+    #group_ids from resolve_group_names, when names were resolved together with other rules
+    if group_ids is None:
+        group_ids = resolve_group_names(aws_region, [services])
     count = 0
     for service_name, service in services.items():
         for rule in service:
-            sec_id = get_sec_id(rule, aws_region)
+            sec_id = get_sec_id(rule, group_ids)
             for port in rule["ports"]:
                 #add ingress rules into external service security group
                 template.add_resource(
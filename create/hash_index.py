@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import utils
+
+chunk_size = 65536
+
+def default_workers():
+    return min(8, (os.cpu_count() or 1) + 2)
+
+def stat_key(st):
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+def hash_file(filename):
+    #Returns the stat taken before reading with the sha, so a file changed while hashing is re-hashed next time
+    with open(filename, 'rb') as f:
+        st = os.fstat(f.fileno())
+        sha256 = hashlib.sha256()
+        while True:
+            d = f.read(chunk_size)
+            if not d:
+                break
+            sha256.update(d)
+    return st, sha256.hexdigest()
+
+class HashIndex(object):
+    """ Persistent index of file sha256 keyed on absolute path, checked against size, mtime and inode.
+    Only files whose stat changed since they were last hashed are read again. Saving merges the
+    entries hashed here into the file as other processes left it.
+    """
+    def __init__(self, path = None):
+        self.path    = path or utils.cache_path("hash_index.json")
+        self.lock    = threading.Lock()
+        self.changed = set()
+        self.entries = self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return dict()
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            entries = self.load()
+            entries.update((k, self.entries[k]) for k in self.changed)
+            #Per process temporary file, render workers can save the index at once
+            tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+            self.entries = entries
+            self.changed = set()
+
+    def cached_sha(self, filename):
+        entry = self.entries.get(os.path.abspath(filename))
+        if entry and entry[:3] == stat_key(os.stat(filename)):
+            return entry[3]
+        return None
+
+    def record(self, filename, st, sha):
+        with self.lock:
+            path = os.path.abspath(filename)
+            self.entries[path] = stat_key(st) + [sha]
+            self.changed.add(path)
+
+    def file_sha(self, filename):
+        sha = self.cached_sha(filename)
+        if sha is None:
+            st, sha = hash_file(filename)
+            self.record(filename, st, sha)
+        return sha
+
+    def cached_shas(self, files):
+        #All shas from the index without reading any file, or None if any file needs hashing
+        shas = []
+        for f in files:
+            sha = self.cached_sha(f)
+            if sha is None:
+                return None
+            shas.append(sha)
+        return shas
+
+    def file_shas(self, files, workers = None):
+        #Stat checks are cheap, only files missing from the index go to the thread pool
+        shas = [self.cached_sha(f) for f in files]
+        missing = [i for i, sha in enumerate(shas) if sha is None]
+        if missing:
+            with ThreadPoolExecutor(max_workers = workers or default_workers()) as pool:
+                for i, sha in zip(missing, pool.map(self.file_sha, [files[i] for i in missing])):
+                    shas[i] = sha
+        return shas
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = HashIndex()
+        return _index
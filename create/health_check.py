@@ -1,4 +1,3 @@
-import boto3
 from troposphere.iam import Role, Policy
 from troposphere import AWSObject, GetAtt, Join, Ref
 from troposphere import awslambda
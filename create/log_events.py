@@ -0,0 +1,120 @@
+import asyncio
+import datetime
+import json
+import re
+import sys
+import time
+from botocore.exceptions import ClientError
+
+throttle_codes = ("ThrottlingException", "TooManyRequestsException")
+relative_time  = re.compile(r"^(\d+)\s*([smhdw])$")
+time_units     = dict(s = 1, m = 60, h = 3600, d = 86400, w = 604800)
+
+def parse_time(value, now = None):
+    #Epoch milliseconds for an age such as 20m, 2h or 1d, epoch seconds or an ISO 8601 time
+    now = time.time() if now is None else now
+    value = str(value).strip()
+    match = relative_time.match(value)
+    if match:
+        return int((now - int(match.group(1)) * time_units[match.group(2)]) * 1000)
+    if value.isdigit():
+        return int(value) * 1000
+    try:
+        parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise(ValueError("Time '{}' is not an age such as 20m, 2h or 1d, epoch seconds or an ISO 8601 time".format(value)))
+    if parsed.tzinfo is None:
+        parsed = parsed.astimezone()
+    return int(parsed.timestamp() * 1000)
+
+def event_line(event, json_output = False):
+    timestamp = datetime.datetime.fromtimestamp(event['timestamp'] / 1000.0, datetime.timezone.utc)
+    message   = event['message'].rstrip("\r\n")
+    if json_output:
+        return json.dumps(dict(timestamp = timestamp.isoformat(), stream = event['logStreamName'], message = message), sort_keys = True)
+    return "  ".join([timestamp.strftime("%Y-%m-%d %H:%M:%S"), event['logStreamName'], message])
+
+class LogEventTail(object):
+    """ Incrementally read filter_log_events for one stream prefix, or every stream of the group.
+    A page walk cut short by throttling keeps its nextToken and carries on at the next call, walking
+    stays set until a page without a nextToken ends it. A finished walk starts the next one at the
+    newest event, skipping events already returned at that millisecond.
+    """
+    def __init__(self, client, log_group, start, end = None, filter_pattern = None, stream_prefix = None):
+        self.client         = client
+        self.log_group      = log_group
+        self.start          = start
+        self.end            = end
+        self.filter_pattern = filter_pattern
+        self.stream_prefix  = stream_prefix
+        self.token          = None
+        self.walking        = False
+        self.seen           = dict()
+
+    def request(self):
+        kwargs = dict(logGroupName = self.log_group, startTime = self.start)
+        if self.end is not None:
+            kwargs['endTime'] = self.end
+        if self.filter_pattern:
+            kwargs['filterPattern'] = self.filter_pattern
+        if self.stream_prefix:
+            kwargs['logStreamNamePrefix'] = self.stream_prefix
+        if self.token:
+            kwargs['nextToken'] = self.token
+        return kwargs
+
+    def new_events(self):
+        events = []
+        #Set before the first page, a throttled first page leaves the walk still to do
+        self.walking = True
+        while True:
+            try:
+                r = self.client.filter_log_events(**self.request())
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') in throttle_codes:
+                    return events
+                raise
+            for event in r.get('events', []):
+                if event['eventId'] not in self.seen:
+                    self.seen[event['eventId']] = event['timestamp']
+                    events.append(event)
+            self.token = r.get('nextToken')
+            if not self.token:
+                self.walking = False
+                break
+        if self.seen:
+            self.start = max(self.seen.values())
+            self.seen  = dict((k, v) for k, v in self.seen.items() if v == self.start)
+        return events
+
+async def follow_logs(client, log_group, start, end = None, filter_pattern = None, stream_prefixes = None, follow = True,
+        json_output = False, min_delay = 2, max_delay = 10, backoff = 1.5, out = sys.stdout, clock = time.time):
+    """Print events of log_group from start, with the time window, filter pattern and stream prefixes applied
+    by filter_log_events. Each stream prefix has its own tail, read at the same time as the others.
+    Without follow, or once past end, returns after every tail has read all its events. Returns the number
+    of events printed.
+    """
+    loop  = asyncio.get_running_loop()
+    tails = [LogEventTail(client, log_group, start, end, filter_pattern, prefix) for prefix in (stream_prefixes or [None])]
+    delay = min_delay
+    count = 0
+    while True:
+        polled_at = clock() * 1000
+        batches = await asyncio.gather(*[loop.run_in_executor(None, tail.new_events) for tail in tails])
+        #Overlapping prefixes can return the same event
+        events = dict((event['eventId'], event) for batch in batches for event in batch)
+        for event in sorted(events.values(), key = lambda e: (e['timestamp'], e['eventId'])):
+            print(event_line(event, json_output), file = out)
+        count += len(events)
+
+        drained = not any(tail.walking for tail in tails)
+        if drained and (not follow or (end is not None and end <= polled_at)):
+            return count
+        if events:
+            delay = min_delay
+        else:
+            delay = min(delay * backoff, max_delay)
+        await asyncio.sleep(delay)
+
+def tail_logs(client, log_group, start, **kwargs):
+    return asyncio.run(follow_logs(client, log_group, start, **kwargs))
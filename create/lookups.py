@@ -0,0 +1,86 @@
+import json
+import os
+import threading
+import time
+from . import boto_clients
+
+default_ttl = 900
+
+class OfflineLookupError(LookupError):
+    pass
+
+def lookup_key(aws_region, service_name, operation, params):
+    return json.dumps([aws_region, service_name, operation, params], sort_keys = True, default = str)
+
+def load_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return dict()
+
+def save_json(path, data):
+    #Per process temporary file, render workers can save the same cache at once
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent = 1, sort_keys = True, default = str)
+    os.replace(tmp_path, path)
+
+class LookupCache(object):
+    """ Memoise read only AWS calls made while rendering templates.
+
+    Responses are kept in memory for ttl seconds and, when disk_path is set, in a json file
+    shared between runs. In offline mode responses only come from the recorded snapshot file
+    and no AWS call is made. record_path saves every response used into a snapshot file.
+    """
+    def __init__(self, ttl = default_ttl, disk_path = None, offline_path = None, record_path = None):
+        self.ttl          = ttl
+        self.disk_path    = disk_path
+        self.offline_path = offline_path
+        self.record_path  = record_path
+        self.lock         = threading.Lock()
+        self.entries      = load_json(disk_path) if disk_path else dict()
+        self.snapshot     = load_json(offline_path) if offline_path else dict()
+        self.recorded     = dict()
+
+    def fresh(self, entry):
+        return entry and time.time() - entry['time'] < self.ttl
+
+    def call(self, aws_region, service_name, operation, **params):
+        key = lookup_key(aws_region, service_name, operation, params)
+        with self.lock:
+            if self.offline_path:
+                if key not in self.snapshot:
+                    raise(OfflineLookupError("No recorded response for {} {} in {}: {}".format(
+                        service_name, operation, self.offline_path, params)))
+                return self.snapshot[key]['response']
+
+            entry = self.entries.get(key)
+            if not self.fresh(entry):
+                response = getattr(boto_clients.get_client(service_name, aws_region), operation)(**params)
+                #Round trip through json so cached and fresh responses look the same
+                entry = dict(time = time.time(), response = json.loads(json.dumps(response, default = str)))
+                self.entries[key] = entry
+                if self.disk_path:
+                    save_json(self.disk_path, self.entries)
+
+            if self.record_path:
+                self.recorded[key] = entry
+                save_json(self.record_path, self.recorded)
+            return entry['response']
+
+lookup_cache = LookupCache()
+
+def configure(ttl = default_ttl, use_disk = False, offline_path = None, record_path = None):
+    from .utils import cache_path
+    global lookup_cache
+    lookup_cache = LookupCache(
+        ttl          = ttl,
+        disk_path    = cache_path("lookups.json") if use_disk else None,
+        offline_path = offline_path,
+        record_path  = record_path,
+    )
+    return lookup_cache
+
+def call(aws_region, service_name, operation, **params):
+    return lookup_cache.call(aws_region, service_name, operation, **params)
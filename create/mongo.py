@@ -5,8 +5,8 @@ from troposphere.sns import Subscription
 from troposphere import awslambda
 from functools import partial
 import argparse
-import boto3
 import json
+import os
 import sys
 from . import iam as create_iam
 from . import custom_funcs
@@ -16,6 +16,9 @@ import awacs.logs as logs
 import create.network
 from create import export_ref, import_ref
 
+#Uploaded with the other lambda artifacts before any stack is built
+start_stop_lambda = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambdas", "mongo_start_stop_lambda.py"))
+
 
 def mongo_userdata(db_type, db_name, ops, app_cfn_options, db_ips, userdata_file):
 
@@ -31,6 +34,7 @@ def mongo_userdata(db_type, db_name, ops, app_cfn_options, db_ips, userdata_file
                         install_packages = ["docker"],
                         sub_values       = userdata_vars,
                         ip_list          = db_ips,
+                        compress         = ops.get("compress_userdata", False),
                     )
     return userdata_1
 
@@ -116,12 +120,11 @@ def create_lambda_func(template, ops, app_cfn_options):
                                         )
                                       ]
     lambda_mongo_start_stop_iam     = custom_funcs.lambda_iam(template, "LambdaCronRole", lambda_mongo_start_stop_role,)
-    custom_funcs.check_lambda_code(ops.deploy_bucket, deploy_env, "./create_cloudformation/lambdas/mongo_start_stop_lambda.py", lib_files = [])
     lambda_func                     = custom_funcs.lambda_function(
                                                 template,
                                                 "LambdaCronResource",
                                                 deploy_bucket = ops.deploy_bucket,
-                                                local_file    = "./create_cloudformation/lambdas/mongo_start_stop_lambda.py",
+                                                local_file    = start_stop_lambda,
                                                 iam_role      = GetAtt(lambda_mongo_start_stop_iam,"Arn"),
                                                 s3_prefix     =  deploy_env,
                                             )
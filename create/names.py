@@ -0,0 +1,65 @@
+#Resource and export names, without troposphere so commands that only need names start fast
+
+def create_network_names(ops):
+    app_name = ops.app_name
+    net_names = dict(
+        #Subnets
+        app_subnet_names = ["".join([app_name,"Sn","App",key]) for key,val in sorted(ops.app_networks.items())],
+        #Security Groups
+        app_sg_name = app_name+"Sg"+"App",
+        #Network ACL rules
+        app_nacl_name = app_name+"NetAcl"+"App",
+    )
+    if ops.get('elb'):
+        s3_bucket=ops['elb'].get('bucket', 'None')
+    else:
+        s3_bucket=ops.get("elb_bucket")
+
+    if s3_bucket:
+        net_names.update(
+            elb_subnet_names = ["".join([app_name,"Sn","Elb",key]) for key,val in sorted(ops.elb_networks.items())],
+            elb_sg_name = app_name+"Sg"+"Elb",
+            elb_nacl_name = app_name+"NetAcl"+"Elb",
+        )
+
+    if ops.get('tcpstacks'):
+        net_names['tcpstacks'] = dict()
+        for service_name,service_setup in ops.tcpstacks.items():
+            join_sn_name = lambda x: "".join([ops.app_name, "Sn", service_name, x])
+            stack_subnet_names = [join_sn_name(key) for key in sorted(service_setup['networks'].keys())]
+
+            service_net_names = dict(
+                sg_name      = ops.app_name+"Sg"+service_name,
+                subnet_names = stack_subnet_names,
+                nacl_name    = "".join([ops.app_name, "NetAcl", service_name]),
+            )
+
+            if (service_setup['stack_type'] == "rds" ): #TODO: change this to a supported list of types
+                service_net_names['rds_subnet_grp_name'] = app_name + "RDSSnGroup"
+            net_names['tcpstacks'][service_name] = service_net_names
+
+    if s3_bucket:
+        net_names.update(
+            elb_subnet_names = ["".join([app_name,"Sn","Elb",key]) for key,val in sorted(ops.elb_networks.items())],
+            elb_sg_name = app_name+"Sg"+"Elb",
+            elb_nacl_name = app_name+"NetAcl"+"Elb",
+        )
+    return net_names
+
+def create_resource_names(ops):
+    resource_names = dict(
+        ec2_iam_profile = "{app_name}Iam".format(app_name = ops.app_name),
+        log_group       = "{app_name}Logs".format(app_name = ops.app_name)
+    )
+
+    if ops.build_ami:
+        resource_names['build_ami_role'] = "{app_name}BuildAmiLambdaRole".format(app_name = ops.app_name)
+        resource_names['ec2_amibuild_profile'] = "{app_name}AmiBuildInstanceIamProfile".format(app_name = ops.app_name)
+
+    if ops.cloudwatch_alarm:
+        resource_names['cloudwatch_alarm_role'] = "{app_name}CloudwatchAlarmLambdaRole".format(app_name = ops.app_name)
+
+    if ops.get("build_stack_profile"):
+        resource_names['build_stack_profile'] = "{app_name}BuildStackProfile".format(app_name = ops.app_name)
+
+    return resource_names
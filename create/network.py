@@ -1,6 +1,10 @@
+import sys
+import json
+import hashlib
+import ipaddress
 import troposphere.ec2
 from troposphere import Parameter, Ref, Template, Tags
-
+from collections import OrderedDict
 
 from itertools import repeat
 
@@ -101,22 +105,24 @@ def routetable(template, vpc_id, name, subnet, nat_id = None, igw_id = None,
         )
     )
 
-def sg_rule(net, port):
+def parse_port(port):
+    #(protocol, from port, to port) for a port given as 80, "80", "1024:65535" or "53/udp"
     if isinstance(port, int):
-        port_num1 = port
-        port_num2 = port
+        return "tcp", port, port
+    if "/" in port:
+        port_num, proto = port.split('/')
+    else:
+        port_num = port
         proto = "tcp"
+    if ":" in port_num:
+        port_num1, port_num2 = port_num.split(':')
     else:
-        if "/" in port:
-            port_num, proto = port.split('/')
-        else: #TODO: this shouldn't be here twice
-            port_num = port
-            proto = "tcp"
-        if ":" in port_num:
-            port_num1, port_num2= port_num.split(':')
-        else:
-            port_num1 = port_num
-            port_num2 = port_num
+        port_num1 = port_num
+        port_num2 = port_num
+    return proto, port_num1, port_num2
+
+def sg_rule(net, port):
+    proto, port_num1, port_num2 = parse_port(port)
     if net[0:2] == "sg":
         sg_r = troposphere.ec2.SecurityGroupRule(
             IpProtocol = proto,
@@ -133,6 +139,109 @@ def sg_rule(net, port):
         )
     return sg_r
 
+#AWS default for inbound, and separately outbound, rules of one security group
+sg_rule_limit = 60
+#Protocols whose from and to ports are a port range, so adjacent ranges can be merged
+range_protocols = ["tcp", "udp", "6", "17"]
+
+def cidr_network(net):
+    if net[0:2] == "sg":
+        return None
+    try:
+        return ipaddress.ip_network(net, strict = False)
+    except ValueError:
+        return None
+
+def rule_range(net, port):
+    #(net, protocol, from, to) for rules that can be merged, None for anything else
+    proto, port_num1, port_num2 = parse_port(port)
+    if not isinstance(net, str) or str(proto).lower() not in range_protocols:
+        return None
+    try:
+        return net, str(proto).lower(), int(port_num1), int(port_num2)
+    except ValueError:
+        return None
+
+def merge_port_ranges(ranges):
+    #ranges of [order, net, proto, from, to, (net, port) as given], same net and protocol with
+    #overlapping or adjacent ports are joined. The rule as given is kept if it covers the joined range
+    groups = OrderedDict()
+    for r in ranges:
+        groups.setdefault((r[1], r[2]), []).append(r)
+    merged = []
+    for (net, proto), group in groups.items():
+        current = None
+        for r in sorted(group, key = lambda r: (r[3], r[4], r[0])):
+            if current and r[3] <= current[4] + 1:
+                current[0] = min(current[0], r[0])
+                if r[4] > current[4]:
+                    current[4] = r[4]
+                    current[5] = r[5] if r[3] == current[3] else None
+                continue
+            current = list(r)
+            merged.append(current)
+    return merged
+
+def collapse_networks(ranges):
+    #Rules with the same protocol and ports and CIDR blocks that join into a supernet become one rule
+    groups = OrderedDict()
+    for r in ranges:
+        network = cidr_network(r[1])
+        groups.setdefault((r[2], r[3], r[4], network.version if network else r[1]), []).append((r, network))
+    collapsed = []
+    for key, group in groups.items():
+        networks = [n for r, n in group if n]
+        if len(networks) < 2:
+            collapsed.extend(r for r, n in group)
+            continue
+        for supernet in ipaddress.collapse_addresses(networks):
+            members = [(r, n) for r, n in group if n and n.subnet_of(supernet)]
+            given = [r for r, n in members if n == supernet]
+            if given:
+                collapsed.append([min(r[0] for r, n in members)] + given[0][1:])
+            else:
+                #Keep the port as given when a member rule still has it
+                port = next((r[5][1] for r, n in members if r[5]), None)
+                collapsed.append([min(r[0] for r, n in members), str(supernet)] + members[0][0][2:5] +
+                    [(str(supernet), port) if port is not None else None])
+    return collapsed
+
+def compact_rules(rules):
+    """Equivalent, shorter list of (net, port) security group rules. Duplicates are dropped,
+    overlapping or adjacent tcp/udp port ranges are merged and CIDR blocks are collapsed into
+    supernets. Rules keep the position of the first rule they replace.
+    """
+    ranges = []
+    others = []
+    seen   = set()
+    for order, (net, port) in enumerate(rules):
+        r = rule_range(net, port)
+        if r:
+            ranges.append([order] + list(r) + [(net, port)])
+            continue
+        key = (net, str(port)) if isinstance(net, str) else None
+        if key is None or key not in seen:
+            seen.add(key)
+            others.append((order, (net, port)))
+
+    compacted = [(r[0], r[5] or (r[1], format_port(r[2], r[3], r[4])))
+        for r in collapse_networks(merge_port_ranges(ranges))]
+    return [rule for order, rule in sorted(compacted + others, key = lambda r: r[0])]
+
+def format_port(proto, port_num1, port_num2):
+    if port_num1 == port_num2:
+        return "{}/{}".format(port_num1, proto)
+    return "{}:{}/{}".format(port_num1, port_num2, proto)
+
+def compact_sg_rules(name, direction, rules, limit = sg_rule_limit):
+    compacted = compact_rules(rules)
+    if len(compacted) < len(rules):
+        print("Security group {} {}: {} rules compacted to {}".format(name, direction, len(rules), len(compacted)), file = sys.stderr)
+    if len(compacted) > limit:
+        raise(ValueError("Security group {} has {} {} rules after compaction, more than the limit of {}".format(
+            name, len(compacted), direction, limit)))
+    return [sg_rule(net, port) for net, port in compacted]
+
 def sec_group(template, name, in_networks, in_ports, out_ports, ops, custom_rules = None, ssh_hosts = None, ssh_ports = [22]):
     vpc_id      = ops.vpc_id
     billing_id  = ops.billing_id
@@ -140,16 +249,16 @@ def sec_group(template, name, in_networks, in_ports, out_ports, ops, custom_rule
 
     default_out_ports = ['80','443']
 
-    ingress_rules = [sg_rule(net, port) for (net,port) in combine(in_networks, in_ports)]
+    ingress_rules = combine(in_networks, in_ports)
     if ssh_hosts:
         for dhost in sorted(ssh_hosts):
             for p in ssh_ports:
-                ingress_rules.append(sg_rule(dhost, p))
-    egress_rules = [sg_rule('0.0.0.0/0', out_port) for out_port in sorted(out_ports)]
+                ingress_rules.append((dhost, p))
+    egress_rules = [('0.0.0.0/0', out_port) for out_port in sorted(out_ports)]
 
     for dp in default_out_ports:
         if dp not in out_ports:
-            egress_rules.append(sg_rule('0.0.0.0/0', dp))
+            egress_rules.append(('0.0.0.0/0', dp))
 
     #TODO: fix this logic
     if custom_rules:
@@ -159,10 +268,13 @@ def sec_group(template, name, in_networks, in_ports, out_ports, ops, custom_rule
             else:
                 custom_port = str(cr[1])+"/"+cr[3]
             if cr[2] == "egress":
-                egress_rules.append(sg_rule(net=cr[0],port=custom_port))
+                egress_rules.append((cr[0], custom_port))
             else:
-                ingress_rules.append(sg_rule(net=cr[0],port=custom_port))
+                ingress_rules.append((cr[0], custom_port))
 
+    limit = ops.get("sg_rule_limit", sg_rule_limit)
+    ingress_rules = compact_sg_rules(name, "ingress", ingress_rules, limit)
+    egress_rules  = compact_sg_rules(name, "egress", egress_rules, limit)
 
     sg = template.add_resource(
         troposphere.ec2.SecurityGroup(
@@ -200,56 +312,90 @@ def nacl(template, name, vpc_id):
     )
     return Ref(nacl)
 
-def acl_add_networks(template, name, nacl, networks, start_rule = 100, ports=None):
-    for count, netw in enumerate(networks):
-        rule_number = start_rule + count*10
+#Rule number bands. Entries a stack adds to its own network ACLs and entries the network stack
+#adds to ACLs imported from tcpstacks never share numbers, so each stack can be updated on its own
+acl_bands = dict(
+    local    = (100, 9999),
+    imported = (10000, 19999),
+)
+
+def acl_key(nacl):
+    #Ref or ImportValue of the ACL, as a string
+    return json.dumps(nacl.to_dict(), sort_keys = True) if hasattr(nacl, 'to_dict') else str(nacl)
+
+def egress_flag(egress):
+    return egress in (True, 'true')
+
+class AclPlanner(object):
+    """ Rule numbers for the network ACL entries of one template. Numbers come from a hash of the
+    entry, so adding, removing or reordering networks leaves the numbers and logical ids of the
+    other entries unchanged. Numbers already used in the same ACL and direction, by any
+    AclFactory or acl_add_networks call, move on to the next free number.
+    """
+    def __init__(self):
+        self.used    = dict()
+        self.planned = dict()
+
+    def plan(self, nacl, egress, content, band = 'local'):
+        #(rule number, True) for a new entry, (rule number, False) for an entry already planned
+        acl = (acl_key(nacl), egress_flag(egress))
+        if (acl, content) in self.planned:
+            return self.planned[(acl, content)], False
+        low, high = acl_bands[band]
+        size = high - low + 1
+        used = self.used.setdefault(acl, set())
+        start = int(hashlib.sha256(content.encode('utf8')).hexdigest(), 16) % size
+        for i in range(size):
+            rule_number = low + (start + i) % size
+            if rule_number not in used:
+                used.add(rule_number)
+                self.planned[(acl, content)] = rule_number
+                return rule_number, True
+        raise(ValueError("No free {} rule numbers left in network ACL {}".format(band, acl[0])))
+
+def acl_planner(template):
+    #Kept on the template, troposphere templates hash by their contents so cannot be dict keys
+    if not hasattr(template, 'acl_planner'):
+        template.acl_planner = AclPlanner()
+    return template.acl_planner
+
+def acl_entry(template, name, nacl, cidr, egress, protocol = '-1', from_port = None, to_port = None, band = 'local'):
+    #Adds an allow entry numbered by the template's planner. Duplicate entries are only added once
+    content = "|".join(str(v) for v in [protocol, cidr, from_port, to_port])
+    rule_number, new = acl_planner(template).plan(nacl, egress, content, band)
+    if not new:
+        return None
+    rulename = 'OutRule' if egress_flag(egress) else 'InRule'
+    entry = dict(
+        NetworkAclId = nacl,
+        RuleNumber   = rule_number,
+        Protocol     = protocol,
+        CidrBlock    = cidr,
+        Egress       = egress,
+        RuleAction   = "Allow"
+    )
+    if from_port is not None:
+        entry['PortRange'] = troposphere.ec2.PortRange(From=from_port, To=to_port)
+    return template.add_resource(troposphere.ec2.NetworkAclEntry(name+rulename+str(rule_number), **entry))
+
+def acl_add_networks(template, name, nacl, networks, band = 'local', ports=None):
+    """Allow entries in both directions for each network. ports is a list of 'protocol|port|InRule'
+    or 'protocol|from|to|OutRule' strings, all traffic is allowed without it.
+    """
+    for netw in networks:
         for rulename in ['InRule','OutRule']:
             egress = dict(InRule = False, OutRule = True)
             if ports == None:
-                template.add_resource(
-                    troposphere.ec2.NetworkAclEntry(
-                        name+rulename+str(rule_number),
-                        NetworkAclId = nacl,
-                        RuleNumber   = rule_number,
-                        Protocol     = '-1', #TODO config for protocol
-                        CidrBlock    = netw,
-                        Egress       = egress[rulename],
-                        RuleAction   = "Allow"
-                    )
-                )
+                acl_entry(template, name, nacl, netw, egress[rulename], band = band) #TODO config for protocol
             else:
-                for proto_port_number in enumerate(ports):
-                    proto_port_list=proto_port_number[-1].split("|")
-                    if proto_port_list[-1] == rulename:
-                        if len(proto_port_list) == 3:
-                            template.add_resource(
-                                troposphere.ec2.NetworkAclEntry(
-                                    name + rulename + str(rule_number),
-                                    NetworkAclId=nacl,
-                                    RuleNumber=rule_number,
-                                    Protocol=proto_port_list[0],  # TODO config for protocol
-                                    CidrBlock=netw,
-                                    Egress=egress[rulename],
-                                    RuleAction="Allow",
-                                    PortRange=troposphere.ec2.PortRange(From=proto_port_list[1], To=proto_port_list[1])
-                            )
-                         )
-                            rule_number = rule_number + 10
-                        elif len(proto_port_list) == 4:
-                            template.add_resource(
-                                troposphere.ec2.NetworkAclEntry(
-                                    name + rulename + str(rule_number),
-                                    NetworkAclId=nacl,
-                                    RuleNumber=rule_number,
-                                    Protocol=proto_port_list[0],  # TODO config for protocol
-                                    CidrBlock=netw,
-                                    Egress=egress[rulename],
-                                    RuleAction="Allow",
-                                    PortRange=troposphere.ec2.PortRange(From=proto_port_list[1], To=proto_port_list[2])
-                                )
-                            )
-                            rule_number = rule_number + 10
-    return start_rule + (count*10) + 10
+                for proto_port in ports:
+                    proto_port_list = proto_port.split("|")
+                    if proto_port_list[-1] != rulename:
+                        continue
+                    from_port = proto_port_list[1]
+                    to_port   = proto_port_list[2] if len(proto_port_list) == 4 else from_port
+                    acl_entry(template, name, nacl, netw, egress[rulename], protocol = proto_port_list[0],
+                        from_port = from_port, to_port = to_port, band = band)
 
 #TODO doesn't seem the best to have this class add to CF template directly, consider alternatives
 class AclFactory(object):
@@ -261,8 +407,6 @@ class AclFactory(object):
         self.in_ports       = in_ports
         self.in_networks    = in_networks
         self.out_networks   = out_networks
-        self.in_rule_count  = 0
-        self.out_rule_count = 0
 
         add_nacl_rule = self.add_nacl_rule
 
@@ -327,28 +471,10 @@ class AclFactory(object):
 
 
     def add_nacl_rule(self, network, port, to_port=None, egress='false'):
-        if egress == 'false':
-            rule_number = 100 + self.in_rule_count*10
-            nacl_name = self.name+"InRule"+str(rule_number)
-            self.in_rule_count += 1
-        else:
-            rule_number = 100 + self.out_rule_count*10
-            nacl_name = self.name+"OutRule"+str(rule_number)
-            self.out_rule_count += 1
         if to_port is None:
             to_port = port
-        self.template.add_resource(
-            troposphere.ec2.NetworkAclEntry(
-                nacl_name,
-                NetworkAclId = self.nacl,
-                RuleNumber   = rule_number,
-                Protocol     = '6', #TODO config for protocol
-                CidrBlock    = network,
-                PortRange    = troposphere.ec2.PortRange(From=port, To=to_port),
-                Egress       = egress,
-                RuleAction   = "Allow"
-            )
-        )
+        acl_entry(self.template, self.name, self.nacl, network, egress,
+            protocol = '6', from_port = port, to_port = to_port) #TODO config for protocol
 
     def create_ephemeral_rules(self):
         """ Create rules for all unique networks to
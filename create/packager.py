@@ -0,0 +1,122 @@
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+chunk_size = 65536
+#Compressed files larger than this are spooled to disk while waiting to be written
+spool_size = 1024 * 1024
+#Fixed timestamp (1980-01-01 00:00) so the same files always give the same archive
+dos_time = 0
+dos_date = (1 << 5) | 1
+utf8_flag = 0x800
+zipfile_deflated = 8
+zip_limit = 0xFFFFFFFF
+
+def default_workers():
+    return min(8, (os.cpu_count() or 1) + 2)
+
+def compress_file(path):
+    """Read path once, returning its sha256, crc, sizes and raw deflate data in a spooled file"""
+    sha256 = hashlib.sha256()
+    crc    = 0
+    size   = 0
+    comp   = zlib.compressobj(6, zlib.DEFLATED, -15)
+    data   = tempfile.SpooledTemporaryFile(max_size = spool_size)
+    with open(path, 'rb') as f:
+        st = os.fstat(f.fileno())
+        while True:
+            d = f.read(chunk_size)
+            if not d:
+                break
+            sha256.update(d)
+            crc = zlib.crc32(d, crc)
+            size += len(d)
+            data.write(comp.compress(d))
+    data.write(comp.flush())
+    compressed_size = data.tell()
+    data.seek(0)
+    executable = st.st_mode & 0o111
+    return dict(sha = sha256.hexdigest(), crc = crc & 0xFFFFFFFF, size = size, stat = st,
+        compressed_size = compressed_size, data = data, mode = 0o755 if executable else 0o644)
+
+class ZipWriter(object):
+    """ Minimal zip writer for already deflated entries """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset  = 0
+        self.central = []
+
+    def write(self, b):
+        self.fileobj.write(b)
+        self.offset += len(b)
+
+    def add(self, arcname, entry):
+        if entry['size'] > zip_limit or entry['compressed_size'] > zip_limit or self.offset > zip_limit:
+            raise(ValueError("File {} too large for zip archive".format(arcname)))
+        name = arcname.encode('utf8')
+        header_offset = self.offset
+        self.write(struct.pack('<4s5H3L2H', b'PK\x03\x04', 20, utf8_flag, zipfile_deflated,
+            dos_time, dos_date, entry['crc'], entry['compressed_size'], entry['size'], len(name), 0))
+        self.write(name)
+        while True:
+            d = entry['data'].read(chunk_size)
+            if not d:
+                break
+            self.write(d)
+        entry['data'].close()
+        self.central.append(struct.pack('<4s6H3L5H2L', b'PK\x01\x02', (3 << 8) | 20, 20, utf8_flag, zipfile_deflated,
+            dos_time, dos_date, entry['crc'], entry['compressed_size'], entry['size'], len(name), 0, 0, 0, 0,
+            (0o100000 | entry['mode']) << 16, header_offset) + name)
+
+    def close(self):
+        if len(self.central) > 0xFFFF:
+            raise(ValueError("Too many files for zip archive"))
+        cd_offset = self.offset
+        for c in self.central:
+            self.write(c)
+        self.write(struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, len(self.central), len(self.central),
+            self.offset - cd_offset, cd_offset, 0))
+
+def arcname(f, root_path):
+    return os.path.relpath(f, start = root_path).replace(os.sep, "/")
+
+def package_files(files, root_path, fileobj, workers = None, index = None):
+    """Write a reproducible zip of files to fileobj: entries sorted by name with fixed timestamps.
+    Files are read once each and compressed on a thread pool. Returns sorted [(arcname, sha256)].
+    File shas are recorded in index when given.
+    """
+    workers = workers or default_workers()
+    entries = sorted([(arcname(f, root_path), f) for f in files])
+    writer  = ZipWriter(fileobj)
+    shas    = []
+    pending = deque()
+    todo    = iter(entries)
+    with ThreadPoolExecutor(max_workers = workers) as pool:
+        #Only keep a few files ahead of the writer so compressed data does not pile up in memory
+        for name, f in todo:
+            pending.append((name, pool.submit(compress_file, f)))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            name, future = pending.popleft()
+            entry = future.result()
+            if index is not None:
+                index.record(os.path.join(root_path, name), entry['stat'], entry['sha'])
+            writer.add(name, entry)
+            shas.append((name, entry['sha']))
+            for next_name, f in todo:
+                pending.append((next_name, pool.submit(compress_file, f)))
+                break
+    writer.close()
+    return shas
+
+def shas_digest(shas):
+    #sha of the sorted (name, file sha) pairs, stable for the same file names and contents
+    sha256 = hashlib.sha256()
+    for name, sha in shas:
+        sha256.update("".join([name, sha]).encode('utf8'))
+    return sha256.hexdigest()
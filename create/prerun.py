@@ -1,16 +1,79 @@
-from troposphere import Export
 import importlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import profiling
+from .lookups import load_json, save_json
 
 supported_keys = dict(
     var_export = "Name of exported value that will hold return string from given function",
     function   = "Function to call, expects string return value",
-    function_args = "Arguments as key=value pairs for function call"
+    function_args = "Arguments as key=value pairs for function call",
+    cache_ttl  = "Seconds the return string is reused from the local cache for the same function, function_args and dry run",
 )
 
+max_workers = 8
+
+def result_key(item_setup, dry_run):
+    return json.dumps([item_setup['function'], item_setup['function_args'], dry_run], sort_keys = True, default = str)
+
+class ResultCache(object):
+    """ Return strings of prerun items with a cache_ttl, kept in a json file between runs.
+    The file is read again before each write so processes rendering at the same time keep each other's results.
+    refresh ignores cached results, fresh results are still saved.
+    """
+    def __init__(self, disk_path = None, refresh = False):
+        self.disk_path = disk_path
+        self.refresh   = refresh
+        self.lock      = threading.Lock()
+        self.entries   = load_json(disk_path) if disk_path else dict()
+
+    def get(self, key, ttl):
+        with self.lock:
+            entry = self.entries.get(key)
+            if self.refresh or not entry or time.time() - entry['time'] >= ttl:
+                return None
+            return entry['value']
+
+    def put(self, key, value):
+        with self.lock:
+            if self.disk_path:
+                self.entries.update(load_json(self.disk_path))
+            self.entries[key] = dict(time = time.time(), value = value)
+            if self.disk_path:
+                save_json(self.disk_path, self.entries)
+
+result_cache = None
+
+def configure(refresh = False):
+    from .utils import cache_path
+    global result_cache
+    result_cache = ResultCache(disk_path = cache_path("prerun.json"), refresh = refresh)
+    return result_cache
+
+def get_result_cache():
+    if result_cache is None:
+        configure()
+    return result_cache
+
+@profiling.profiled("prerun.call")
 def call(template, prerun_items, dry_run):
+    #Items run at the same time, the mapping keeps the config order
+    for v in prerun_items.values():
+        check_keys(v)
+    parent = profiling.current_path()
+
+    def run(item):
+        k, v = item
+        with profiling.span("prerun " + k, parent):
+            return run_item(v, dry_run)
+
+    with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(prerun_items)))) as pool:
+        item_values = list(pool.map(run, prerun_items.items()))
+
     prerun_values = dict()
-    for k,v in prerun_items.items():
-        item_value = run_item(v, dry_run)
+    for k, item_value in zip(prerun_items.keys(), item_values):
         prerun_values[k.replace("_","-")] = dict(ReturnString = item_value)
     template.add_mapping("PrerunValues", prerun_values)
 
@@ -21,7 +84,16 @@ def check_keys(item_setup):
 
 def run_item(item_setup, dry_run):
     check_keys(item_setup)
+    ttl = item_setup.get('cache_ttl')
+    if ttl:
+        key = result_key(item_setup, dry_run)
+        cached = get_result_cache().get(key, ttl)
+        if cached is not None:
+            return cached
     func_str = item_setup['function'].split(".")
     lib = importlib.import_module(".".join(func_str[:-1]))
     func = getattr(lib, func_str[-1])
-    return func(dry_run = dry_run, **item_setup['function_args'])
+    value = func(dry_run = dry_run, **item_setup['function_args'])
+    if ttl:
+        get_result_cache().put(key, value)
+    return value
@@ -0,0 +1,135 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+class Profiler(object):
+    """ Records nested timing spans per thread while enabled.
+
+    summary() gives a flame style tree of total and self time for each span path and
+    chrome_trace() a trace event document that can be loaded in chrome://tracing or Perfetto.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.lock    = threading.Lock()
+        self.local   = threading.local()
+        self.records = []
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def current_path(self):
+        stack = self.stack()
+        return stack[-1]['path'] if stack else ()
+
+    @contextlib.contextmanager
+    def span(self, name, parent = None):
+        #parent places a span started in a worker thread under a span path of the submitting thread
+        if not self.enabled:
+            yield
+            return
+        stack  = self.stack()
+        if stack or parent is None:
+            parent = self.current_path()
+        record = dict(
+            name       = name,
+            path       = parent + (name,),
+            thread     = threading.current_thread().name,
+            tid        = threading.get_ident(),
+            child_time = 0.0,
+            start      = time.perf_counter(),
+        )
+        stack.append(record)
+        try:
+            yield
+        finally:
+            record['end'] = time.perf_counter()
+            stack.pop()
+            if stack:
+                stack[-1]['child_time'] += record['end'] - record['start']
+            with self.lock:
+                self.records.append(record)
+
+    def spans(self):
+        with self.lock:
+            return sorted(self.records, key = lambda r: r['start'])
+
+    def summary(self, width = 30):
+        records = self.spans()
+        if not records:
+            return "No profile spans recorded"
+        wall = max(r['end'] for r in records) - min(r['start'] for r in records)
+        paths = []
+        totals = dict()
+        for r in records:
+            if r['path'] not in totals:
+                paths.append(r['path'])
+                totals[r['path']] = dict(total = 0.0, self_time = 0.0, calls = 0)
+            t = totals[r['path']]
+            t['total']     += r['end'] - r['start']
+            t['self_time'] += r['end'] - r['start'] - r['child_time']
+            t['calls']     += 1
+
+        #Children follow their parent, in order of first start
+        order = dict((p, i) for i, p in enumerate(paths))
+        def tree_key(path):
+            return [order.get(path[:i + 1], len(order)) for i in range(len(path))]
+
+        lines = ["{:>9} {:>9} {:>6}  {}".format("total s", "self s", "calls", "span (bar is share of {:.3f}s wall time)".format(wall))]
+        for path in sorted(paths, key = tree_key):
+            t = totals[path]
+            bar = "#" * max(1, int(round(width * min(t['total'] / wall, 1.0)))) if wall else ""
+            lines.append("{:>9.3f} {:>9.3f} {:>6}  {}{} {}".format(
+                t['total'], t['self_time'], t['calls'], "  " * (len(path) - 1), path[-1], bar))
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        records = self.spans()
+        start = records[0]['start'] if records else 0
+        pid = os.getpid()
+        events = []
+        threads = dict()
+        for r in records:
+            threads[r['tid']] = r['thread']
+            events.append(dict(
+                name = r['name'],
+                cat  = "go_tropo",
+                ph   = "X",
+                ts   = round((r['start'] - start) * 1e6, 1),
+                dur  = round((r['end'] - r['start']) * 1e6, 1),
+                pid  = pid,
+                tid  = r['tid'],
+            ))
+        for tid, thread_name in threads.items():
+            events.append(dict(name = "thread_name", ph = "M", pid = pid, tid = tid, args = dict(name = thread_name)))
+        return dict(traceEvents = events, displayTimeUnit = "ms")
+
+    def write_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+profiler = Profiler()
+
+def enable():
+    profiler.enabled = True
+
+def span(name, parent = None):
+    return profiler.span(name, parent)
+
+def current_path():
+    return profiler.current_path()
+
+def profiled(name = None):
+    #Decorator recording a span for each call, named after the function by default
+    def decorator(func):
+        span_name = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,126 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def find_values(obj, key):
+    #Yield every value stored under key anywhere in a template dict
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k == key:
+                yield v
+            else:
+                for found in find_values(v, key):
+                    yield found
+    elif isinstance(obj, list):
+        for item in obj:
+            for found in find_values(item, key):
+                yield found
+
+def template_exports(template_dict):
+    exports = set()
+    for output in template_dict.get("Outputs", {}).values():
+        name = output.get("Export", {}).get("Name")
+        if isinstance(name, str):
+            exports.add(name)
+    return exports
+
+def template_imports(template_dict):
+    return set([i for i in find_values(template_dict, "Fn::ImportValue") if isinstance(i, str)])
+
+def stack_dependencies(templates):
+    """Map each stack to the stacks it imports values from.
+    templates is a dict of stack name to template dict. Imports exported by
+    stacks outside of templates are assumed to already exist.
+    """
+    exporters = dict()
+    for stack_name, template_dict in templates.items():
+        for export_name in template_exports(template_dict):
+            exporters[export_name] = stack_name
+
+    dependencies = OrderedDict()
+    for stack_name, template_dict in templates.items():
+        dependencies[stack_name] = set([
+            exporters[i] for i in template_imports(template_dict)
+            if i in exporters and exporters[i] != stack_name
+        ])
+    check_cycles(dependencies)
+    return dependencies
+
+def check_cycles(dependencies):
+    remaining = {k:set(v) for k,v in dependencies.items()}
+    while remaining:
+        ready = [k for k,v in remaining.items() if not v]
+        if not ready:
+            raise(ValueError("Circular export/import dependency between stacks: {}".format(", ".join(sorted(remaining)))))
+        for k in ready:
+            del remaining[k]
+        for v in remaining.values():
+            v.difference_update(ready)
+
+class StackScheduler(object):
+    """ Run stack deployments in dependency order, running independent stacks at the same time """
+    def __init__(self, dependencies, exec_stack, max_workers = 4, out = sys.stderr):
+        self.dependencies = dependencies
+        self.exec_stack   = exec_stack
+        self.max_workers  = max(1, max_workers)
+        self.out          = out
+        self.status       = OrderedDict((s, "pending") for s in dependencies)
+        self.print_lock   = threading.Lock()
+
+    def report(self, stack_name, message):
+        with self.print_lock:
+            print("[{}] {}".format(stack_name, message), file = self.out)
+
+    def skip_blocked(self):
+        #Repeat until nothing changes so every transitive dependent of a failed stack is skipped, whatever the order
+        changed = True
+        while changed:
+            changed = False
+            for stack_name, status in self.status.items():
+                if status == "pending" and any(self.status[d] in ("failed", "skipped") for d in self.dependencies[stack_name]):
+                    self.status[stack_name] = "skipped"
+                    self.report(stack_name, "skipped, dependency failed")
+                    changed = True
+
+    def ready_stacks(self):
+        self.skip_blocked()
+        return [stack_name for stack_name, status in self.status.items()
+            if status == "pending" and all(self.status[d] == "complete" for d in self.dependencies[stack_name])]
+
+    def timed_exec(self, stack_name):
+        start = time.time()
+        self.exec_stack(stack_name)
+        return time.time() - start
+
+    def run(self):
+        for stack_name, deps in self.dependencies.items():
+            if deps:
+                self.report(stack_name, "waiting on {}".format(", ".join(sorted(deps))))
+
+        running = dict()
+        with ThreadPoolExecutor(max_workers = self.max_workers) as pool:
+            while True:
+                for stack_name in self.ready_stacks():
+                    if len(running) >= self.max_workers:
+                        break
+                    self.status[stack_name] = "running"
+                    self.report(stack_name, "started")
+                    running[pool.submit(self.timed_exec, stack_name)] = stack_name
+                if not running:
+                    break
+                done, _ = wait(running, return_when = FIRST_COMPLETED)
+                for future in done:
+                    stack_name = running.pop(future)
+                    try:
+                        elapsed = future.result()
+                        self.status[stack_name] = "complete"
+                        self.report(stack_name, "complete in {:.0f}s".format(elapsed))
+                    except Exception as e:
+                        self.status[stack_name] = "failed"
+                        self.report(stack_name, "FAILED: {}".format(e))
+        return self.status
+
+def run_stacks(dependencies, exec_stack, max_workers = 4):
+    return StackScheduler(dependencies, exec_stack, max_workers).run()
@@ -0,0 +1,358 @@
+import ipaddress
+
+#Declarative schema for the config yaml. Nodes built with field() are compiled once into check
+#functions that collect every problem in one pass, so a bad config fails before any prerun or upload.
+
+kinds = dict(
+    str     = (str,),
+    int     = (int,),
+    number  = (int, float),
+    bool    = (bool,),
+    scalar  = (str, int, float),
+    list    = (list,),
+    mapping = (dict,),
+    cidr    = (str,),
+    any     = (object,),
+)
+
+def field(kind, required = False, keys = None, values = None, items = None, choices = None, length = None,
+        extra = True, ref = None, switch = None, implies = None, root_requires = None, check = None):
+    """ Schema node.
+    keys:    dict of field nodes for the known keys of a mapping
+    values:  node every value of a mapping must match
+    items:   node every item of a list must match
+    choices: allowed values
+    length:  (min, max) length of a list
+    extra:   False to reject mapping keys not in keys
+    ref:     top level mapping whose keys the mapping keys, or the value, must be one of
+    switch:  (key, cases), the cases node is also checked when the mapping's key has that value
+    implies: dict of key: [keys] required in the mapping when key is set
+    root_requires: keys required at the top of the config wherever this node is used
+    check:   extra function(value, path, errors, config)
+    """
+    return dict(kind = kind, required = required, keys = keys, values = values, items = items, choices = choices,
+        length = length, extra = extra, ref = ref, switch = switch, implies = implies,
+        root_requires = root_requires, check = check)
+
+def join_path(path, key):
+    return "{}.{}".format(path, key) if path else str(key)
+
+def describe(value):
+    return type(value).__name__ if value is not None else "nothing"
+
+def compile_node(node):
+    types  = kinds[node['kind']]
+    checks = []
+
+    if node['kind'] == 'cidr':
+        def check_cidr(value, path, errors, config):
+            try:
+                ipaddress.ip_network(value, strict = False)
+            except ValueError:
+                errors.append("{}: '{}' is not a CIDR block".format(path, value))
+        checks.append(check_cidr)
+
+    if node['choices']:
+        choices = node['choices']
+        def check_choices(value, path, errors, config):
+            if value not in choices:
+                errors.append("{}: '{}' is not one of {}".format(path, value, ", ".join(str(c) for c in choices)))
+        checks.append(check_choices)
+
+    if node['length']:
+        low, high = node['length']
+        def check_length(value, path, errors, config):
+            if not low <= len(value) <= high:
+                expected = str(low) if low == high else "{} to {}".format(low, high)
+                errors.append("{}: expected {} items, got {}".format(path, expected, len(value)))
+        checks.append(check_length)
+
+    if node['ref']:
+        ref = node['ref']
+        def check_ref(value, path, errors, config):
+            known = config.get(ref)
+            if not isinstance(known, dict):
+                return
+            for k in (value.keys() if isinstance(value, dict) else [value]):
+                if k not in known:
+                    errors.append("{}: '{}' is not defined in {}".format(path, k, ref))
+        checks.append(check_ref)
+
+    if node['root_requires']:
+        root_requires = node['root_requires']
+        def check_root_requires(value, path, errors, config):
+            for k in root_requires:
+                if k not in config:
+                    errors.append("{}: required by {}".format(k, path))
+        checks.append(check_root_requires)
+
+    if node['keys']:
+        known = [(k, sub['required'], compile_node(sub)) for k, sub in node['keys'].items()]
+        extra = node['extra']
+        def check_keys(value, path, errors, config):
+            for k, required, sub_check in known:
+                if k in value:
+                    sub_check(value[k], join_path(path, k), errors, config)
+                elif required:
+                    errors.append("{}: required".format(join_path(path, k)))
+            if not extra:
+                for k in value.keys():
+                    if k not in node['keys']:
+                        errors.append("{}: not supported, expected one of {}".format(
+                            join_path(path, k), ", ".join(node['keys'].keys())))
+        checks.append(check_keys)
+
+    if node['implies']:
+        implies = node['implies']
+        def check_implies(value, path, errors, config):
+            for k, needed in implies.items():
+                if value.get(k):
+                    for n in needed:
+                        if n not in value:
+                            errors.append("{}: required when {} is set".format(join_path(path, n), k))
+        checks.append(check_implies)
+
+    if node['values']:
+        value_check = compile_node(node['values'])
+        def check_values(value, path, errors, config):
+            for k, v in value.items():
+                value_check(v, join_path(path, k), errors, config)
+        checks.append(check_values)
+
+    if node['items']:
+        item_check = compile_node(node['items'])
+        def check_items(value, path, errors, config):
+            for i, v in enumerate(value):
+                item_check(v, "{}[{}]".format(path, i), errors, config)
+        checks.append(check_items)
+
+    if node['switch']:
+        switch_key, cases = node['switch']
+        case_checks = {k: compile_node(case) for k, case in cases.items()}
+        def check_switch(value, path, errors, config):
+            case_check = case_checks.get(value.get(switch_key))
+            if case_check:
+                case_check(value, path, errors, config)
+        checks.append(check_switch)
+
+    if node['check']:
+        checks.append(node['check'])
+
+    def check(value, path, errors, config):
+        #bool is an int, so only accept it where bool is expected
+        if not isinstance(value, types) or (isinstance(value, bool) and bool not in types and object not in types):
+            errors.append("{}: expected {}, got {}".format(path, node['kind'], describe(value)))
+            return
+        for c in checks:
+            c(value, path, errors, config)
+    return check
+
+
+def ec2_instances(stack_setup, path, errors, config):
+    #Mirrors parent_yaml_fallback, instance values fall back to the stack and then the top of the config
+    instances = stack_setup.get('instances')
+    if not isinstance(instances, dict):
+        return
+    networks = stack_setup.get('networks') or {}
+    for instance, instance_setup in instances.items():
+        if not isinstance(instance_setup, dict):
+            continue
+        instance_path = join_path(join_path(path, 'instances'), instance)
+        for k in ['ami_image', 'instance_size']:
+            if not (instance_setup.get(k) or stack_setup.get(k) or config.get(k)):
+                errors.append("{}: required in the instance, its stack or the top of the config".format(
+                    join_path(instance_path, k)))
+        az = instance_setup.get('az')
+        if az is not None and isinstance(networks, dict) and az not in networks:
+            errors.append("{}: '{}' has no network in {}".format(join_path(instance_path, 'az'), az, join_path(path, 'networks')))
+
+def alarm_keys():
+    comparisons = ["GreaterThanOrEqualToThreshold", "GreaterThanThreshold", "LessThanThreshold", "LessThanOrEqualToThreshold"]
+    statistics  = ["SampleCount", "Average", "Sum", "Minimum", "Maximum"]
+    keys = dict()
+    for level in ["high", "low"]:
+        keys['threshold_' + level]   = field('number', required = True)
+        keys['comp_oper_' + level]   = field('str', required = True, choices = comparisons)
+        keys['statistic_' + level]   = field('str', required = True, choices = statistics)
+        keys['period_' + level]      = field('int', required = True)
+        keys['eval_period_' + level] = field('int', required = True)
+    return keys
+
+az_networks  = field('mapping', values = field('cidr'), ref = 'availability_zones')
+port_list    = field('list', items = field('scalar'))
+#[network, port, ingress|egress] with an optional protocol
+custom_rules = field('list', items = field('list', length = (3, 4), items = field('scalar')))
+userdata     = field('any')
+
+prerun_items = field('mapping', values = field('mapping', extra = False, keys = dict(
+    var_export    = field('str', required = True),
+    function      = field('str', required = True),
+    function_args = field('mapping', required = True),
+    cache_ttl     = field('number'),
+)))
+
+s3_trigger = field('mapping', keys = dict(
+    lambda_code  = field('str', required = True),
+    prefix       = field('str', required = True),
+    suffix       = field('str', required = True),
+    preset_roles = field('list', required = True, items = field('str')),
+    custom_roles = field('mapping', values = field('mapping', keys = dict(
+        actions   = field('list', required = True, items = field('list', length = (2, 2), items = field('str'))),
+        resources = field('list', required = True),
+    ))),
+    environment_setup = field('mapping'),
+    handler           = field('str'),
+))
+
+ec2_instance = field('mapping', keys = dict(
+    az            = field('str', required = True, ref = 'availability_zones'),
+    ami_image     = field('str'),
+    instance_size = field('str'),
+    userdata_file = userdata,
+    environment   = field('mapping'),
+    domain        = field('str'),
+))
+
+ec2_stack = field('mapping', check = ec2_instances, root_requires = ['userdata_exports'], keys = dict(
+    networks      = dict(az_networks, required = True),
+    custom_rules  = dict(custom_rules, required = True),
+    instances     = field('mapping', required = True, values = ec2_instance),
+    fs_mounts     = field('list'),
+    environment   = field('mapping'),
+    userdata_file = userdata,
+))
+
+tcpstack_types = dict(
+    ec2         = ec2_stack,
+    ec2_windows = ec2_stack,
+    mongodb = field('mapping', root_requires = ['email_topic_arn'], keys = dict(
+        stack_name       = field('str', required = True),
+        networks         = dict(az_networks, required = True),
+        ports            = dict(port_list, required = True),
+        number_of_shards = field('int', required = True),
+        custom_rules     = dict(custom_rules, required = True),
+        shards_userdata  = dict(userdata, required = True),
+        config_userdata  = dict(userdata, required = True),
+        man_userdata     = dict(userdata, required = True),
+        mongo_dbs        = field('str', required = True),
+        enableArbiter    = field('bool', required = True),
+        fs_mounts        = field('list', required = True),
+    )),
+    rds = field('mapping', keys = dict(
+        networks     = dict(az_networks, required = True),
+        custom_rules = dict(custom_rules, required = True),
+        ports        = field('list', required = True, length = (1, 1), items = field('scalar')),
+        db_username  = field('str', required = True),
+        db_password  = field('str', required = True),
+        zone         = field('str', required = True),
+        Storage      = field('scalar', required = True),
+        dbclass      = field('str', required = True),
+        engine       = field('str', required = True),
+        engine_ver   = field('scalar', required = True),
+        license      = field('str', required = True),
+        param_grp    = field('str', required = True),
+        option_grp   = field('str', required = True),
+        backup_win   = field('str', required = True),
+        maint_win    = field('str', required = True),
+        backup_days  = field('scalar', required = True),
+    )),
+    #EFS networks are keyed by the real availability zone names
+    efs = field('mapping', keys = dict(
+        networks = field('mapping', required = True, values = field('cidr')),
+        ports    = dict(port_list, required = True),
+    )),
+)
+
+tcpstack = field('mapping', switch = ('stack_type', tcpstack_types), keys = dict(
+    stack_type = field('str', required = True, choices = list(tcpstack_types.keys())),
+    enabled    = field('bool', required = True),
+    prerun     = prerun_items,
+))
+
+config_schema = field('mapping',
+    keys = dict(
+        app_name           = field('str', required = True),
+        deploy_env         = field('str', required = True),
+        deploy_bucket      = field('str', required = True),
+        aws_region         = field('str', required = True),
+        build_ami          = field('bool', required = True),
+        cloudwatch_alarm   = field('bool', required = True),
+        app_networks       = dict(az_networks, required = True),
+        vpc_id             = field('str'),
+        billing_id         = field('scalar'),
+        availability_zones = field('mapping', values = field('str')),
+        elb_networks       = az_networks,
+        nat_host_ids       = field('mapping', ref = 'availability_zones'),
+        nat_gw_ids         = field('mapping', ref = 'availability_zones'),
+        public_ips         = field('list', items = field('cidr')),
+        port_map           = field('mapping', values = field('list', length = (2, 2), items = field('scalar'))),
+        out_ports          = port_list,
+        cf_params          = field('mapping', values = field('mapping', keys = dict(
+            name    = field('str', required = True),
+            desc    = field('str'),
+            default = field('scalar'),
+        ))),
+        userdata_exports   = field('mapping', values = field('str')),
+        userdata_values    = field('mapping'),
+        install_packages   = field('list', items = field('str')),
+        app_prerun         = prerun_items,
+        build_prerun       = prerun_items,
+        s3_triggers        = field('mapping', values = s3_trigger),
+        asg_mem_alarm      = field('mapping', keys = alarm_keys()),
+        tcpstacks          = field('mapping', values = tcpstack),
+        external_services  = field('mapping', values = field('list', items = field('mapping', keys = dict(
+            sec_grp_name = field('str'),
+            sec_grp      = field('str'),
+            ports        = dict(port_list, required = True),
+        )))),
+        root_volume_size   = field('int'),
+        sg_rule_limit      = field('int'),
+        compress_userdata  = field('bool'),
+    ),
+    implies = dict(
+        elb_bucket       = ['elb_networks', 'public_ips', 'SSLCert_arn'],
+        elb              = ['elb_networks', 'public_ips', 'SSLCert_arn'],
+        use_nat          = ['nat_host_ids'],
+        use_nat_gw       = ['nat_gw_ids'],
+        asg_mem_alarm    = ['sns_topic_arn'],
+        cloudwatch_alarm = ['domain', 'health_check_location', 'sns_topic_arn'],
+        s3_triggers      = ['account_id'],
+        use_shut_scheduled_action  = ['shut_desired_capacity', 'shut_min_size', 'shut_recurrence'],
+        use_start_scheduled_action = ['start_desired_capacity', 'start_min_size', 'start_recurrence'],
+    ),
+)
+
+#Top level keys each stack reads directly, on top of the ones every stack needs
+stack_keys = dict(
+    resources = [],
+    network   = ['vpc_id', 'billing_id', 'availability_zones', 'port_map', 'out_ports'],
+    app       = ['billing_id', 'port_map', 'cf_params', 'ami_image', 'userdata_exports', 'userdata_file', 'install_packages'],
+    build     = ['ami_image', 'cf_params', 'build_stack_userdata', 'userdata_exports'],
+    tcpstack  = ['vpc_id', 'billing_id', 'availability_zones', 'cf_params', 'port_map', 'out_ports'],
+)
+
+check_config = compile_node(config_schema)
+
+def config_errors(ops, stacks = None):
+    errors = []
+    check_config(ops, "", errors, ops)
+    if not isinstance(ops, dict):
+        return errors
+    needed = dict()
+    for s in stacks or []:
+        kind = s if s in stack_keys else 'tcpstack'
+        for k in stack_keys[kind]:
+            if k not in ops and s not in needed.setdefault(k, []):
+                needed[k].append(s)
+    for k, needed_by in needed.items():
+        errors.append("{}: required by the {} stack{}".format(k, ", ".join(needed_by), "s" if len(needed_by) > 1 else ""))
+    return errors
+
+def validate(ops, stacks = None, config_file = None):
+    """Check the whole config against the schema, raising one ValueError listing every problem.
+    stacks adds the top level keys those stacks need.
+    """
+    errors = config_errors(ops, stacks)
+    if errors:
+        source = " " + config_file if config_file else ""
+        raise(ValueError("Invalid config{} ({} errors):\n  {}".format(source, len(errors), "\n  ".join(errors))))
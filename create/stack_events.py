@@ -0,0 +1,139 @@
+import asyncio
+import sys
+from functools import partial
+from botocore.exceptions import ClientError
+
+#Waiter names used by go_tropo mapped to (success statuses, resource statuses that fail the wait)
+wait_statuses = dict(
+    stack_create_complete = (["CREATE_COMPLETE"], ["CREATE_FAILED"]),
+    stack_update_complete = (["UPDATE_COMPLETE"], ["CREATE_FAILED", "UPDATE_FAILED"]),
+    stack_delete_complete = (["DELETE_COMPLETE"], ["DELETE_FAILED"]),
+)
+
+FROM_LATEST = "latest"
+#Seconds before a wait gives up, the budget of the boto waiters this replaced (120 attempts, 30s apart)
+default_max_wait = 3600
+
+class StackFailed(Exception):
+    pass
+
+class StackWaitTimeout(StackFailed):
+    pass
+
+def stack_missing(error):
+    return "does not exist" in str(error)
+
+def event_line(stack_name, event):
+    return "  ".join([
+        stack_name,
+        str(event.get('Timestamp', '')),
+        event.get('LogicalResourceId', ''),
+        event.get('ResourceType', ''),
+        event.get('ResourceStatus', ''),
+        event.get('ResourceStatusReason', ''),
+    ]).rstrip()
+
+def is_stack_event(stack_name, event):
+    return event.get('ResourceType') == "AWS::CloudFormation::Stack" and event.get('LogicalResourceId') == stack_name
+
+def stack_finished(status):
+    return not status.endswith("_IN_PROGRESS")
+
+class StackEventTail(object):
+    """ Incrementally read describe_stack_events, returning only events newer than the last seen event """
+    def __init__(self, client, stack_name, since_event_id = None):
+        self.client        = client
+        self.stack_name    = stack_name
+        self.last_event_id = since_event_id
+
+    def new_events(self):
+        events = []
+        kwargs = dict(StackName = self.stack_name)
+        while True:
+            r = self.client.describe_stack_events(**kwargs)
+            for event in r['StackEvents']:
+                if event['EventId'] == self.last_event_id:
+                    return self.chronological(events)
+                events.append(event)
+            if not r.get('NextToken'):
+                return self.chronological(events)
+            kwargs['NextToken'] = r['NextToken']
+
+    def chronological(self, events):
+        #describe_stack_events returns newest first
+        events.reverse()
+        if events:
+            self.last_event_id = events[-1]['EventId']
+        return events
+
+def latest_event_id(client, stack_name):
+    try:
+        events = client.describe_stack_events(StackName = stack_name)['StackEvents']
+    except ClientError as e:
+        if stack_missing(e):
+            return None
+        raise
+    if events:
+        return events[0]['EventId']
+    return None
+
+async def watch_stack(client, stack_name, wait_status, since_event_id = FROM_LATEST,
+        min_delay = 2, max_delay = 30, backoff = 1.5, max_wait = default_max_wait, out = sys.stdout):
+    """Stream events for stack_name until it reaches the status for wait_status.
+    Raises StackFailed on the first failed resource event or unexpected final stack status,
+    StackWaitTimeout when the status is not reached within max_wait seconds (None waits forever).
+    since_event_id is the last event already seen, None to show every event of the stack.
+    """
+    if wait_status not in wait_statuses:
+        raise(ValueError("Unknown stack wait status: {}".format(wait_status)))
+    success, failures = wait_statuses[wait_status]
+    loop = asyncio.get_running_loop()
+    call = lambda f, *args: loop.run_in_executor(None, partial(f, *args))
+
+    if since_event_id == FROM_LATEST:
+        since_event_id = await call(latest_event_id, client, stack_name)
+    tail  = StackEventTail(client, stack_name, since_event_id)
+    delay = min_delay
+    deadline = loop.time() + max_wait if max_wait is not None else None
+
+    print("Waiting for %s to be in state %s" % (stack_name, wait_status), file = out)
+    while True:
+        try:
+            events = await call(tail.new_events)
+        except ClientError as e:
+            if wait_status == "stack_delete_complete" and stack_missing(e):
+                return "DELETE_COMPLETE"
+            raise
+
+        for event in events:
+            print(event_line(stack_name, event), file = out)
+            status = event.get('ResourceStatus', '')
+            if is_stack_event(stack_name, event):
+                if status in success:
+                    return status
+                if stack_finished(status) or "ROLLBACK" in status:
+                    raise(StackFailed("Stack {} reached status {}".format(stack_name, status)))
+            elif status in failures:
+                raise(StackFailed("Stack {} resource {} {}: {}".format(
+                    stack_name, event.get('LogicalResourceId'), status, event.get('ResourceStatusReason', ''))))
+
+        if events:
+            delay = min_delay
+        else:
+            delay = min(delay * backoff, max_delay)
+        if deadline is not None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise(StackWaitTimeout("Stack {} did not reach {} within {}s".format(stack_name, wait_status, max_wait)))
+            delay = min(delay, remaining)
+        await asyncio.sleep(delay)
+
+async def watch_stacks(client, stack_waits, **kwargs):
+    #stack_waits is a list of (stack_name, wait_status) watched from the one event loop
+    return await asyncio.gather(*[watch_stack(client, name, status, **kwargs) for name, status in stack_waits])
+
+def wait_for_stack(client, stack_name, wait_status, **kwargs):
+    return asyncio.run(watch_stack(client, stack_name, wait_status, **kwargs))
+
+def wait_for_stacks(client, stack_waits, **kwargs):
+    return asyncio.run(watch_stacks(client, stack_waits, **kwargs))
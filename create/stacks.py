@@ -4,7 +4,6 @@ from troposphere import (
     GetAtt, Ref, FindInMap
 )
 import troposphere as trop
-import boto3
 from troposphere.cloudformation import WaitCondition, WaitConditionHandle
 from create import export_ref, import_ref
 import create.network
@@ -22,9 +21,13 @@ import create.rds
 import create.tcpstacks
 from .utils import update_dict
 import create.efs
+import create.config
+import create.meta
+import create.assembler
+from .names import create_network_names, create_resource_names
 
 def create_template(app_name, stack_type):
-    template = Template()
+    template = create.assembler.SplittableTemplate()
     template.add_version("2010-09-09")
 
     template.add_description(
@@ -34,70 +37,6 @@ def create_template(app_name, stack_type):
     return template
 
 
-def create_network_names(ops):
-    app_name = ops.app_name
-    net_names = dict(
-        #Subnets
-        app_subnet_names = ["".join([app_name,"Sn","App",key]) for key,val in sorted(ops.app_networks.items())],
-        #Security Groups
-        app_sg_name = app_name+"Sg"+"App",
-        #Network ACL rules
-        app_nacl_name = app_name+"NetAcl"+"App",
-    )
-    if ops.get('elb'):
-        s3_bucket=ops['elb'].get('bucket', 'None')
-    else:
-        s3_bucket=ops.get("elb_bucket")
-
-    if s3_bucket:
-        net_names.update(
-            elb_subnet_names = ["".join([app_name,"Sn","Elb",key]) for key,val in sorted(ops.elb_networks.items())],
-            elb_sg_name = app_name+"Sg"+"Elb",
-            elb_nacl_name = app_name+"NetAcl"+"Elb",
-        )
-
-    if ops.get('tcpstacks'):
-        net_names['tcpstacks'] = dict()
-        for service_name,service_setup in ops.tcpstacks.items():
-            join_sn_name = lambda x: "".join([ops.app_name, "Sn", service_name, x])
-            stack_subnet_names = [join_sn_name(key) for key in sorted(service_setup['networks'].keys())]
-
-            service_net_names = dict(
-                sg_name      = ops.app_name+"Sg"+service_name,
-                subnet_names = stack_subnet_names,
-                nacl_name    = "".join([ops.app_name, "NetAcl", service_name]),
-            )
-
-            if (service_setup['stack_type'] == "rds" ): #TODO: change this to a supported list of types
-                service_net_names['rds_subnet_grp_name'] = app_name + "RDSSnGroup"
-            net_names['tcpstacks'][service_name] = service_net_names
-
-    if s3_bucket:
-        net_names.update(
-            elb_subnet_names = ["".join([app_name,"Sn","Elb",key]) for key,val in sorted(ops.elb_networks.items())],
-            elb_sg_name = app_name+"Sg"+"Elb",
-            elb_nacl_name = app_name+"NetAcl"+"Elb",
-        )
-    return net_names
-
-def create_resource_names(ops):
-    resource_names = dict(
-        ec2_iam_profile = "{app_name}Iam".format(app_name = ops.app_name),
-        log_group       = "{app_name}Logs".format(app_name = ops.app_name)
-    )
-
-    if ops.build_ami:
-        resource_names['build_ami_role'] = "{app_name}BuildAmiLambdaRole".format(app_name = ops.app_name)
-        resource_names['ec2_amibuild_profile'] = "{app_name}AmiBuildInstanceIamProfile".format(app_name = ops.app_name)
-
-    if ops.cloudwatch_alarm:
-        resource_names['cloudwatch_alarm_role'] = "{app_name}CloudwatchAlarmLambdaRole".format(app_name = ops.app_name)
-
-    if ops.get("build_stack_profile"):
-        resource_names['build_stack_profile'] = "{app_name}BuildStackProfile".format(app_name = ops.app_name)
-
-    return resource_names
-
 def cfn_options_setup(template, ops):
     cfn_options                = create.config.ConfigOptions()
     cfn_options.network_names  = create_network_names(ops)
@@ -263,7 +202,9 @@ def network_stack_template(ops, dry_run):
         assoc_name = "AppAclAssoc"+str(count)
         create.network.assoc_nacl_subnet(template, assoc_name, app_nacl_factory.nacl, subnet)
 
-    last_rule_number = 1000
+    #Every security group name used by external service rules is looked up in one batch
+    group_ids = create.external_services.resolve_group_names(aws_region, [ops.get("external_services", {})])
+
     for service,service_setup in ops.get("tcpstacks",{}).items():
         if service_setup['enabled']:
             stack_name =  service
@@ -272,18 +213,18 @@ def network_stack_template(ops, dry_run):
                 sg_rules = dict(sec_grp = ImportValue(stack_sg_name), ports = service_setup['ports'])
                 sg_key   = "".join([service,"ExtSecGrpPorts"])
                 ext_stack = {sg_key: [sg_rules]}
-                create.external_services.security_group_rules(template, app_name, aws_region, app_sg, ext_stack)
+                create.external_services.security_group_rules(template, app_name, aws_region, app_sg, ext_stack, group_ids)
 
             stack_nacl_name = app_cfn_options['network_names']['tcpstacks'][service]['nacl_name']
             nacl = ImportValue(stack_nacl_name)
 
-            create.network.acl_add_networks(template, stack_nacl_name, nacl, app_nets, start_rule = 1000) #TODO: describe nacl to find value for start_rule
+            #Numbered apart from the entries the tcpstack adds to its own ACL
+            create.network.acl_add_networks(template, stack_nacl_name, nacl, app_nets, band = 'imported')
             tcpstack_networks = [n for az, n in service_setup['networks'].items()]
-            last_rule_number = create.network.acl_add_networks(template, app_cfn_options.network_names['app_nacl_name']+service, app_nacl_factory.nacl, tcpstack_networks, start_rule=last_rule_number)
-            last_rule_number += 10
+            create.network.acl_add_networks(template, app_cfn_options.network_names['app_nacl_name']+service, app_nacl_factory.nacl, tcpstack_networks)
 
     if ops.get("external_services"):
-        create.external_services.security_group_rules(template, app_name, aws_region, app_sg, ops.external_services)
+        create.external_services.security_group_rules(template, app_name, aws_region, app_sg, ops.external_services, group_ids)
 
     return template
 
@@ -433,6 +374,7 @@ def build_stack_template(ops, dry_run):
                 bash_files       = userdata_files,
                 install_packages = ["docker"],
                 sub_values       = userdata_vars,
+                compress         = ops.get("compress_userdata", False),
             ),
             InstanceType = "t2.small",
             SubnetId = subnet,
@@ -7,7 +7,6 @@ from troposphere import cloudwatch
 from troposphere.cloudwatch import MetricDimension
 from troposphere.policies import CreationPolicy, ResourceSignal
 import argparse
-import boto3
 import json
 import sys
 from functools import partial
@@ -124,11 +123,11 @@ def sub_stack_network(template, ops, app_cfn_options, stack_name, stack_setup):
         networks_cidrs.extend(nat_networks)
     custom_networks = set([cr[0] for cr in sorted(stack_setup.get("custom_rules"))])
 #   Need to discuss this with Jeremy. Calling acl_add_networks with custom_networks list, It will open all the inbound ports based on the ports mentioned in yaml.
-    #     next_rule_number=create.network.acl_add_networks(template, app_name+stack_name+"NaclRules", nacl, networks_cidrs + ops.get("deploy_hosts", []) + list(custom_networks))
-    next_rule_number = create.network.acl_add_networks(template, app_name+stack_name+"NaclRules", nacl, networks_cidrs + ops.get("deploy_hosts", []))
-    next_rule_number = create.network.acl_add_networks(template, app_name+stack_name+"NaclRules", nacl, custom_networks, start_rule = next_rule_number + 10)
+    #     create.network.acl_add_networks(template, app_name+stack_name+"NaclRules", nacl, networks_cidrs + ops.get("deploy_hosts", []) + list(custom_networks))
+    create.network.acl_add_networks(template, app_name+stack_name+"NaclRules", nacl, networks_cidrs + ops.get("deploy_hosts", []))
+    create.network.acl_add_networks(template, app_name+stack_name+"NaclRules", nacl, sorted(custom_networks))
     port_list = ['6|80|OutRule', '6|443|OutRule', '6|1024|65535|InRule','17|1024|65535|InRule']
-    create.network.acl_add_networks(template, app_name + stack_name + "NaclRules", nacl, ["0.0.0.0/0"],start_rule=next_rule_number, ports=port_list)
+    create.network.acl_add_networks(template, app_name + stack_name + "NaclRules", nacl, ["0.0.0.0/0"], ports=port_list)
 
     for count,(az,subnet) in enumerate(sorted(stack_subnets.items())):
         assoc_name = app_name+stack_name+"AclAssoc"+str(count)
@@ -190,7 +189,8 @@ def linux_instance(template, instance_setup):
         bash_files       = userdata_file,
         install_packages = ["docker"],
         sub_values       = instance_setup['userdata_vars'],
-        env_vars         = instance_setup.get('environment')
+        env_vars         = instance_setup.get('environment'),
+        compress         = instance_setup.get('compress_userdata', False),
     )
 
     if instance_setup['root_volume_size']:
@@ -368,6 +368,7 @@ def create_ec2_stack(template, ops, app_cfn_options, stack_name, stack_setup):
         instance_setup['previous_instance'] = previous_instance
         instance_setup['fs_mounts']         = fs_mounts
         instance_setup['build_serial']      = stack_setup.get('build_serial')
+        instance_setup['compress_userdata'] = ops.get('compress_userdata', False)
         instance_setup['ami_image']         = parent_yaml_fallback(ops, stack_setup, instance_setup, 'ami_image')
         instance_setup['instance_size']     = parent_yaml_fallback(ops, stack_setup, instance_setup, 'instance_size')
 
@@ -0,0 +1,61 @@
+import json
+
+template_sections = ["Parameters", "Mappings", "Conditions", "Resources", "Outputs"]
+
+def canonical(template_body):
+    #Deployed templates come back from get_template as a string or an already parsed dict
+    if isinstance(template_body, str):
+        template_body = json.loads(template_body)
+    return json.loads(json.dumps(template_body, sort_keys = True))
+
+def same_template(deployed_body, local_body):
+    try:
+        return canonical(deployed_body) == canonical(local_body)
+    except ValueError:
+        #Not JSON, so not a template created by go_tropo. Treat as changed
+        return False
+
+def changed_paths(old, new, prefix = ""):
+    if isinstance(old, dict) and isinstance(new, dict):
+        paths = []
+        for key in sorted(set(old) | set(new)):
+            if old.get(key) != new.get(key):
+                paths.extend(changed_paths(old.get(key), new.get(key), ".".join([p for p in [prefix, key] if p])))
+        return paths
+    return [prefix or "(value)"]
+
+def template_diff(deployed_body, local_body):
+    """Return a list of (action, section, name, detail) for every difference between templates.
+    action is one of Add, Remove or Modify.
+    """
+    old = canonical(deployed_body)
+    new = canonical(local_body)
+    changes = []
+    for key in sorted(set(old) | set(new)):
+        if key in template_sections or old.get(key) == new.get(key):
+            continue
+        changes.append(("Modify", key, "", ""))
+
+    for section in template_sections:
+        old_items = old.get(section, {})
+        new_items = new.get(section, {})
+        for name in sorted(set(old_items) | set(new_items)):
+            if name not in old_items:
+                changes.append(("Add", section, name, new_items[name].get("Type", "") if section == "Resources" else ""))
+            elif name not in new_items:
+                changes.append(("Remove", section, name, old_items[name].get("Type", "") if section == "Resources" else ""))
+            elif old_items[name] != new_items[name]:
+                changes.append(("Modify", section, name, ", ".join(changed_paths(old_items[name], new_items[name]))))
+    return changes
+
+def format_diff(stack_name, changes):
+    symbols = dict(Add = "+", Remove = "-", Modify = "~")
+    if not changes:
+        return "{}: no changes".format(stack_name)
+    lines = ["{}: {} change(s)".format(stack_name, len(changes))]
+    for action, section, name, detail in changes:
+        line = "  {} {}".format(symbols[action], "/".join([p for p in [section, name] if p]))
+        if detail:
+            line += " ({})".format(detail)
+        lines.append(line)
+    return "\n".join(lines)
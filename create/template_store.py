@@ -0,0 +1,164 @@
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+import yaml
+from botocore.exceptions import ClientError
+from troposphere import Template
+from .utils import cache_path
+
+default_prefix    = "templates"
+default_retention = 10
+#compact is what gets uploaded, json is the readable form troposphere prints
+template_formats  = ("json", "compact", "yaml")
+#Indent and separators of the installed troposphere's Template.to_json(), they differ between versions
+to_json_options   = dict((k, p.default) for k, p in inspect.signature(Template.to_json).parameters.items() if k != "self")
+
+class TemplateDumper(yaml.SafeDumper):
+    pass
+
+def represent_text(dumper, data):
+    #Scripts in userdata read best as literal blocks
+    return dumper.represent_scalar(u'tag:yaml.org,2002:str', str(data), style = '|' if "\n" in data else None)
+
+TemplateDumper.add_multi_representer(str, represent_text)
+TemplateDumper.add_multi_representer(dict, lambda dumper, data: dumper.represent_dict(data))
+
+def template_body(template_dict, fmt = "compact"):
+    if fmt == "compact":
+        return json.dumps(template_dict, sort_keys = True, separators = (',', ':'))
+    if fmt == "json":
+        return json.dumps(template_dict, **to_json_options)
+    if fmt == "yaml":
+        return yaml.dump(template_dict, Dumper = TemplateDumper, default_flow_style = False, width = 1000)
+    raise(ValueError("Unknown template format {}, expected one of {}".format(fmt, ", ".join(template_formats))))
+
+def env_prefix(deploy_env, prefix = None):
+    #Templates stay under the deploy_env prefix CloudFormation roles are allowed to read
+    return "{}/{}".format(deploy_env, prefix or default_prefix)
+
+def template_key(body, prefix = default_prefix):
+    #Templates are stored under their content hash so a key always refers to the same template
+    sha = hashlib.sha256(body.encode('utf8')).hexdigest()
+    return "{}/{}.json".format(prefix, sha)
+
+def template_url(aws_region, bucket, key):
+    return "https://s3-%s.amazonaws.com/%s/%s" % (aws_region, bucket, key)
+
+class UploadManifest(object):
+    """ Local record of the template keys this checkout uploaded to each bucket and the keys used by each stack.
+    Each change is applied to the file as saved by now, keeping what other processes saved.
+
+    Layout: {bucket: {"uploaded": {key: upload time}, "stacks": {stack_ref: [keys, newest first]}}}
+    """
+    def __init__(self, path = None):
+        self.path = path or cache_path("template_manifest.json")
+        self.lock = threading.Lock()
+        self.data = self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return dict()
+
+    def apply(self, change):
+        action, bucket, keys, stack_ref, uploaded_at = change
+        b = self.bucket(bucket)
+        if action == "add":
+            if uploaded_at:
+                b['uploaded'].setdefault(keys[0], uploaded_at)
+            b['stacks'][stack_ref] = keys + [k for k in b['stacks'].get(stack_ref, []) if k not in keys]
+        else:
+            for k in keys:
+                b['uploaded'].pop(k, None)
+            for ref, history in b['stacks'].items():
+                b['stacks'][ref] = [k for k in history if k not in keys]
+
+    def save(self, change):
+        self.data = self.load()
+        self.apply(change)
+        #Per process temporary file, deploy and render runs can save the manifest at once
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f, indent = 1, sort_keys = True)
+        os.replace(tmp_path, self.path)
+
+    def bucket(self, bucket):
+        b = self.data.setdefault(bucket, dict())
+        b.setdefault('uploaded', dict())
+        b.setdefault('stacks', dict())
+        return b
+
+    def add_key(self, bucket, key, stack_ref, uploaded = False):
+        with self.lock:
+            self.save(("add", bucket, [key], stack_ref, int(time.time()) if uploaded else None))
+
+    def stale_keys(self, bucket, keep, stack_prefix = ""):
+        """Templates uploaded from here for stacks under stack_prefix that are not among the last keep
+        templates of any stack. Keys other checkouts uploaded are left to them, they may still use them.
+        """
+        with self.lock:
+            self.data = self.load()
+            b = self.bucket(bucket)
+            retained = set()
+            for history in b['stacks'].values():
+                retained.update(history[:keep])
+            candidates = set()
+            for stack_ref, history in b['stacks'].items():
+                if stack_ref.startswith(stack_prefix):
+                    candidates.update(history[keep:])
+            return sorted((candidates & set(b['uploaded'])) - retained)
+
+    def remove_keys(self, bucket, keys):
+        with self.lock:
+            self.save(("remove", bucket, list(keys), None, None))
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+def get_manifest():
+    global _manifest
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = UploadManifest()
+        return _manifest
+
+def object_exists(s3_client, bucket, key):
+    try:
+        s3_client.head_object(Bucket = bucket, Key = key)
+        return True
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+def upload_template_body(s3_client, bucket, stack_ref, body, prefix = default_prefix, manifest = None):
+    """Upload template body under its content hash unless already in the bucket.
+    Returns (key, uploaded) where uploaded is False when the PUT was skipped.
+    The object is always checked with a HEAD, the manifest may list keys pruned or expired elsewhere.
+    """
+    manifest = manifest or get_manifest()
+    key = template_key(body, prefix)
+    uploaded = False
+    if not object_exists(s3_client, bucket, key):
+        s3_client.put_object(Bucket = bucket, Key = key, Body = body)
+        uploaded = True
+    manifest.add_key(bucket, key, stack_ref, uploaded)
+    return key, uploaded
+
+def prune_templates(s3_client, bucket, deploy_env, keep = default_retention, manifest = None, dry_run = False):
+    #Delete older templates of deploy_env stacks uploaded from here that are not among the last keep templates of any stack
+    if keep < 1:
+        raise(ValueError("At least the current template of each stack has to be kept"))
+    manifest = manifest or get_manifest()
+    stale = manifest.stale_keys(bucket, keep, stack_prefix = deploy_env + "/")
+    if not dry_run:
+        for i in range(0, len(stale), 1000):
+            batch = stale[i:i+1000]
+            s3_client.delete_objects(Bucket = bucket, Delete = dict(Objects = [dict(Key = k) for k in batch], Quiet = True))
+        manifest.remove_keys(bucket, stale)
+    return stale
@@ -1,9 +1,10 @@
-import boto3
 import hashlib
 import io
 import os
-import zipfile
-from botocore.client import Config
+import tempfile
+from .boto_clients import get_client
+from .packager import package_files, shas_digest, arcname
+from . import hash_index
 
 def find_files(paths, exclude_suffixes = ['pyc']):
     if type(paths) == str:
@@ -13,7 +14,7 @@ def find_files(paths, exclude_suffixes = ['pyc']):
             raise(ValueError("Given path '{}' not a directory".format(path)))
         for o in os.walk(path):
             for p in o[2]:
-                if (not check_suffixes(path, exclude_suffixes)):
+                if (not check_suffixes(p, exclude_suffixes)):
                     yield os.path.join(o[0],p)
 
 
@@ -28,13 +29,14 @@ def file_sha(filename):
         return sha256.hexdigest()
 
 
-def path_sha(path, exclude_suffixes = []):
-    #Calc sha of shas in path
-    sha256 = hashlib.sha256()
-    for f in find_files(path, exclude_suffixes):
-        #sha hash based on path and sha of file contents
-        sha256.update("".join([f,file_sha(f)]).encode('utf8'))
-    return sha256.hexdigest()
+def path_sha(path, exclude_suffixes = [], index = None):
+    #Calc sha of shas in path, based on sorted paths relative to path and sha of file contents
+    #Only files changed since the last run are read, using the persistent hash index
+    index = index or hash_index.get_index()
+    files = list(find_files(path, exclude_suffixes))
+    shas  = sorted(zip([arcname(f, path) for f in files], index.file_shas(files)))
+    index.save()
+    return shas_digest(shas)
 
 
 def check_suffixes(path, suffixes):
@@ -43,33 +45,62 @@ def check_suffixes(path, suffixes):
             return True
     return False
 
+def cache_path(*parts):
+    #Local cache files shared by go_tropo runs. GO_TROPO_CACHE_DIR overrides the location
+    cache_dir = os.environ.get("GO_TROPO_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "go_tropo"))
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok = True)
+    return os.path.join(cache_dir, *parts)
+
 def get_s3_client():
-    return boto3.client('s3', config=Config(signature_version='s3v4'))
+    return get_client('s3', signature_version='s3v4')
 
 def upload_path_to_zip(s3_bucket, s3_prefix, local_path, dry_run):
-    s3 = get_s3_client()
-
-    sha = path_sha(local_path)
-    remote_filename = "".join([os.path.basename(local_path),"-",sha,".zip"])
-    upload_key = os.path.join(s3_prefix, remote_filename)
-    if not dry_run:
-        o = s3.list_objects(
-            Bucket = s3_bucket,
-            Prefix = upload_key
-        )
-        if not o.get("Contents"):
-            print("Uploading local file path to s3bucket {}".format(upload_key))
-            upload_body = create_zip(find_files(local_path), local_path)
-            s3.put_object(Body = upload_body, Bucket = s3_bucket, Key = upload_key)
+    s3    = get_s3_client()
+    index = hash_index.get_index()
+    files = list(find_files(local_path, []))
+
+    with tempfile.TemporaryFile() as archive:
+        packaged = False
+        if dry_run or index.cached_shas(files) is not None:
+            #Unchanged files come from the index so the archive is only built when it has to be uploaded
+            sha = path_sha(local_path, index = index)
+        else:
+            #Hash and compress in one pass, the archive is spooled to disk rather than memory
+            sha = shas_digest(package_files(files, local_path, archive, index = index))
+            index.save()
+            packaged = True
+        remote_filename = "".join([os.path.basename(local_path),"-",sha,".zip"])
+        upload_key = os.path.join(s3_prefix, remote_filename)
+        if not dry_run:
+            from .artifacts import key_exists
+            if not key_exists(s3, s3_bucket, upload_key):
+                print("Uploading local file path to s3bucket {}".format(upload_key))
+                if not packaged:
+                    package_files(files, local_path, archive)
+                archive.seek(0)
+                s3.upload_fileobj(archive, s3_bucket, upload_key)
 
     return os.path.join("s3://",s3_bucket, upload_key)
 
 
+def write_if_changed(path, body):
+    #Leave the file and its mtime alone when the contents are the same. Returns True if written
+    data = body.encode('utf8')
+    if os.path.isfile(path) and file_sha(path) == hashlib.sha256(data).hexdigest():
+        return False
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+    #Per process temporary file, render workers can write the same output at once
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return True
+
 def create_zip(files, root_path):
     mem_obj = io.BytesIO()
-    with zipfile.ZipFile(mem_obj, mode='w') as tf:
-        for f in files:
-            tf.write(f, os.path.relpath(f, start = root_path))
+    package_files(files, root_path, mem_obj)
     return mem_obj.getvalue()
 
 def update_dict(dest, src):
@@ -1,22 +1,63 @@
+import hashlib
+import os
 import yaml
 from collections import OrderedDict
 
+#libyaml parser when PyYAML was built with it, same constructors as the python loaders
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 ## define custom tag handler
 def join_str(loader, node):
     seq = loader.construct_sequence(node)
     return ''.join([str(i) for i in seq])
 
-def ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict):
-    class OrderedLoader(Loader):
-        pass
-    def construct_mapping(loader, node):
-        loader.flatten_mapping(node)
-        return object_pairs_hook(loader.construct_pairs(node))
-    OrderedLoader.add_constructor(
-        yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
-        construct_mapping)
-    OrderedLoader.add_constructor('!join', join_str)
-    return yaml.load(stream, OrderedLoader)
+def include_file(loader, node):
+    #!include path, relative to the including file. Anchors are not shared between files
+    path = os.path.abspath(os.path.join(loader.include_dir, loader.construct_scalar(node)))
+    with open(path, 'rb') as f:
+        data = f.read()
+    return load_document(data, path, type(loader), loader.included)
+
+_loader_classes = dict()
+
+def ordered_loader(Loader, object_pairs_hook = OrderedDict):
+    #Loader classes are built once, add_constructor copies the constructor tables each time
+    key = (Loader, object_pairs_hook)
+    if key not in _loader_classes:
+        class OrderedLoader(Loader):
+            pass
+        def construct_mapping(loader, node):
+            loader.flatten_mapping(node)
+            return object_pairs_hook(loader.construct_pairs(node))
+        OrderedLoader.add_constructor(
+            yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
+            construct_mapping)
+        OrderedLoader.add_constructor('!join', join_str)
+        OrderedLoader.add_constructor('!include', include_file)
+        _loader_classes[key] = OrderedLoader
+    return _loader_classes[key]
+
+def load_document(data, path, loader_class, included):
+    #Record the sha of the data actually parsed, so a file changed afterwards does not match
+    if path:
+        included[path] = hashlib.sha256(data if type(data) == bytes else data.encode('utf8')).hexdigest()
+    loader = loader_class(data)
+    loader.include_dir = os.path.dirname(path) if path else os.getcwd()
+    loader.included    = included
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
+
+def ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict, included=None):
+    """Load yaml keeping mapping order. The sha256 of the stream's file and every file read
+    through !include is added to the included dict by absolute path.
+    """
+    path = os.path.abspath(stream.name) if hasattr(stream, 'name') else None
+    data = stream.read() if hasattr(stream, 'read') else stream
+    if included is None:
+        included = dict()
+    return load_document(data, path, ordered_loader(Loader, object_pairs_hook), included)
 
 def ordered_dump(data, stream=None, Dumper=yaml.Dumper, **kwds):
     class OrderedDumper(Dumper):
@@ -10,7 +10,6 @@ setup(
         'awacs',
         'PyYaml',
         'Click',
-        'AWSLogs',
     ],
     entry_points='''
         [console_scripts]
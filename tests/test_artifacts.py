@@ -0,0 +1,73 @@
+import os
+import threading
+from botocore.exceptions import ClientError
+from create.artifacts import RemoteKeys, upload_artifacts
+import create.artifacts
+
+
+class FakePaginator(object):
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, Bucket, Prefix):
+        self.s3.calls.append(("list", Prefix))
+        keys = sorted(k for k in self.s3.objects if k.startswith(Prefix))
+        yield dict(Contents = [dict(Key = k) for k in keys[:1]])
+        yield dict(Contents = [dict(Key = k) for k in keys[1:]])
+
+class FakeS3(object):
+    def __init__(self, objects):
+        self.objects = set(objects)
+        self.calls   = []
+        self.lock    = threading.Lock()
+
+    def get_paginator(self, name):
+        return FakePaginator(self)
+
+    def head_object(self, Bucket, Key):
+        self.calls.append(("head", Key))
+        if Key not in self.objects:
+            raise(ClientError(dict(Error = dict(Code = "404")), "HeadObject"))
+
+
+def artifact(s3, key, uploaded):
+    def upload(s3_client, bucket, key):
+        with s3.lock:
+            uploaded.append(key)
+    return dict(key = key, description = "test code", upload = upload)
+
+def test_upload_only_missing_artifacts(monkeypatch):
+    monkeypatch.setattr(create.artifacts, "remote_keys", RemoteKeys())
+    s3 = FakeS3(["env/custom/a.py-1", "env/custom/b.py-2"])
+    uploaded = []
+    artifacts = [artifact(s3, k, uploaded) for k in
+        ["env/custom/a.py-1", "env/custom/b.py-2", "env/custom/c.py-3", "env/s3triggers/d.py-4", "env/custom/c.py-3"]]
+
+    upload_artifacts(s3, "bucket", "env/", artifacts)
+    assert sorted(uploaded) == ["env/custom/c.py-3", "env/s3triggers/d.py-4"]
+    assert s3.calls == [("list", "env/")]
+
+def test_keys_outside_listed_prefix_use_head(monkeypatch):
+    keys = RemoteKeys()
+    s3 = FakeS3(["env/a", "other/b"])
+    keys.prefetch(s3, "bucket", "env/")
+    assert keys.exists(s3, "bucket", "env/a")
+    assert not keys.exists(s3, "bucket", "env/missing")
+    assert keys.exists(s3, "bucket", "other/b")
+    assert not keys.exists(s3, "bucket", "other/missing")
+    assert [c for c in s3.calls if c[0] == "head"] == [("head", "other/b"), ("head", "other/missing")]
+
+def test_mongodb_lambda_in_pre_flight_artifacts():
+    from bin.go_tropo import lambda_artifacts
+    from create.config import ConfigOptions
+    import create.custom_funcs
+    import create.mongo
+    ops = ConfigOptions()
+    ops.update(deploy_env = "dev", build_ami = False, cloudwatch_alarm = False, tcpstacks = dict(
+        db      = dict(stack_type = "mongodb", enabled = True, enableArbiter = False),
+        arbiter = dict(stack_type = "mongodb", enabled = True, enableArbiter = True),
+    ))
+    assert os.path.isfile(create.mongo.start_stop_lambda)
+    keys = [a['key'] for a in lambda_artifacts(ops, ["network", "db"])]
+    assert keys == ["dev/" + create.custom_funcs.remote_filename(create.mongo.start_stop_lambda)]
+    assert lambda_artifacts(ops, ["network", "arbiter"]) == []
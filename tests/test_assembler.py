@@ -0,0 +1,55 @@
+from troposphere import Ref, GetAtt, Sub, Parameter, Output
+import troposphere.ec2 as ec2
+import create.assembler
+
+
+def chained_groups(count):
+    template = create.assembler.SplittableTemplate()
+    vpc = template.add_parameter(Parameter("VpcId", Type = "String"))
+    prev = None
+    for i in range(count):
+        sg = template.add_resource(ec2.SecurityGroup("Sg{}".format(i), GroupDescription = Sub("group ${VpcId} " + str(i)), VpcId = Ref(vpc)))
+        if prev is not None:
+            template.add_resource(ec2.SecurityGroupIngress("In{}".format(i), GroupId = GetAtt(sg, "GroupId"),
+                SourceSecurityGroupId = Ref(prev), IpProtocol = "tcp", FromPort = 1, ToPort = 1))
+        prev = sg
+    template.add_output(Output("Last", Value = Ref(prev)))
+    return template
+
+def test_small_template_is_unchanged():
+    template = chained_groups(10)
+    assert create.assembler.assemble(template, "App-small", "ap-southeast-2", "bucket") is template
+
+def test_large_template_splits_into_nested_stacks():
+    assembled = create.assembler.assemble(chained_groups(900), "App-big", "ap-southeast-2", "bucket")
+    parent = assembled.parent
+    assert len(assembled.nested) > 1
+    for n in assembled.nested:
+        create.assembler.check_limits(n['name'], n['template'], n['body'])
+        assert parent['Resources'][n['name']]['Properties']['TemplateURL'] == n['url']
+    create.assembler.check_limits("parent", parent, assembled.to_json())
+
+    #Parent values come in as parameters, earlier nested values through exports
+    first, second = assembled.nested[0]['template'], assembled.nested[1]['template']
+    stack = parent['Resources']['NestedStack2']
+    assert stack['DependsOn'] == ["NestedStack1"]
+    assert stack['Properties']['Parameters']['VpcId'] == {"Ref": "VpcId"}
+    assert second['Parameters']['VpcId'] == dict(Type = "String")
+    imported = [r['Properties']['SourceSecurityGroupId'] for r in second['Resources'].values() if 'SourceSecurityGroupId' in r['Properties']]
+    exported = set(o['Export']['Name'] for o in first['Outputs'].values())
+    assert any(v.get('Fn::ImportValue') in exported for v in imported)
+
+    #Every resource and output is kept exactly once
+    combined = create.assembler.dependency_dict(assembled)
+    assert len([r for r in combined['Resources'] if not r.startswith("NestedStack")]) == 900 + 899
+    assert "Last" in combined['Outputs']
+
+def test_parent_counts_nested_stacks_within_headroom(monkeypatch):
+    #A smaller limit gives the parent as many nested stacks as a very large template would
+    monkeypatch.setitem(create.assembler.limits, 'resources', 100)
+    assembled = create.assembler.assemble(chained_groups(2500), "App-big", "ap-southeast-2", "bucket")
+    parent = assembled.parent
+    assert len(assembled.nested) > 50
+    assert len(parent['Resources']) <= create.assembler.limits['resources'] * create.assembler.headroom
+    combined = create.assembler.dependency_dict(assembled)
+    assert len([r for r in combined['Resources'] if not r.startswith("NestedStack")]) == 2500 + 2499
@@ -0,0 +1,17 @@
+import pytest
+import troposphere.cloudfront
+
+if not hasattr(troposphere.cloudfront, "CustomOrigin"):
+    #The stack builders use troposphere 2.x cloudfront classes
+    pytest.skip("stack builders need troposphere 2.x", allow_module_level = True)
+
+import benchmarks.render
+
+
+def test_every_builder_renders_in_the_render_benchmark():
+    #xlarge only adds more of the same and takes most of the time
+    names = [s[0] for s in benchmarks.render.scenarios if s[0] != "xlarge"]
+    results, errors = benchmarks.render.run(1, names)
+    assert errors == []
+    for name in names:
+        assert sorted(results[name]['builders']) == sorted(benchmarks.render.builders)
@@ -0,0 +1,39 @@
+import os
+import create.config
+import create.yaml_load
+from create.config import load_yml_file
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+def test_include_join_and_order(tmpdir, monkeypatch):
+    monkeypatch.setenv("GO_TROPO_CACHE_DIR", str(tmpdir.mkdir("cache")))
+    write(str(tmpdir.join("networks.yaml")), "az2: 10.0.1.0/24\naz1: 10.0.0.0/24\n")
+    write(str(tmpdir.join("config.yaml")),
+        "deploy_env: &env test\nprefix: !join [*env, /app]\napp_networks: !include networks.yaml\n")
+    doc = load_yml_file(str(tmpdir.join("config.yaml")))
+    assert doc['prefix'] == "test/app"
+    assert list(doc['app_networks'].keys()) == ["az2", "az1"]
+
+def test_snapshot_reused_until_include_changes(tmpdir, monkeypatch):
+    monkeypatch.setenv("GO_TROPO_CACHE_DIR", str(tmpdir.mkdir("cache")))
+    write(str(tmpdir.join("values.yaml")), "a: 1\n")
+    write(str(tmpdir.join("config.yaml")), "values: !include values.yaml\n")
+    config_file = str(tmpdir.join("config.yaml"))
+    assert load_yml_file(config_file)['values'] == dict(a = 1)
+
+    loads = []
+    real_ordered_load = create.yaml_load.ordered_load
+    def counting_load(*args, **kwargs):
+        loads.append(1)
+        return real_ordered_load(*args, **kwargs)
+    monkeypatch.setattr(create.yaml_load, "ordered_load", counting_load)
+
+    assert load_yml_file(config_file)['values'] == dict(a = 1)
+    assert loads == []
+
+    write(str(tmpdir.join("values.yaml")), "a: 2\n")
+    assert load_yml_file(config_file)['values'] == dict(a = 2)
+    assert loads == [1]
@@ -0,0 +1,46 @@
+import pytest
+import create.external_services
+from create import lookups
+
+
+def group(group_id, name):
+    return dict(GroupId = group_id, Tags = [dict(Key = "Name", Value = name)])
+
+def fake_describe(calls, pages):
+    def call(aws_region, service_name, operation, **params):
+        calls.append(params)
+        return pages[params.get('NextToken')]
+    return call
+
+def test_names_resolved_in_one_paginated_call(monkeypatch):
+    calls = []
+    monkeypatch.setattr(lookups, "call", fake_describe(calls, {
+        None:    dict(SecurityGroups = [group("sg-1", "db")], NextToken = "page2"),
+        "page2": dict(SecurityGroups = [group("sg-2", "cache")]),
+    }))
+    services = dict(
+        db    = [dict(sec_grp_name = "db", ports = [5432])],
+        cache = [dict(sec_grp_name = "cache", ports = [6379]), dict(sec_grp = "sg-3", ports = [22])],
+    )
+    group_ids = create.external_services.resolve_group_names("ap-southeast-2", [services, dict(more = [dict(sec_grp_name = "db", ports = [1])])])
+    assert group_ids == dict(db = "sg-1", cache = "sg-2")
+    assert calls == [
+        dict(Filters = [dict(Name = "tag:Name", Values = ["cache", "db"])]),
+        dict(Filters = [dict(Name = "tag:Name", Values = ["cache", "db"])], NextToken = "page2"),
+    ]
+    assert create.external_services.get_sec_id(services['cache'][1], group_ids) == "sg-3"
+
+def test_missing_and_ambiguous_names_reported_together(monkeypatch):
+    monkeypatch.setattr(lookups, "call", fake_describe([], {
+        None: dict(SecurityGroups = [group("sg-1", "db"), group("sg-2", "db")]),
+    }))
+    services = dict(
+        db  = [dict(sec_grp_name = "db", ports = [5432])],
+        web = [dict(sec_grp_name = "web", ports = [80]), dict(sec_grp_name = "db", sec_grp = "sg-9", ports = [1])],
+    )
+    with pytest.raises(ValueError) as e:
+        create.external_services.resolve_group_names("ap-southeast-2", [services])
+    message = str(e.value)
+    assert "Both sec_grp_name and sec_grp given" in message
+    assert "External security group not found: web" in message
+    assert "Multiple groups found for external security group db: sg-1, sg-2" in message
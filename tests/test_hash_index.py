@@ -0,0 +1,49 @@
+import os
+from create.hash_index import HashIndex
+from create.utils import path_sha, find_files
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def test_only_changed_files_rehashed(tmpdir, monkeypatch):
+    root = str(tmpdir.mkdir("src"))
+    write(os.path.join(root, "a.py"), b"a")
+    write(os.path.join(root, "b.py"), b"b")
+    index_path = str(tmpdir.join("index.json"))
+    first = path_sha(root, index = HashIndex(index_path))
+
+    import create.hash_index
+    hashed = []
+    real_hash_file = create.hash_index.hash_file
+    def counting_hash_file(f):
+        hashed.append(os.path.basename(f))
+        return real_hash_file(f)
+    monkeypatch.setattr(create.hash_index, "hash_file", counting_hash_file)
+
+    assert path_sha(root, index = HashIndex(index_path)) == first
+    assert hashed == []
+
+    write(os.path.join(root, "b.py"), b"changed")
+    assert path_sha(root, index = HashIndex(index_path)) != first
+    assert hashed == ["b.py"]
+
+def test_find_files_excludes_suffixes(tmpdir):
+    root = tmpdir.mkdir("src")
+    write(str(root.join("a.py")), b"a")
+    write(str(root.join("a.pyc")), b"a")
+    assert [os.path.basename(f) for f in find_files(str(root))] == ["a.py"]
+
+def test_indexes_saved_together_keep_each_others_entries(tmpdir):
+    index_path = str(tmpdir.join("index.json"))
+    write(str(tmpdir.join("a.py")), b"a")
+    write(str(tmpdir.join("b.py")), b"b")
+    #Two render workers loaded the index before either saved it
+    first, second = HashIndex(index_path), HashIndex(index_path)
+    first.file_sha(str(tmpdir.join("a.py")))
+    second.file_sha(str(tmpdir.join("b.py")))
+    first.save()
+    second.save()
+    saved = HashIndex(index_path)
+    assert saved.cached_sha(str(tmpdir.join("a.py"))) and saved.cached_sha(str(tmpdir.join("b.py")))
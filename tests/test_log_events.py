@@ -0,0 +1,69 @@
+import io
+import json
+from botocore.exceptions import ClientError
+from create.log_events import LogEventTail, parse_time, tail_logs
+
+
+class FakeLogs(object):
+    """ Serves filter_log_events from scripted batches, one batch added per new page walk """
+    def __init__(self, batches, page_size = 2, throttle_calls = ()):
+        self.batches  = batches
+        self.events   = []
+        self.page_size = page_size
+        self.throttle_calls = set(throttle_calls)
+        self.calls    = []
+
+    def filter_log_events(self, logGroupName, startTime, endTime = None, filterPattern = None, logStreamNamePrefix = None, nextToken = None):
+        self.calls.append(dict(start = startTime, end = endTime, pattern = filterPattern, prefix = logStreamNamePrefix, token = nextToken))
+        if len(self.calls) in self.throttle_calls:
+            raise ClientError(dict(Error = dict(Code = "ThrottlingException", Message = "Rate exceeded")), "FilterLogEvents")
+        if nextToken is None and self.batches:
+            self.events.extend(self.batches.pop(0))
+        matching = [e for e in self.events if e['timestamp'] >= startTime and (endTime is None or e['timestamp'] <= endTime)
+            and e['logStreamName'].startswith(logStreamNamePrefix or "")]
+        offset = int(nextToken or 0)
+        page = dict(events = matching[offset:offset + self.page_size])
+        if offset + self.page_size < len(matching):
+            page['nextToken'] = str(offset + self.page_size)
+        return page
+
+
+def event(event_id, timestamp, stream = "i-1/app.log"):
+    return dict(eventId = event_id, timestamp = timestamp, logStreamName = stream, message = "line {}\n".format(event_id))
+
+def test_parse_time():
+    assert parse_time("20m", now = 10000) == (10000 - 1200) * 1000
+    assert parse_time("1600000000") == 1600000000000
+    assert parse_time("2020-09-13T12:26:40Z") == 1600000000000
+
+def test_tail_resumes_without_repeating_events():
+    logs = FakeLogs([
+        [event("a", 100), event("b", 100), event("c", 200)],
+        [],
+        [event("d", 200), event("e", 300)],
+    ], throttle_calls = [2])
+    tail = LogEventTail(logs, "group", start = 0, filter_pattern = "ERROR", stream_prefix = "i-1")
+    #Throttled after the first page, the walk carries on from its token
+    assert [e['eventId'] for e in tail.new_events()] == ["a", "b"]
+    assert tail.token == "2" and tail.walking
+    assert [e['eventId'] for e in tail.new_events()] == ["c"]
+    assert tail.start == 200
+    assert [e['eventId'] for e in tail.new_events()] == []
+    assert [e['eventId'] for e in tail.new_events()] == ["d", "e"]
+    assert all(c['pattern'] == "ERROR" and c['prefix'] == "i-1" for c in logs.calls)
+
+def test_prefixes_are_read_together_and_printed_in_order():
+    logs = FakeLogs([[event("a", 300, "i-2/app.log"), event("b", 100, "i-1/app.log"), event("c", 200, "i-1/app.log"), event("x", 150, "i-3/app.log")]])
+    out = io.StringIO()
+    count = tail_logs(logs, "group", 0, end = 1000, stream_prefixes = ["i-1", "i-2"], json_output = True, min_delay = 0, out = out)
+    lines = [json.loads(l) for l in out.getvalue().splitlines()]
+    assert count == 3
+    assert [(l['stream'], l['message']) for l in lines] == [("i-1/app.log", "line b"), ("i-1/app.log", "line c"), ("i-2/app.log", "line a")]
+    assert set(c['end'] for c in logs.calls) == set([1000])
+
+def test_throttled_first_page_is_read_before_returning():
+    logs = FakeLogs([[event("a", 100), event("b", 200), event("c", 300)]], throttle_calls = [1, 2])
+    out = io.StringIO()
+    count = tail_logs(logs, "group", 0, follow = False, min_delay = 0, max_delay = 0, out = out)
+    assert count == 3
+    assert [l.split()[-1] for l in out.getvalue().splitlines()] == ["a", "b", "c"]
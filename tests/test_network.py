@@ -0,0 +1,71 @@
+import pytest
+from create.network import compact_rules, compact_sg_rules
+
+
+def test_compact_rules_is_equivalent_and_keeps_order():
+    rules = [
+        ("10.0.0.0/24", "443"),
+        ("10.0.0.0/24", 80),
+        ("10.0.0.0/24", "80"),
+        ("10.0.0.0/24", "81:90"),
+        ("10.0.1.0/24", "443"),
+        ("10.0.0.0/24", "53/udp"),
+        ("10.0.0.0/24", "53/udp"),
+        ("sg-123", "443"),
+        ("10.0.0.0/24", "8/icmp"),
+        ("10.0.0.0/24", "8/icmp"),
+        ("10.0.5.0/24", "1000:2000"),
+        ("10.0.5.0/24", "1500"),
+    ]
+    assert compact_rules(rules) == [
+        ("10.0.0.0/23", "443"),
+        ("10.0.0.0/24", "80:90/tcp"),
+        ("10.0.0.0/24", "53/udp"),
+        ("sg-123", "443"),
+        ("10.0.0.0/24", "8/icmp"),
+        ("10.0.5.0/24", "1000:2000"),
+    ]
+
+def test_rule_limit_checked_after_compaction():
+    rules = [("10.0.{}.0/24".format(i), p) for i in range(0, 40, 2) for p in ["22", "80", "443", "8080"]]
+    assert len(compact_sg_rules("Sg", "ingress", rules, limit = 80)) == 80
+    with pytest.raises(ValueError) as e:
+        compact_sg_rules("Sg", "ingress", rules + [("10.0.1.0/24", "22")], limit = 60)
+    assert "Security group Sg has 80 ingress rules after compaction, more than the limit of 60" in str(e.value)
+
+def acl_entries(template):
+    return dict((name, r.to_dict()['Properties']) for name, r in template.resources.items()
+        if r.resource_type == "AWS::EC2::NetworkAclEntry")
+
+def test_acl_rule_numbers_stable_when_networks_change():
+    from troposphere import Template, Ref
+    from create.network import acl_add_networks
+
+    def entries(networks):
+        template = Template()
+        acl_add_networks(template, "Rules", Ref("Nacl"), networks)
+        acl_add_networks(template, "Imported", Ref("Nacl"), networks[:1], band = "imported")
+        return acl_entries(template)
+
+    before = entries(["10.0.1.0/24", "10.0.2.0/24"])
+    after  = entries(["10.0.0.0/24", "10.0.2.0/24", "10.0.1.0/24", "10.0.1.0/24"])
+    assert len(after) == len(before) + 2
+    for name, props in before.items():
+        if name.startswith("Rules"):
+            assert after[name] == props
+        else:
+            assert 10000 <= props['RuleNumber'] <= 19999
+
+def test_acl_planner_probes_collisions():
+    from create.network import AclPlanner, acl_bands
+    acl_bands['tiny'] = (1, 3)
+    try:
+        planner = AclPlanner()
+        numbers = [planner.plan("acl", False, str(i), "tiny") for i in range(3)]
+        assert sorted(n for n, new in numbers) == [1, 2, 3]
+        assert planner.plan("acl", 'false', "1", "tiny") == (numbers[1][0], False)
+        assert planner.plan("acl", True, "1", "tiny")[1]
+        with pytest.raises(ValueError):
+            planner.plan("acl", False, "3", "tiny")
+    finally:
+        del acl_bands['tiny']
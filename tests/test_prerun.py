@@ -0,0 +1,53 @@
+import time
+from collections import OrderedDict
+import create.prerun
+
+calls = []
+
+def slow_lookup(name, dry_run):
+    calls.append((name, dry_run))
+    time.sleep(0.2)
+    return "value-" + name
+
+class Template(object):
+    def add_mapping(self, name, mapping):
+        self.mappings = {name: mapping}
+
+
+def item(name, **extra):
+    return dict(var_export = name, function = __name__ + ".slow_lookup", function_args = dict(name = name), **extra)
+
+def test_items_run_concurrently_in_config_order(tmpdir, monkeypatch):
+    monkeypatch.setenv("GO_TROPO_CACHE_DIR", str(tmpdir))
+    create.prerun.configure()
+    del calls[:]
+    template = Template()
+    start = time.time()
+    create.prerun.call(template, OrderedDict([("first_item", item("a")), ("second_item", item("b")), ("third", item("c"))]), True)
+    assert time.time() - start < 0.5
+    assert list(template.mappings['PrerunValues'].items()) == [
+        ("first-item", dict(ReturnString = "value-a")),
+        ("second-item", dict(ReturnString = "value-b")),
+        ("third", dict(ReturnString = "value-c")),
+    ]
+
+def test_cache_ttl_and_refresh(tmpdir, monkeypatch):
+    monkeypatch.setenv("GO_TROPO_CACHE_DIR", str(tmpdir))
+    create.prerun.configure()
+    del calls[:]
+    cached   = item("a", cache_ttl = 60)
+    uncached = item("b")
+    for i in range(2):
+        create.prerun.call(Template(), dict(cached = cached, uncached = uncached), True)
+    assert sorted(calls) == [("a", True), ("b", True), ("b", True)]
+
+    #A new process reads the results from disk, dry run and real runs are cached apart
+    create.prerun.configure()
+    create.prerun.run_item(cached, True)
+    create.prerun.run_item(cached, False)
+    assert calls.count(("a", True)) == 1
+    assert calls.count(("a", False)) == 1
+
+    create.prerun.configure(refresh = True)
+    assert create.prerun.run_item(cached, True) == "value-a"
+    assert calls.count(("a", True)) == 2
@@ -0,0 +1,33 @@
+import threading
+from create.profiling import Profiler
+
+
+def test_nested_spans_and_trace():
+    p = Profiler()
+    p.enabled = True
+    with p.span("deploy"):
+        with p.span("build"):
+            pass
+        parent = p.current_path()
+        def worker():
+            with p.span("stack", parent):
+                pass
+        t = threading.Thread(target = worker)
+        t.start()
+        t.join()
+
+    paths = [r['path'] for r in p.spans()]
+    assert paths == [("deploy",), ("deploy", "build"), ("deploy", "stack")]
+    summary = p.summary().splitlines()
+    assert summary[1].split()[3] == "deploy"
+    assert summary[2].split()[3] == "build"
+
+    events = [e for e in p.chrome_trace()['traceEvents'] if e['ph'] == "X"]
+    assert [e['name'] for e in events] == ["deploy", "build", "stack"]
+    assert len(set(e['tid'] for e in events)) == 2
+
+def test_disabled_records_nothing():
+    p = Profiler()
+    with p.span("deploy"):
+        pass
+    assert p.spans() == []
@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+from create.scheduler import stack_dependencies, run_stacks
+
+
+def export_template(*names):
+    return dict(Outputs = {n:dict(Value = "x", Export = dict(Name = n)) for n in names})
+
+def import_template(*names):
+    return dict(Resources = {n:dict(Properties = dict(Value = {"Fn::ImportValue": n})) for n in names})
+
+
+def test_stack_dependencies_from_exports():
+    templates = dict(
+        network = export_template("AppSubnet"),
+        rds     = import_template("AppSubnet", "ExternalValue"),
+        efs     = import_template("AppSubnet"),
+    )
+    deps = stack_dependencies(templates)
+    assert deps['network'] == set()
+    assert deps['rds'] == set(['network'])
+    assert deps['efs'] == set(['network'])
+
+def test_circular_dependency_raises():
+    a = export_template("A")
+    a.update(import_template("B"))
+    b = export_template("B")
+    b.update(import_template("A"))
+    try:
+        stack_dependencies(dict(a = a, b = b))
+    except ValueError:
+        return
+    raise AssertionError("Expected circular dependency error")
+
+def test_independent_stacks_run_in_parallel():
+    deps = dict(network = set(), rds = set(['network']), efs = set(['network']))
+    order = []
+    running = set()
+    overlap = []
+    lock = threading.Lock()
+
+    def exec_stack(name):
+        with lock:
+            order.append(name)
+            running.add(name)
+            if len(running) > 1:
+                overlap.append(set(running))
+        time.sleep(0.05)
+        with lock:
+            running.discard(name)
+
+    status = run_stacks(deps, exec_stack, max_workers = 4)
+    assert order[0] == 'network'
+    assert set(['rds', 'efs']) in overlap
+    assert all(s == "complete" for s in status.values())
+
+def test_failed_stack_skips_dependents():
+    deps = dict(network = set(), app = set(['network']), efs = set())
+
+    def exec_stack(name):
+        if name == 'network':
+            raise RuntimeError("stack failed")
+
+    status = run_stacks(deps, exec_stack, max_workers = 1)
+    assert status['network'] == "failed"
+    assert status['app'] == "skipped"
+    assert status['efs'] == "complete"
+
+def test_failure_skips_whole_chain_in_any_order():
+    #c depends on b which depends on a, with c listed before b
+    deps = OrderedDict([("a", set()), ("c", set(['b'])), ("b", set(['a']))])
+
+    def exec_stack(name):
+        raise RuntimeError("stack failed")
+
+    status = run_stacks(deps, exec_stack, max_workers = 1)
+    assert dict(status) == dict(a = "failed", b = "skipped", c = "skipped")
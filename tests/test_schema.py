@@ -0,0 +1,40 @@
+import pytest
+import create.config
+import create.schema
+
+
+def phpinfo_config(tmpdir, monkeypatch):
+    #Parse snapshots go to the test's cache, not ~/.cache/go_tropo
+    monkeypatch.setenv("GO_TROPO_CACHE_DIR", str(tmpdir.mkdir("cache")))
+    return create.config.parse("examples/phpinfo.yaml")
+
+def test_example_config_is_valid(tmpdir, monkeypatch):
+    assert create.schema.config_errors(phpinfo_config(tmpdir, monkeypatch), ["resources", "network", "app"]) == []
+
+def test_all_errors_reported_together(tmpdir, monkeypatch):
+    ops = phpinfo_config(tmpdir, monkeypatch)
+    del ops['deploy_bucket']
+    ops['app_networks']['az3'] = "10.1.0.300/28"
+    ops['asg_mem_alarm'] = dict(threshold_high = 60)
+    ops['app_prerun']['app_setup']['functon'] = "typo"
+    ops['tcpstacks'] = dict(
+        db = dict(stack_type = "mongodb", enabled = True, networks = dict(az1 = "10.1.1.0/28")),
+        web = dict(stack_type = "ec2", enabled = True, networks = dict(az1 = "10.1.2.0/28"), custom_rules = [],
+            instances = dict(one = dict(az = "az2"))),
+    )
+    errors = create.schema.config_errors(ops, ["network", "db"])
+
+    assert "deploy_bucket: required" in errors
+    assert "app_networks.az3: '10.1.0.300/28' is not a CIDR block" in errors
+    assert "app_networks: 'az3' is not defined in availability_zones" in errors
+    assert "asg_mem_alarm.comp_oper_low: required" in errors
+    assert "sns_topic_arn: required when asg_mem_alarm is set" in errors
+    assert any(e.startswith("app_prerun.app_setup.functon: not supported") for e in errors)
+    assert "tcpstacks.db.number_of_shards: required" in errors
+    assert "email_topic_arn: required by tcpstacks.db" in errors
+    assert "tcpstacks.web.instances.one.instance_size: required in the instance, its stack or the top of the config" in errors
+    assert "tcpstacks.web.instances.one.az: 'az2' has no network in tcpstacks.web.networks" in errors
+
+    with pytest.raises(ValueError) as e:
+        create.schema.validate(ops, ["network", "db"], "phpinfo.yaml")
+    assert "Invalid config phpinfo.yaml ({} errors)".format(len(errors)) in str(e.value)
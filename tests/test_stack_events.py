@@ -0,0 +1,90 @@
+import io
+import asyncio
+from create.stack_events import watch_stack, watch_stacks, StackFailed, StackWaitTimeout, latest_event_id
+
+
+class FakeCloudFormation(object):
+    """ Serves describe_stack_events from scripted batches, one batch added per call """
+    def __init__(self, stack_batches, page_size = 2):
+        self.stack_batches = stack_batches
+        self.events    = {name:[] for name in stack_batches}
+        self.page_size = page_size
+        self.calls     = 0
+
+    def describe_stack_events(self, StackName, NextToken = None):
+        self.calls += 1
+        if NextToken is None and self.stack_batches[StackName]:
+            self.events[StackName] = list(reversed(self.stack_batches[StackName].pop(0))) + self.events[StackName]
+        start = int(NextToken or 0)
+        end   = start + self.page_size
+        page  = dict(StackEvents = self.events[StackName][start:end])
+        if end < len(self.events[StackName]):
+            page['NextToken'] = str(end)
+        return page
+
+
+def event(stack_name, event_id, logical_id, status, resource_type = "AWS::EC2::Subnet"):
+    if logical_id == stack_name:
+        resource_type = "AWS::CloudFormation::Stack"
+    return dict(EventId = event_id, LogicalResourceId = logical_id, ResourceType = resource_type, ResourceStatus = status)
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_watch_stack_streams_until_complete():
+    cf = FakeCloudFormation(dict(app = [
+        [event("app", "1", "app", "CREATE_IN_PROGRESS")],
+        [],
+        [event("app", "2", "Subnet", "CREATE_IN_PROGRESS"), event("app", "3", "Subnet", "CREATE_COMPLETE")],
+        [event("app", "4", "app", "CREATE_COMPLETE")],
+    ]))
+    out = io.StringIO()
+    status = run(watch_stack(cf, "app", "stack_create_complete", since_event_id = None, min_delay = 0, out = out))
+    assert status == "CREATE_COMPLETE"
+    lines = out.getvalue().splitlines()[1:]
+    assert [l.split()[-1] for l in lines] == ["CREATE_IN_PROGRESS", "CREATE_IN_PROGRESS", "CREATE_COMPLETE", "CREATE_COMPLETE"]
+
+def test_watch_stack_fails_on_first_failed_resource():
+    cf = FakeCloudFormation(dict(app = [
+        [event("app", "1", "app", "UPDATE_IN_PROGRESS"), event("app", "2", "Asg", "UPDATE_FAILED")],
+        [event("app", "3", "app", "UPDATE_ROLLBACK_IN_PROGRESS")],
+    ]))
+    try:
+        run(watch_stack(cf, "app", "stack_update_complete", since_event_id = None, min_delay = 0, out = io.StringIO()))
+    except StackFailed as e:
+        assert "Asg" in str(e)
+        assert cf.stack_batches['app'], "rollback events should not have been read"
+        return
+    raise AssertionError("Expected StackFailed")
+
+def test_watch_stack_skips_events_already_seen():
+    cf = FakeCloudFormation(dict(app = [
+        [event("app", "1", "app", "CREATE_COMPLETE"), event("app", "2", "app", "UPDATE_IN_PROGRESS")],
+        [event("app", "3", "app", "UPDATE_COMPLETE")],
+    ]))
+    last_seen = latest_event_id(cf, "app")
+    out = io.StringIO()
+    status = run(watch_stack(cf, "app", "stack_update_complete", since_event_id = last_seen, min_delay = 0, out = out))
+    assert status == "UPDATE_COMPLETE"
+    assert len(out.getvalue().splitlines()) == 2
+
+def test_watch_many_stacks_from_one_loop():
+    cf = FakeCloudFormation(dict(
+        rds = [[], [], [event("rds", "r1", "rds", "CREATE_COMPLETE")]],
+        efs = [[event("efs", "e1", "efs", "CREATE_COMPLETE")]],
+    ))
+    statuses = run(watch_stacks(cf, [("rds", "stack_create_complete"), ("efs", "stack_create_complete")],
+        since_event_id = None, min_delay = 0, out = io.StringIO()))
+    assert statuses == ["CREATE_COMPLETE", "CREATE_COMPLETE"]
+
+def test_watch_stack_gives_up_after_max_wait():
+    #A stack left in REVIEW_IN_PROGRESS never sends another event
+    cf = FakeCloudFormation(dict(app = [[event("app", "1", "app", "REVIEW_IN_PROGRESS")]]))
+    try:
+        run(watch_stack(cf, "app", "stack_create_complete", since_event_id = None, min_delay = 0.01, max_wait = 0.1, out = io.StringIO()))
+    except StackWaitTimeout as e:
+        assert "did not reach stack_create_complete" in str(e)
+        assert cf.calls > 1
+        return
+    raise AssertionError("Expected StackWaitTimeout")
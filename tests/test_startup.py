@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+
+#Seconds allowed for importing the CLI in a fresh interpreter, GO_TROPO_STARTUP_BUDGET overrides
+default_budget = 0.2
+heavy_modules  = ["boto3", "botocore", "troposphere", "awacs", "create.stacks"]
+
+root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+probe = """
+import json, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+import bin.go_tropo
+elapsed = time.perf_counter() - start
+if len(sys.argv) > 1:
+    from click.testing import CliRunner
+    CliRunner().invoke(bin.go_tropo.go_tropo, sys.argv[1:])
+print(json.dumps(dict(elapsed = elapsed, modules = sorted(set(sys.modules) - before))))
+"""
+
+def run_probe(*args):
+    out = subprocess.check_output([sys.executable, "-c", probe] + list(args), cwd = root_path)
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+def loaded(modules, name):
+    return any(m == name or m.startswith(name + ".") for m in modules)
+
+def test_help_does_not_import_builders_or_clients():
+    for args in [[], ["--help"], ["deploy", "--help"], ["logs", "--help"]]:
+        modules = run_probe(*args)['modules']
+        assert [m for m in heavy_modules if loaded(modules, m)] == [], args
+
+def test_cold_import_within_budget():
+    budget = float(os.environ.get("GO_TROPO_STARTUP_BUDGET", default_budget))
+    elapsed = min(run_probe()['elapsed'] for _ in range(3))
+    assert elapsed < budget, "go_tropo import took {:.3f}s, budget {:.3f}s".format(elapsed, budget)
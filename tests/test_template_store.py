@@ -0,0 +1,76 @@
+from botocore.exceptions import ClientError
+from create.template_store import UploadManifest, upload_template_body, prune_templates, template_key
+
+
+class FakeS3(object):
+    def __init__(self):
+        self.objects = dict()
+        self.calls   = []
+
+    def head_object(self, Bucket, Key):
+        self.calls.append(("head", Key))
+        if Key not in self.objects:
+            raise ClientError(dict(Error = dict(Code = "404")), "HeadObject")
+
+    def put_object(self, Bucket, Key, Body):
+        self.calls.append(("put", Key))
+        self.objects[Key] = Body
+
+    def delete_objects(self, Bucket, Delete):
+        for o in Delete['Objects']:
+            self.calls.append(("delete", o['Key']))
+            self.objects.pop(o['Key'], None)
+
+
+def test_upload_checks_the_bucket_even_when_the_manifest_has_the_key(tmpdir):
+    s3 = FakeS3()
+    manifest = UploadManifest(str(tmpdir.join("manifest.json")))
+    key, uploaded = upload_template_body(s3, "bucket", "dev/app", "{}", manifest = manifest)
+    assert uploaded
+    assert upload_template_body(s3, "bucket", "dev/app", "{}", manifest = manifest) == (key, False)
+
+    #Pruned from another machine or expired by a lifecycle rule
+    del s3.objects[key]
+    assert upload_template_body(s3, "bucket", "dev/app", "{}", manifest = manifest) == (key, True)
+    assert key in s3.objects
+
+def test_prune_only_removes_old_templates_of_the_deploy_env(tmpdir):
+    s3 = FakeS3()
+    manifest = UploadManifest(str(tmpdir.join("manifest.json")))
+    for body in ["1", "2", "3"]:
+        upload_template_body(s3, "bucket", "dev/app", body, manifest = manifest)
+        upload_template_body(s3, "bucket", "prod/app", body + "p", manifest = manifest)
+    #prod still runs the first dev template
+    upload_template_body(s3, "bucket", "prod/app", "1", manifest = manifest)
+
+    stale = prune_templates(s3, "bucket", "dev", keep = 1, manifest = manifest)
+    assert stale == [template_key("2")]
+    assert template_key("1") in s3.objects
+    assert template_key("2p") in s3.objects
+
+def test_prune_leaves_templates_uploaded_elsewhere(tmpdir):
+    s3 = FakeS3()
+    #Another checkout uploaded the first template
+    s3.objects[template_key("1")] = "1"
+    manifest = UploadManifest(str(tmpdir.join("manifest.json")))
+    for body in ["1", "2", "3"]:
+        upload_template_body(s3, "bucket", "dev/app", body, manifest = manifest)
+    assert prune_templates(s3, "bucket", "dev", keep = 1, manifest = manifest) == [template_key("2")]
+    assert template_key("1") in s3.objects
+
+def test_manifests_saved_together_keep_each_others_entries(tmpdir):
+    path = str(tmpdir.join("manifest.json"))
+    first, second = UploadManifest(path), UploadManifest(path)
+    first.add_key("bucket", "templates/a.json", "dev/app", uploaded = True)
+    second.add_key("bucket", "templates/b.json", "dev/db", uploaded = True)
+    first.add_key("bucket", "templates/c.json", "dev/app", uploaded = True)
+    saved = UploadManifest(path).bucket("bucket")
+    assert sorted(saved['uploaded']) == ["templates/a.json", "templates/b.json", "templates/c.json"]
+    assert saved['stacks'] == {"dev/app": ["templates/c.json", "templates/a.json"], "dev/db": ["templates/b.json"]}
+
+    #A pruned key is not brought back by a manifest loaded before the prune
+    second.remove_keys("bucket", ["templates/a.json"])
+    first.add_key("bucket", "templates/d.json", "dev/web", uploaded = True)
+    saved = UploadManifest(path).bucket("bucket")
+    assert "templates/a.json" not in saved['uploaded']
+    assert saved['stacks']['dev/app'] == ["templates/c.json"]
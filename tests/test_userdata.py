@@ -0,0 +1,64 @@
+import base64
+import gzip
+import json
+import yaml
+from troposphere import Template, Output
+import create.ec2
+import create.template_store
+
+
+def cloud_config(userdata):
+    text = userdata.to_dict()['Fn::Base64']['Fn::Sub'][0]
+    return yaml.safe_load(text[len("#cloud-config\n"):])
+
+def test_compressed_userdata_writes_the_same_files():
+    options = dict(bash_files = ["create/userdata/awslog.sh"], sub_values = dict(LOG_GROUP = "logs"), enable_cre_disk_alarm = True)
+    plain      = create.ec2.multipart_userdata(**options)
+    compressed = create.ec2.multipart_userdata(compress = True, **options)
+    assert create.ec2.userdata_size(compressed.to_dict()) < create.ec2.userdata_size(plain.to_dict())
+
+    plain_files = dict((f['path'], f['content']) for f in cloud_config(plain)['write_files'])
+    for f in cloud_config(compressed)['write_files']:
+        if f.get('encoding') == create.ec2.compressed_encoding:
+            assert "${" not in plain_files[f['path']]
+            assert gzip.decompress(base64.b64decode(f['content'])).decode('utf8') == plain_files[f['path']]
+        else:
+            assert f['content'] == plain_files[f['path']]
+    #Compression is deterministic so unchanged userdata does not change the template
+    assert create.ec2.multipart_userdata(compress = True, **options).to_dict() == compressed.to_dict()
+
+def test_userdata_report_and_template_formats():
+    template_dict = dict(Resources = dict(
+        Lc   = dict(Type = "AWS::AutoScaling::LaunchConfiguration", Properties = dict(UserData = {"Fn::Base64": {"Fn::Sub": ["#!/bin/bash\n${A}", dict(A = "a")]}})),
+        Host = dict(Type = "AWS::EC2::Instance", Properties = dict(UserData = {"Fn::Base64": {"Fn::Join": ["", ["echo ", {"Ref": "X"}, "\n"]]}})),
+        Sg   = dict(Type = "AWS::EC2::SecurityGroup", Properties = dict(GroupDescription = "sg")),
+    ))
+    assert create.ec2.userdata_report(template_dict) == [("Lc", 16), ("Host", 6)]
+
+    compact = create.template_store.template_body(template_dict)
+    assert " " not in compact.replace("#!/bin/bash", "").replace("echo ", "")
+    assert json.loads(compact) == template_dict
+    assert json.loads(create.template_store.template_body(template_dict, "json")) == template_dict
+    #json is what deploy --dry-run and render printed before the formats were added
+    template = Template()
+    template.add_output(Output("Name", Value = "value"))
+    assert create.template_store.template_body(template.to_dict(), "json") == template.to_json()
+    assert yaml.safe_load(create.template_store.template_body(template_dict, "yaml")) == template_dict
+
+def test_cloud_config_rendered_once_per_file_contents(tmpdir):
+    script = tmpdir.join("setup.sh")
+    script.write("echo one\n")
+    create.ec2.cloud_config.cache_clear()
+    texts = set()
+    for i in range(10):
+        userdata = create.ec2.multipart_userdata(bash_files = [str(script)], sub_values = dict(resource_name = "Host{}".format(i)))
+        assert userdata.to_dict()['Fn::Base64']['Fn::Sub'][1] == dict(resource_name = "Host{}".format(i))
+        texts.add(userdata.to_dict()['Fn::Base64']['Fn::Sub'][0])
+    assert len(texts) == 1
+    assert create.ec2.cloud_config.cache_info().misses == 1
+
+    #An edited file is read and rendered again
+    script.write("echo two, a longer line\n")
+    changed = create.ec2.multipart_userdata(bash_files = [str(script)], sub_values = dict(resource_name = "Host0"))
+    assert "echo two" in changed.to_dict()['Fn::Base64']['Fn::Sub'][0]
+    assert create.ec2.cloud_config.cache_info().misses == 2